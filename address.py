@@ -0,0 +1,365 @@
+# coding: utf-8
+
+"""
+address.py
+
+居住地址解析及相似度, 依赖 jieba/sklearn/scipy, 由 pboc 在首次使用时加载
+"""
+
+import re
+import json
+from typing import List
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+import jieba
+from sklearn.feature_extraction.text import CountVectorizer
+from scipy.linalg import norm
+
+
+class Address(object):
+    """
+    province	string	是	省
+    city	string	是	市
+    district	string	是	区，可能为空字串
+    street	string	是	街道，可能为空字串
+    """
+    prefix = None
+    tail = None
+    province = None
+    city = None
+    district = None
+    street = None
+    detail = None
+
+    def __init__(self, *args):
+        if len(args) != 0:
+            self.province, self.city, self.district, self.street, self.detail = args
+
+    def value_count(self) -> List[int]:
+        prefix_cnt, tail_cnt, cnt = 0, 0, 0
+        if self.province is not None:
+            prefix_cnt += 1
+            cnt += 1
+        if self.city is not None:
+            prefix_cnt += 1
+            cnt += 1
+        if self.district is not None:
+            prefix_cnt += 1
+            cnt += 1
+        if self.street is not None:
+            tail_cnt += 1
+            cnt += 1
+        if self.detail is not None:
+            tail_cnt += 1
+            cnt += 1
+        return [prefix_cnt, tail_cnt, cnt]
+
+
+class Residence(object):
+    """
+    pass
+    """
+    residence_type = None
+    get_time = None
+    address = None
+    address_his = None
+
+    def __init__(self, *args):
+        if len(args) > 0:
+            self.residence_type, self.get_time, self.address = args
+            self.address_his = self.address
+        else:
+            self.address_his = []
+
+    def union(self, residence):
+        if isinstance(self.address_his, list):
+            self.address_his.append(residence.address)
+        else:
+            self.address_his = [self.address, residence.address]
+        if self.residence_type is None:
+            self.residence_type = residence.residence_type
+        if self.get_time is None:
+            self.get_time = residence.get_time
+        if self.address is None:
+            self.address = residence.address
+        return self
+
+
+def address_parse(address) -> Address:
+    """
+    居住地址解析
+    :param address:
+    :return:
+    """
+    #
+    address = re.sub('(^中国)|(--)|(待补充)|(UNKNOW)', '', address)
+    # model 1
+    province_pattern = '(?P<province>.*?省)?'
+    city_pattern = '(?P<city>.*?((自治州)|市(?!场)))?'
+    district_pattern = '(?P<district>(((.*[^社工业市\d一二三四五六七八九东南])区)|((.*?[^城])市)|(.*?县))?)'
+    prefix_pattern = '(?P<prefix>{0}{1}{2})'.format(province_pattern, city_pattern, district_pattern)
+    street_pattern = '(?P<street>((.+路(\d+号)?)|(.+[街道](\d+号)?)|(.*?[镇乡].*?村)))?'
+    detail_pattern = '(?P<detail>.*)'
+    tail_pattern = '(?P<tail>{0}{1})'.format(street_pattern, detail_pattern)
+    pattern = prefix_pattern + tail_pattern
+    rs = re.search(pattern, address)
+    add = Address()
+    prefix = rs.group('prefix')
+    tail = rs.group('tail')
+    province = rs.group('province')
+    city = rs.group('city')
+    district = rs.group('district')
+    street = rs.group('street')
+    detail = rs.group('detail')
+
+    address_prefix_detail_parse(prefix, add, **{'province': province, 'city': city, 'district': district})
+    address_tail_detail_parse(tail, add)
+    add.street = street
+    add.detail = detail
+
+    return add
+
+
+def address_cell_cmp(x1, x2) -> bool:
+    if x1 is None or x2 is None:
+        return True
+    else:
+        return x1 in x2 or x2 in x1
+
+
+def string_similarity(x1: str, x2: str) -> float:
+    def add_space(s: str):
+        return ' '.join(list(s))
+
+    # 将字中间加入空格
+    s1, s2 = add_space(x1), add_space(x2)
+    # 转化为TF矩阵
+    cv = CountVectorizer(tokenizer=lambda s: s.split())
+    corpus = [s1, s2]
+    vectors = cv.fit_transform(corpus).toarray()
+    # 计算TF系数
+    rs = np.dot(vectors[0], vectors[1]) / (norm(vectors[0]) * norm(vectors[1]))
+    return rs
+
+
+def address_cls(address: List[dict], sim_score: pd.DataFrame) -> List[dict]:
+    """
+    score > 8 即可视为一类
+    :param address:
+    :param sim_score:
+    :return:
+    """
+    cls = defaultdict(list)
+    cls_count = 0
+    cutoff = 8
+    for ii, row in sim_score.iterrows():
+        for jj, score in enumerate(row):
+            if jj < ii:
+                continue
+            find = False
+            if score >= cutoff:
+                for k, v in cls.items():
+                    if ii in v and jj not in v:
+                        v.append(jj)
+                        find = True
+                    elif ii not in v and jj in v:
+                        v.append(ii)
+                        find = True
+                    elif ii in v and jj in v:
+                        find = True
+            else:
+                for k, v in cls.items():
+                    if jj in v:
+                        find = True
+            if not find and jj == ii:
+                cls[cls_count].append(jj)
+                cls_count += 1
+
+    rs = []
+    for k, v in cls.items():
+        r = Residence()
+        for index in v:
+            add = address[index]
+            r = r.union(Residence(add.get('residenceType'), add.get('getTime'), add.get('address')))
+        rs.append(r.__dict__)
+    return rs
+
+
+def address_cls_v1(address: List[str]):
+    rs = defaultdict(list)
+    adds = address
+    cls_counter = 0
+    cls = [None] * len(adds)
+    cutoff = 8
+    for ii, add1 in enumerate(adds):
+        for jj, add2 in enumerate(adds):
+            if jj < ii:
+                continue
+            if cls[jj] is not None:
+                continue
+            if jj == ii:
+                cls[jj] = cls_counter
+                rs[cls_counter].append(address[jj])
+                cls_counter += 1
+                continue
+            score = int(string_similarity(add1, add2) * 10)
+            if score > cutoff:
+                cls[jj] = cls[ii]
+                rs[cls[ii]].append(address[jj])
+    return rs
+
+
+def address_vague_match(address: str, adds: List[str], num: int = 1) -> List[str]:
+    """
+    地址模糊匹配
+    :param address:
+    :param adds:
+    :param num: 若num==-1,返回所有匹配成功的结果,否则返回指定数量的结果
+    :return:
+    """
+    cutoff = 7
+    matched_address, final_matched_address = [], []
+    final_matched_counter = 0
+    for ii, add in enumerate(adds):
+        score = int(string_similarity(address, add) * 10)
+        if score >= cutoff:
+            matched_address.append(add)
+    print(json.dumps(matched_address, ensure_ascii=False, indent=4))
+    matched_address = [address_parse(add) for add in matched_address]
+    parsed_add = address_parse(address)
+    for ii, add in enumerate(matched_address):
+        prefix_score, tail_score = address_match_score(parsed_add, add)
+        final_matched_address.append((add.prefix + add.tail, tail_score))
+        if prefix_score >= 3 and tail_score >= 0.75:
+            # final_matched_address.append((add.prefix + add.tail, tail_score))
+            final_matched_counter += 1
+    final_matched_address = sorted(final_matched_address, key=lambda x: x[1], reverse=True)
+    print(json.dumps(final_matched_address, ensure_ascii=False, indent=4))
+    final_matched_address = [v[0] for v in final_matched_address]
+    return final_matched_address if num == -1 else final_matched_address[:num]
+
+
+def address_match_score(address1: Address, address2: Address):
+    """
+    地址匹配相似的得分
+    :param address1:
+    :param address2:
+    :return:
+    """
+    score = 0
+    if address_cell_cmp(address1.province, address2.province):
+        score += 1
+    if address_cell_cmp(address1.city, address2.city):
+        score += 1
+    if address_cell_cmp(address1.district, address2.district):
+        score += 1
+    return score, string_similarity(address1.tail, address2.tail)
+
+
+def address_cell_fill(add: Address, p: str, index: int) -> Address:
+    if '省' in p or '自治区' in p:
+        add.province = p if add.province is None else add.province
+    if '市' in p or '自治州' in p:
+        if index < 2:
+            add.city = p if add.city is None else add.city
+    if '区' in p or '县' in p:
+        add.district = p if add.district is None else add.district
+    return add
+
+
+def address_tail_detail_parse(tail: str, add: Address) -> Address:
+    """
+    区县级以下具体地址解构
+    :param tail:
+    :param add:
+    :return:
+    """
+    add.tail = tail
+    return add
+
+
+def fix_jieba_over_cut(prefix_lst: List[str], **kwargs) -> List[str]:
+    lst = []
+    province, city, district = kwargs.get('province'), kwargs.get('city'), kwargs.get('district')
+    for ii, p in enumerate(prefix_lst):
+        match = False
+        for c in ['市', '区', '县', '新区']:
+            # 过度分词
+            if p == c:
+                lst[-1] = lst[-1] + p
+                match = True
+                break
+        if match:
+            continue
+        for c in ['镇', '村', '乡', '街道', '路', '号']:
+            # 过度匹配
+            if p.endswith(c):
+                lst.pop()
+                match = True
+                break
+        if match:
+            continue
+        for jj, n in enumerate(lst):
+            # 词重复
+            if n in p:
+                lst[jj] = p
+                match = True
+                break
+            elif p in n:
+                match = True
+                break
+        if not match:
+            lst.append(p)
+    if len(lst) > 3:
+        last = ''.join(lst[2:])
+        lst = lst[:2] + [last]
+    return lst
+
+
+def address_prefix_detail_parse(prefix: str, add: Address, **kwargs) -> Address:
+    """
+    区县级以上地址解构
+    :param prefix:
+    :param add:
+    :return:
+    """
+    if len(prefix) == 0:
+        return
+    prefix_lst = list(jieba.cut(prefix))
+    prefix_lst = fix_jieba_over_cut(prefix_lst, **kwargs)
+    if ''.join(prefix_lst) != prefix:
+        prefix = ''.join(prefix_lst)
+        prefix_lst = list(jieba.cut(prefix))
+        prefix_lst = fix_jieba_over_cut(prefix_lst)
+    for ii, p in enumerate(prefix_lst):
+        address_cell_fill(add, p, ii)
+    prefix_value_count = add.value_count()[0]
+    if len(prefix_lst) == 3 and prefix_value_count < 3:
+        if add.province is None:
+            add.province = prefix_lst[0]
+        if add.city is None:
+            add.city = prefix_lst[1]
+        if add.district is None:
+            add.district = prefix_lst[2]
+    elif len(prefix_lst) == 1 and prefix_value_count < 1:
+        if add.district is None:
+            add.district = prefix_lst[0]
+    elif len(prefix_lst) == 2 and prefix_value_count < 2:
+        if add.city is None:
+            add.city = prefix_lst[0]
+        else:
+            if prefix_lst.index(add.city) == 0:
+                add.district = prefix_lst[1]
+            else:
+                add.province = prefix_lst[0]
+    elif len(prefix_lst) > 3:
+        print('位置情况: {0}'.format(prefix))
+        if add.district is not None:
+            add.district = prefix
+    if add.district is not None and '市' in add.district:
+        add.city = add.district
+        add.district = None
+    add.prefix = prefix
+    return add
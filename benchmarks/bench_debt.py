@@ -0,0 +1,195 @@
+# coding: utf-8
+"""
+负债变量的微基准: 原逐行 apply 的 debt_variables vs 按列计算的 debt_features
+
+Usage:
+  bench_debt.py <json_dir> [--number=<n>]
+
+Options:
+  <json_dir>      解析后的json报告目录
+  --number=<n>    每份报告重复计算的次数 [default: 20]
+"""
+
+import os
+import sys
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from docopt import docopt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import pboc  # noqa: E402
+
+
+def loan_debt_cal_logic(x, type_=1):
+    """ 原逐行实现, 作为对照 """
+    if x['settle_type'] == 'stl' or x['balance'] == 0:
+        return 0
+    if type_ == 1:
+        if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0:
+            if x['balance'] * 2 > x['scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
+                return x['scheduledPaymentAmount']
+            else:
+                return x['credit_limit'] / x['loan_terms']
+        elif not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] == 0:
+            if not pd.isnull(x['loan_terms']):
+                return x['credit_limit'] / x['loan_terms']
+            else:
+                return x['credit_limit'] / int((pboc.get_time(x['end_date']) - pboc.get_time(x['openDate'])).days / 30)
+        elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0:
+            if x['credit_limit'] * 2 > x['scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
+                return x['scheduledPaymentAmount']
+            else:
+                return x['credit_limit'] / x['loan_terms']
+        else:
+            if not pd.isnull(x['loan_terms']):
+                return x['credit_limit'] / x['loan_terms']
+            elif not pd.isnull(x['end_date']):
+                return x['credit_limit'] / int((pboc.get_time(x['end_date']) - pboc.get_time(x['openDate'])).days / 30)
+            return x['credit_limit'] * 0.035
+    elif type_ == 2:
+        if x['loan_type'] == '抵押担保':
+            if x['scheduledPaymentAmount'] != 0:
+                return x['scheduledPaymentAmount']
+            else:
+                return x['credit_limit'] / x['loan_terms']
+        else:
+            if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0:
+                if x['scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
+                    return x['scheduledPaymentAmount']
+                else:
+                    return x['credit_limit'] * 0.035
+    elif type_ == 3:
+        if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['balance'] * 2 > x[
+            'scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
+            return x['scheduledPaymentAmount']
+        elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['credit_limit'] * 2 > x[
+            'scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
+            return x['scheduledPaymentAmount']
+        else:
+            if '银行' in x['loan_from']:
+                if pd.isnull(x['loan_terms']):
+                    return x['credit_limit'] * 0.035
+                if x['loan_terms'] <= 12:
+                    return x['credit_limit'] * 0.09
+                elif x['loan_terms'] <= 35:
+                    return x['credit_limit'] * 0.049
+                else:
+                    return x['credit_limit'] * 0.035
+            else:
+                if pd.isnull(x['loan_terms']):
+                    return x['credit_limit'] * 0.04
+                if x['loan_terms'] <= 12:
+                    return x['credit_limit'] * 0.095
+                elif x['loan_terms'] <= 35:
+                    return x['credit_limit'] * 0.053
+                else:
+                    return x['credit_limit'] * 0.04
+
+
+def loan_debt_cls(x):
+    if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['balance'] * 2 > x[
+        'scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
+        return 'bank_period' if '银行' in x['loan_from'] else 'nbank_period'
+    elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['credit_limit'] * 2 > x[
+        'scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
+        return 'bank_period' if '银行' in x['loan_from'] else 'nbank_period'
+    else:
+        return 'bank_nperiod' if '银行' in x['loan_from'] else 'nbank_nperiod'
+
+
+def credit_card_debt_cal_logic(x):
+    return x['used_credit_limit'] * 0.1 if x['accountState'] == '正常' else 0
+
+
+def pboc_debt_loan(loan_df, loan_card, standard_loan_card, type_=1):
+    debt_sum = 0
+    simple_debt_sum = 0
+    features = dict()
+
+    ldf = loan_df.copy()
+    if len(ldf) != 0:
+        ldf['debt_sum'] = ldf.apply(lambda x: loan_debt_cal_logic(x, type_=type_), axis=1)
+        ldf['debt_cls'] = ldf.apply(lambda x: loan_debt_cls(x), axis=1)
+        ldf['simple_debt_sum'] = ldf.apply(lambda x: loan_debt_cal_logic(x, type_=2), axis=1)
+        debt_sum = np.sum(ldf['debt_sum'])
+        simple_debt_sum = np.sum(ldf['simple_debt_sum'])
+        rs = ldf.groupby(['debt_cls'])['debt_sum'].sum()
+        for ix in rs.index:
+            features['pboc_debt_ln_{0}'.format(ix)] = rs[ix]
+    if len(loan_card) != 0:
+        loan_card = loan_card.drop_duplicates(['account']).copy()
+        rs9 = np.sum(loan_card.apply(credit_card_debt_cal_logic, axis=1))
+        features['pboc_debt_loan_card'] = rs9
+        debt_sum += rs9
+        simple_debt_sum += rs9
+    if len(standard_loan_card) != 0:
+        standard_loan_card = standard_loan_card.drop_duplicates(['account']).copy()
+        rs10 = np.sum(standard_loan_card.apply(credit_card_debt_cal_logic, axis=1))
+        features['pboc_debt_standard_loan_card'] = rs10
+        debt_sum += rs10
+        simple_debt_sum += rs10
+
+    return round(debt_sum, 2), round(simple_debt_sum, 2), features
+
+
+def legacy_debt_variables(entity):
+    """ 原实现: 三次 pboc_debt_loan, 每次逐行 apply """
+    features = dict()
+    loan_df = entity.loan_detail.copy()
+    loan_card = entity.credit_card_detail.copy()
+    standard_loan_card = entity.standard_credit_card_detail.copy()
+    features['pboc_debt_loan_001'], features['pboc_debt_loan_002'], _ = pboc_debt_loan(loan_df, loan_card,
+                                                                                       standard_loan_card)
+    loan_df = entity.loan_detail.copy().drop_duplicates(['account'])
+    ld1 = loan_df[loan_df.apply(pboc.debt_type_check, axis=1)]
+    ld2 = loan_df[loan_df.apply(pboc.debt_type_check_v1, axis=1)]
+    features['pboc_debt_loan_003'] = pboc_debt_loan(ld1, loan_card, standard_loan_card, type_=1)[0]
+    features['pboc_debt_loan_004'], _, loan_features = pboc_debt_loan(ld2, loan_card, standard_loan_card, type_=3)
+    features.update(loan_features)
+    return features
+
+
+def load_entities(json_dir):
+    entities = []
+    for fl in sorted(os.listdir(json_dir)):
+        if not fl.endswith('.json'):
+            continue
+        with open(os.path.join(json_dir, fl), encoding='utf-8') as f:
+            entities.append(pboc.PBOCEntity(json.load(f), _type=1))
+    return entities
+
+
+def bench(func, entities, number):
+    """
+    :return: 每份报告的平均耗时(毫秒)
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        for entity in entities:
+            func(entity)
+    return (time.perf_counter() - start) / (number * len(entities)) * 1000
+
+
+def main(json_dir, number=20):
+    entities = load_entities(json_dir)
+    if not entities:
+        print('没有可用的报告')
+        return
+    for entity in entities:
+        expected, actual = legacy_debt_variables(entity), pboc.debt_variables(entity)
+        assert list(expected) == list(actual) and all(expected[k] == actual[k] for k in expected), (expected, actual)
+    legacy = bench(legacy_debt_variables, entities, number)
+    vectorized = bench(pboc.debt_variables, entities, number)
+    loans = sum(len(entity.loan_detail) for entity in entities)
+    print('reports: {0}, loan rows: {1}, number: {2}'.format(len(entities), loans, number))
+    print('legacy     : {0:.3f} ms/report'.format(legacy))
+    print('vectorized : {0:.3f} ms/report ({1:.2f}x)'.format(vectorized, legacy / vectorized))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['<json_dir>'], int(args['--number']))
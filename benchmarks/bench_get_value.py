@@ -0,0 +1,132 @@
+# coding: utf-8
+"""
+报文取值的微基准: 原递归实现的 get_value vs 预编译路径的 compile_path
+
+Usage:
+  bench_get_value.py [<json_dir>] [--number=<n>]
+
+Options:
+  <json_dir>      解析后的json报告目录, 在其中的账户上取值; 不提供则使用内置样例
+  --number=<n>    重复取值的轮数 [default: 200]
+"""
+
+import os
+import sys
+import json
+import time
+from pathlib import Path
+
+from docopt import docopt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import pboc  # noqa: E402
+
+# get_loan_or_credit_detail 中逐账户取值的路径及默认值
+PATHS = [
+    ('statements', None), ('overdueRecord', {}), ('latest24Date', None), ('latest24State', None),
+    ('overdueRecord,overdueRecordDetail', None), ('overdueRecordDetail,0,month', None),
+    ('currOverdueCyc', '0'), ('currOverdueAmount', '0'), ('overdue31To60Amount', '0'), ('overdue61To90Amount', '0'),
+    ('overdue91To180Amount', '0'), ('overdueOver180Amount', '0'), ('scheduledPaymentAmount', '0'),
+    ('actualPaymentAmount', '0'), ('remainPaymentCyc', '0'), ('scheduledPaymentDate', None), ('class5State', None),
+    ('state', '正常'), ('usedCreditLimitAmount', '0'), ('usedHighestAmount', '0'),
+    ('latest6MonthUsedAvgAmount', '0'), ('balance', '0'), ('currOverdue,currOverdueAmount', 0),
+]
+SAMPLES = [
+    {'statements': '1.2018年07月07日中国银行发放的440,000元（人民币）个人住房贷款', 'class5State': '正常',
+     'balance': '401,223', 'scheduledPaymentAmount': '2,850', 'scheduledPaymentDate': '2019.09.07',
+     'latest24Date': '2017.10-2019.09', 'latest24State': '/NNNNNNNNNNNNNNNNNNN1NNN', 'remainPaymentCyc': '--',
+     'overdueRecord': {'overdueRecordDetail': [{'month': '2019.05', 'lastMonths': '1', 'amount': '2,850'}]}},
+    {'statements': '2.2014年12月04日中国银行发放的贷记卡（人民币账户）', 'state': '', 'usedCreditLimitAmount': '0',
+     'latest24State': '', 'overdueRecord': {}},
+]
+
+
+def legacy_get_value(key_str, obj, default=None):
+    """ 原递归实现, 作为对照 """
+
+    def g_val(key_, obj_):
+        val = None
+        if isinstance(obj_, str):
+            obj_ = json.loads(obj_)
+        elif isinstance(obj_, bytes):
+            obj_ = json.loads(str(obj, encoding="utf8"))
+        if isinstance(obj_, list):
+            val = obj_[key_]
+        elif isinstance(obj_, dict):
+            val = obj_.get(key_)
+        return default if pboc.empty_judge(val) else val
+
+    if pboc.empty_judge(obj):
+        return default
+    key_lst = key_str.split(',')
+    try:
+        key = int(key_lst[0])
+    except ValueError:
+        key = key_lst[0]
+    tp_obj = g_val(key, obj)
+    if len(key_lst) <= 1 or pboc.empty_judge(tp_obj):
+        return tp_obj
+    else:
+        return legacy_get_value(','.join(key_lst[1:]), tp_obj, default)
+
+
+def load_accounts(json_dir):
+    """
+    从解析后的json报告中抽取贷款/贷记卡账户
+    :param json_dir:
+    :return: [dict]
+    """
+    accounts = []
+    for fl in sorted(os.listdir(json_dir)):
+        if not fl.endswith('.json'):
+            continue
+        with open(os.path.join(json_dir, fl), encoding='utf-8') as f:
+            obj = json.load(f)
+        for context in ('loan', 'loanCard', 'standardLoanCard'):
+            accounts.extend(pboc.get_value('creditDetail,{0}'.format(context), obj, []))
+    return accounts
+
+
+def bench(func, accounts, number):
+    """
+    :return: 每次取值的平均耗时(微秒)
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        for li in accounts:
+            for path, default in PATHS:
+                func(path, li, default)
+    return (time.perf_counter() - start) / (number * len(accounts) * len(PATHS)) * 1e6
+
+
+def bench_compiled(accounts, number):
+    """路径在循环外编译好, 与热点代码中持有 getter 的用法一致"""
+    getters = [(pboc.compile_path(path), default) for path, default in PATHS]
+    start = time.perf_counter()
+    for _ in range(number):
+        for li in accounts:
+            for getter, default in getters:
+                getter(li, default)
+    return (time.perf_counter() - start) / (number * len(accounts) * len(PATHS)) * 1e6
+
+
+def main(json_dir=None, number=200):
+    accounts = load_accounts(json_dir) if json_dir else SAMPLES
+    if not accounts:
+        print('没有可用的账户')
+        return
+    for li in accounts:
+        for path, default in PATHS:
+            assert legacy_get_value(path, li, default) == pboc.get_value(path, li, default), (path, li)
+    legacy = bench(legacy_get_value, accounts, number)
+    wrapped = bench(pboc.get_value, accounts, number)
+    compiled = bench_compiled(accounts, number)
+    print('accounts: {0}, paths: {1}, number: {2}'.format(len(accounts), len(PATHS), number))
+    print('legacy     : {0:.3f} us/lookup'.format(legacy))
+    print('get_value  : {0:.3f} us/lookup ({1:.2f}x)'.format(wrapped, legacy / wrapped))
+    print('compiled   : {0:.3f} us/lookup ({1:.2f}x)'.format(compiled, legacy / compiled))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['<json_dir>'], int(args['--number']))
@@ -0,0 +1,86 @@
+# coding: utf-8
+"""
+模块导入耗时及内存的基准: 每个语句在新的解释器中执行, 输出导入耗时的中位数及进程的最大RSS
+
+Usage:
+  bench_import.py [--number=<n>] [--top=<n>]
+
+Options:
+  --number=<n>    每个语句重复启动解释器的次数 [default: 5]
+  --top=<n>       输出 import pboc 时累计耗时最多的模块数(python -X importtime), 0为不输出 [default: 10]
+"""
+
+import sys
+import json
+import statistics
+import subprocess
+from pathlib import Path
+
+from docopt import docopt
+
+ROOT = str(Path(__file__).resolve().parent.parent)
+STATEMENTS = [
+    ('python', 'pass'),
+    ('import tojson', 'import tojson'),
+    ('import pboc', 'import pboc'),
+    ('import pboc + address', 'import pboc; pboc.address_parse'),
+]
+CHILD = '''
+import sys, json, time, resource
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+{stmt}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss]))
+'''
+
+
+def run_once(stmt):
+    """
+    :return: (导入耗时(秒), 最大RSS(KB))
+    """
+    out = subprocess.run([sys.executable, '-c', CHILD.format(root=ROOT, stmt=stmt)], check=True,
+                         capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def import_time_top(module, top):
+    """
+    python -X importtime 中由 module 直接导入、累计耗时最多的模块
+    :return: [(模块, 累计耗时(毫秒))]
+    """
+    code = 'import sys; sys.path.insert(0, {0!r}); import {1}'.format(ROOT, module)
+    err = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], check=True, capture_output=True,
+                         text=True).stderr
+    rows, children = [], []
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # 模块名前按嵌套层级缩进两个空格, 子模块先于父模块输出
+        name = name[1:]
+        depth = (len(name) - len(name.lstrip(' '))) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1000.))
+        elif depth == 0:
+            if name == module:
+                rows = children
+            children = []
+    return sorted(rows, key=lambda x: -x[1])[:top]
+
+
+def main(number=5, top=10):
+    print('{0:<28}{1:>12}{2:>12}'.format('statement', 'p50(ms)', 'rss(MB)'))
+    for name, stmt in STATEMENTS:
+        runs = [run_once(stmt) for _ in range(number)]
+        print('{0:<28}{1:>12.1f}{2:>12.1f}'.format(name, statistics.median(v[0] for v in runs) * 1000,
+                                                   max(v[1] for v in runs) / 1024.))
+    if top > 0:
+        print('\nimport pboc, 累计耗时最多的模块:')
+        for name, ms in import_time_top('pboc', top):
+            print('{0:<40}{1:>10.1f} ms'.format(name, ms))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--number']), int(args['--top']))
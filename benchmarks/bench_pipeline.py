@@ -0,0 +1,131 @@
+# coding: utf-8
+"""
+docx -> json -> bom 全流程的基准测试
+在合成报告上调用 tojson.to_dict 及 pboc.pboc_bom, 按 instrument 登记的阶段计时,
+输出各阶段的 p50/p95 及每秒处理的报告数, 可保存为基线并与基线比较
+
+Usage:
+  bench_pipeline.py [--corpus=<dir>] [--sizes=<sizes>] [--densities=<densities>] [--seeds=<n>] [--repeat=<n>]
+                    [--save=<file>] [--baseline=<file>] [--tolerance=<pct>]
+
+Options:
+  --corpus=<dir>            合成报告目录, 不存在的报告会先生成, 默认为 benchmarks/corpus
+  --sizes=<sizes>           贷款/贷记卡账户数 [default: 0,10,50,200]
+  --densities=<densities>   逾期比例 [default: 0,0.1,0.3]
+  --seeds=<n>               每种组合的报告份数 [default: 1]
+  --repeat=<n>              每份报告重复解析的次数 [default: 3]
+  --save=<file>             结果保存为基线文件(json)
+  --baseline=<file>         与基线文件比较
+  --tolerance=<pct>         p50 比基线慢超过该百分比视为退化, 有退化时返回码为1 [default: 20]
+"""
+
+import sys
+import json
+import time
+import platform
+from pathlib import Path
+from collections import defaultdict
+
+import numpy as np
+from docopt import docopt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import tojson  # noqa: E402
+import pboc  # noqa: E402
+import instrument  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def run_report(word_file, samples):
+    """
+    解析一份报告, 由 instrument 记录 tojson.to_dict 与 pboc.pboc_bom 中各阶段的耗时
+    :param word_file:
+    :param samples: {阶段: [耗时(秒)]}, 追加本次各阶段的耗时
+    :return: bom
+    """
+    with instrument.collect(Path(word_file).name) as stats:
+        bom = pboc.pboc_bom(tojson.to_dict(word_file))
+    for stage, st in stats.stages.items():
+        samples[stage].append(st['seconds'])
+    return bom
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if samples else 0.
+
+
+def summarize(samples, n_reports, elapsed):
+    """
+    :return: {'stages': {stage: {'p50': ms, 'p95': ms, 'n': n}}, 'reports_per_sec': x}
+    """
+    stages = {}
+    for stage, v in samples.items():
+        stages[stage] = {'p50': round(percentile_ms(v, 50), 3), 'p95': round(percentile_ms(v, 95), 3), 'n': len(v)}
+    return {'stages': stages, 'reports_per_sec': round(n_reports / elapsed, 3) if elapsed > 0 else 0.}
+
+
+def compare(result, baseline, tolerance):
+    """
+    与基线比较各阶段的 p50
+    :return: 退化的阶段
+    """
+    regressions = []
+    keys = ('sizes', 'densities', 'seeds')
+    if any(result['meta'].get(k) != baseline.get('meta', {}).get(k) for k in keys):
+        print('注意: 基线使用的报告集合不同, 比较结果仅供参考')
+    print('\n{0:<28}{1:>12}{2:>12}{3:>10}'.format('stage', 'base p50', 'p50', 'ratio'))
+    for stage, v in result['stages'].items():
+        base = baseline['stages'].get(stage)
+        if base is None or base['p50'] == 0:
+            print('{0:<28}{1:>12}{2:>12.3f}{3:>10}'.format(stage, '-', v['p50'], '-'))
+            continue
+        ratio = v['p50'] / base['p50']
+        flag = ''
+        if ratio > 1 + tolerance / 100.:
+            regressions.append(stage)
+            flag = ' !'
+        print('{0:<28}{1:>12.3f}{2:>12.3f}{3:>10.2f}{4}'.format(stage, base['p50'], v['p50'], ratio, flag))
+    print('reports/sec: {0} -> {1}'.format(baseline.get('reports_per_sec'), result['reports_per_sec']))
+    return regressions
+
+
+def main(corpus, sizes, densities, seeds=1, repeat=3, save=None, baseline=None, tolerance=20.):
+    files = synthetic.make_corpus(corpus, sizes, densities, seeds)
+    samples = defaultdict(list)
+    report_totals = defaultdict(list)
+    n_reports = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for word_file in files:
+            t = time.perf_counter()
+            run_report(word_file, samples)
+            report_totals[Path(word_file).name].append(time.perf_counter() - t)
+            n_reports += 1
+    elapsed = time.perf_counter() - start
+    result = summarize(samples, n_reports, elapsed)
+    result['reports'] = {name: round(percentile_ms(v, 50), 3) for name, v in report_totals.items()}
+    result['meta'] = {'python': platform.python_version(), 'repeat': repeat, 'sizes': sizes, 'densities': densities,
+                      'seeds': seeds, 'created': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+    print('{0:<28}{1:>12}{2:>12}'.format('stage', 'p50(ms)', 'p95(ms)'))
+    for stage, v in result['stages'].items():
+        print('{0:<28}{1:>12.3f}{2:>12.3f}'.format(stage, v['p50'], v['p95']))
+    print('reports: {0}, elapsed: {1:.2f}s, reports/sec: {2}'.format(n_reports, elapsed, result['reports_per_sec']))
+
+    if save:
+        with open(save, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), tolerance)
+        if regressions:
+            print('退化的阶段: {0}'.format(','.join(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    sys.exit(main(args['--corpus'] or str(Path(__file__).resolve().parent / 'corpus'), synthetic.parse_list(args['--sizes'], int),
+                  synthetic.parse_list(args['--densities']), int(args['--seeds']), int(args['--repeat']),
+                  args['--save'], args['--baseline'], float(args['--tolerance'])))
@@ -0,0 +1,68 @@
+# coding: utf-8
+"""
+解析结果及bom序列化的基准: 比较各序列化后端每份报告的耗时及输出字节数, 以及文字版报告(body_str)的生成方式
+
+Usage:
+  bench_serialize.py [--corpus=<dir>] [--sizes=<sizes>] [--densities=<densities>] [--repeat=<n>]
+
+Options:
+  --corpus=<dir>            合成报告目录, 不存在的报告会先生成, 默认为 benchmarks/corpus
+  --sizes=<sizes>           贷款/贷记卡账户数 [default: 0,10,50,200]
+  --densities=<densities>   逾期比例 [default: 0.3]
+  --repeat=<n>              每项重复的次数, 取最小耗时 [default: 5]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+from docopt import docopt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import tojson  # noqa: E402
+import pboc  # noqa: E402
+import serializer  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def best_of(func, repeat):
+    """
+    :return: (最小耗时(毫秒), 最后一次的结果)
+    """
+    best, rs = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rs = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000, rs
+
+
+def main(corpus, sizes, densities, repeat=5):
+    files = synthetic.make_corpus(corpus, sizes, densities)
+    backends = sorted(serializer.BACKENDS)
+    print('{0:<32}{1:<10}{2:>10}{3:>12}{4:>10}{5:>12}'.format('report', 'backend', 'obj(ms)', 'obj(bytes)',
+                                                               'bom(ms)', 'bom(bytes)'))
+    for word_file in files:
+        name = Path(word_file).name
+        body = tojson.prefix_word(word_file)
+        old_ms, old_text = best_of(lambda: str(body).replace('\n', ''), repeat)
+        new_ms, new_text = best_of(lambda: tojson.body_text(body), repeat)
+        obj = tojson.to_dict(word_file)
+        obj_bytes = serializer.BACKENDS['json'].dumps(obj)
+        bom = pboc.pboc_bom(serializer.BACKENDS['json'].loads(obj_bytes))
+        for backend in backends:
+            dumps = serializer.BACKENDS[backend].dumps
+            obj_ms, obj_data = best_of(lambda: dumps(obj), repeat)
+            bom_ms, bom_data = best_of(lambda: dumps(bom), repeat)
+            print('{0:<32}{1:<10}{2:>10.3f}{3:>12}{4:>10.3f}{5:>12}'.format(name, backend, obj_ms, len(obj_data),
+                                                                         bom_ms, len(bom_data)))
+        print('{0:<32}{1:<10}{2:>10.3f}{3:>12}  -> body_text {4:.3f}ms, {5} chars'.format(
+            name, 'body_str', old_ms, len(old_text), new_ms, len(new_text)))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['--corpus'] or str(Path(__file__).resolve().parent / 'corpus'),
+         synthetic.parse_list(args['--sizes'], int), synthetic.parse_list(args['--densities']),
+         int(args['--repeat']))
@@ -0,0 +1,124 @@
+# coding: utf-8
+"""
+账户描述(statements)解析的微基准: 逐条动态拼接正则 vs 预编译的 parse_statement
+
+Usage:
+  bench_statement.py [<json_dir>] [--number=<n>]
+
+Options:
+  <json_dir>      解析后的json报告目录, 从中抽取真实的账户描述; 不提供则使用内置样例
+  --number=<n>    每条描述重复解析的次数 [default: 2000]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+from pathlib import Path
+
+from docopt import docopt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import pboc  # noqa: E402
+
+SAMPLES = [
+    ('loan', '1.2010年04月26日某消费金融公司发放的610,000元（人民币）个人汽车贷款，业务号X，信用/免担保，120期，按月归还，'
+             '2020年04月26日到期。截至2019年09月30日，'),
+    ('loan', '2.2018年07月07日中国银行发放的440,000元（人民币）个人住房贷款，业务号X，组合（含保证）担保，240期，按月归还，'
+             '2038年07月07日到期。截至2019年09月30日，'),
+    ('loan', '3.2016年1月5日某小额贷款公司发放的20,000元（人民币）个人经营性贷款，业务号X2016，保证，一次性归还，'
+             '2017年1月5日到期。截至2017年01月05日，'),
+    ('loan', '4.2015年03月10日中国建设银行发放的300,000元（人民币）个人消费贷款，业务号X，抵押担保，按月归还，'
+             '2018年03月10日到期。2018年03月已结清。'),
+    ('loanCard', '1.2009年04月22日招商银行发放的贷记卡（美元账户），业务号X，授信额度34,000元，共享授信额度34,000元，'
+                 '信用/免担保。截至2019年09月14日，'),
+    ('loanCard', '2.2014年12月04日中国银行发放的贷记卡（人民币账户），业务号X，授信额度34,000元，共享授信额度34,000元，'
+                 '信用/免担保。截至2019年09月14日，账户状态为“呆账”。'),
+    ('standardLoanCard', '1.2012年03月05日中国银行发放的准贷记卡（人民币账户），业务号X，授信额度50,000元，'
+                         '共享授信额度50,000元，信用/免担保。截至2019年09月14日，'),
+]
+
+
+def legacy_parse_statement(statements, context='loan'):
+    """ 原 get_loan_or_credit_detail 中的逐字段解析, 作为对照 """
+    rs = dict.fromkeys(['type', 'end_date', 'loan_terms', 'loan_type', 'account_type', 'account_state'])
+    rs['account'] = re.search(r'业务号(?P<account>[A-Z\d]+)', statements).group('account')
+    rs['open_date'] = open_date = re.search(r'\d{4}年\d{1,2}月\d{1,2}日', statements).group()
+    up2date = re.search(r'截至(?P<upToDate>[\d年月日]+)', statements)
+    rs['up_to_date'] = None if up2date is None else up2date.group('upToDate')
+    rs['loan_from'] = re.search('{0}(?P<from>.*?)发放'.format(open_date), statements).group('from')
+    if context == 'loan':
+        rs['credit_limit'] = re.search(r'发放(.*?)(?P<creditLimit>[\d,\.]+)元', statements).group('creditLimit')
+        rs['type'] = re.search(r'[)）](?P<type>.*?贷款)', statements).group('type')
+        end_date = re.search(r'(?P<endDate>[\d年月日]+)到期', statements)
+        rs['end_date'] = None if end_date is None else end_date.group('endDate')
+        loan_terms = re.search(r'，(?P<terms>\d+)期', statements)
+        rs['loan_terms'] = None if loan_terms is None else float(loan_terms.group('terms'))
+        loan_type = re.search(r'业务号.*?，(?P<type>.*?)，', statements).group('type')
+        rs['loan_type'] = loan_type.replace('（', '').replace('）', '').replace('(', '').replace(')', '').replace(
+            '/', '')
+    else:
+        rs['credit_limit'] = re.search(r'授信额度(.*?)(?P<creditLimit>[\d,\.]+)', statements).group('creditLimit')
+        rs['account_type'] = re.search(r'（(?P<accountType>.*?)账户）', statements).group('accountType')
+        account_state = re.search(r'账户状态为“(?P<accountState>.*?)”', statements)
+        rs['account_state'] = '正常' if account_state is None else account_state.group('accountState')
+    if rs['loan_terms'] is None:
+        if '一次性归还' in statements:
+            rs['loan_terms'] = 1
+        elif rs['end_date'] is not None:
+            rs['loan_terms'] = int((pboc.parser.parse(re.sub(r'[^\d]+', '', rs['end_date'])).date() -
+                                    pboc.parser.parse(re.sub(r'[^\d]+', '', open_date)).date()).days / 30)
+    return rs
+
+
+def load_corpus(json_dir):
+    """
+    从解析后的json报告中抽取账户描述
+    :param json_dir:
+    :return: [(context, statements)]
+    """
+    corpus = []
+    for fl in sorted(os.listdir(json_dir)):
+        if not fl.endswith('.json'):
+            continue
+        with open(os.path.join(json_dir, fl), encoding='utf-8') as f:
+            obj = json.load(f)
+        for context in ('loan', 'loanCard', 'standardLoanCard'):
+            for li in pboc.get_value('creditDetail,{0}'.format(context), obj, []):
+                if li.get('statements'):
+                    corpus.append((context, li['statements']))
+    return corpus
+
+
+def bench(func, corpus, number):
+    """
+    :return: 每条描述的平均耗时(微秒)
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        for context, statements in corpus:
+            func(statements, context)
+    return (time.perf_counter() - start) / (number * len(corpus)) * 1e6
+
+
+def main(json_dir=None, number=2000):
+    corpus = load_corpus(json_dir) if json_dir else SAMPLES
+    if not corpus:
+        print('没有可用的账户描述')
+        return
+    for context, statements in corpus:
+        assert legacy_parse_statement(statements, context) == pboc.parse_statement(statements, context), statements
+    # 清空 re 的模式缓存, 两种实现从同一起点计时
+    re.purge()
+    legacy = bench(legacy_parse_statement, corpus, number)
+    compiled = bench(pboc.parse_statement, corpus, number)
+    print('statements: {0}, number: {1}'.format(len(corpus), number))
+    print('legacy    : {0:.2f} us/statement'.format(legacy))
+    print('compiled  : {0:.2f} us/statement'.format(compiled))
+    print('speedup   : {0:.2f}x'.format(legacy / compiled))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(args['<json_dir>'], int(args['--number']))
@@ -0,0 +1,284 @@
+# coding: utf-8
+"""
+合成征信报告(docx), 用于基准测试, 版式与 tojson 解析的人行报告一致, 内容随机
+
+Usage:
+  synthetic.py <out_dir> [--sizes=<sizes>] [--densities=<densities>] [--seeds=<n>] [--json]
+
+Options:
+  <out_dir>                 输出目录
+  --sizes=<sizes>           贷款/贷记卡账户数 [default: 0,10,50,200]
+  --densities=<densities>   还款记录中的逾期比例 [default: 0,0.1,0.3]
+  --seeds=<n>               每种组合生成的份数 [default: 1]
+  --json                    同时输出 tojson 解析后的json
+"""
+
+import os
+import sys
+import random
+from pathlib import Path
+
+import docx
+from docopt import docopt
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+import tojson  # noqa: E402
+
+
+def row24(cells, spans):
+    """ 按合并单元格的跨度展开成24列的一行 """
+    out = []
+    for c, s in zip(cells, spans):
+        out += [c] * s
+    assert len(out) == 24, len(out)
+    return out
+
+
+def add_table(cell, rows):
+    """ 在单元格中嵌套表格 """
+    ncol = max(len(r) for r in rows)
+    t = cell.add_table(rows=len(rows), cols=ncol)
+    # table.cell(i, j) 每次都会展开整张表, 逐行取单元格
+    for row, r in zip(t.rows, rows):
+        for j, c in enumerate(row.cells):
+            v = r[j] if j < len(r) else ''
+            c.text = '' if v is None else str(v)
+    return t
+
+
+def make_report(path, n_loans=3, n_cards=3, n_slc=1, overdue=0.3, seed=0):
+    """
+    生成一份合成报告
+    :param path: docx路径
+    :param n_loans: 贷款数
+    :param n_cards: 贷记卡数
+    :param n_slc: 准贷记卡数
+    :param overdue: 还款记录中的逾期比例, 同时也是带逾期记录明细的账户比例
+    :param seed: 随机种子
+    :return:
+    """
+    rnd = random.Random(seed)
+    # 账户多时按比例缩小金额, 避免月负债超过 calculate_credit_limit 假定的上限使可贷额度为负
+    scale = max(1, (n_loans + n_cards) // 20)
+
+    def amount(hi, step=1):
+        return max(step, rnd.randint(0, hi) // scale // step * step)
+
+    doc = docx.Document()
+    items = []
+
+    def text(s):
+        items.append(('t', s))
+
+    def table(rows):
+        items.append(('d', rows))
+
+    text('个人信用报告')
+    table([['被查询者姓名', '被查询者证件类型', '被查询者证件号码', '查询操作员', '查询原因'],
+           ['张三', '身份证', '1101', 'op1', '贷后管理']])
+    text('一 个人基本信息')
+    text('身份信息')
+    table([['性别', '出生日期', '婚姻状况', '手机号码', '单位电话', '住宅电话', '学历', '学位'],
+           ['男性', '1980.01.01', '已婚', '139', '022', '022', '大学本科（简称"大学"）', '其他'],
+           ['通讯地址'] * 3 + ['户籍地址'] * 5,
+           ['天津市北辰'] * 3 + ['天津市河北'] * 5])
+    text('配偶信息')
+    table([['姓名', '证件类型', '证件号码', '工作单位', '联系电话'], ['--', '--', '--', '--', '--']])
+    text('居住信息')
+    table([['编号', '居住地址', '居住状况', '信息更新日期'], ['1', '天津市北辰区', '按揭', '2017.09.29'],
+           ['2', '天津市河北区', '租房', '2016.09.20']])
+    text('职业信息')
+    table([['编号', '工作单位', '工作单位', '工作单位', '工作单位', '单位地址', '单位地址'],
+           ['1', '公司A', '公司A', '公司A', '公司A', '地址A', '地址A'],
+           ['编号', '职业', '行业', '职务', '职称', '进入本单位年份', '信息更新日期'],
+           ['1', '办事人员', '--', '一般员工', '--', '2010', '2017.09.29']])
+    text('二 信息概要')
+    text('信用提示')
+    table([['个人住房贷款笔数', '个人商用房贷款笔数', '其他贷款笔数', '首笔贷款发放月份', '贷记卡账户数', '首张贷记卡发卡月份',
+            '准贷记卡账户数', '首张准贷记卡发卡月份', '本人声明数目', '异议标注数目'],
+           ['1', '0', str(n_loans), '2012.11', str(n_cards), '2007.01', str(n_slc), '2012.03', '0', '0']])
+    text('逾期及违约信息概要')
+    table([['呆账信息汇总'] * 2 + ['资产处置信息汇总'] * 2 + ['保证人代偿信息汇总'] * 4,
+           ['笔数', '余额', '笔数', '余额', '笔数', '余额', '', ''],
+           ['0', '0', '0', '0', '0', '0', '', '']])
+    text('逾期（透支）信息汇总')
+    table([['贷款逾期'] * 4 + ['贷记卡逾期'] * 4 + ['准贷记卡60天以上透支'] * 4,
+           ['笔数', '月份数', '单月最高逾期总额', '最长逾期月数'] * 3,
+           ['1', '2', '36,195', '2', '1', '3', '309,422', '2', '0', '0', '0', '0']])
+    text('未结清贷款信息汇总')
+    table([['贷款法人机构数', '贷款机构数', '笔数', '合同总额', '余额', '最近6个月平均应还款'],
+           ['2', '2', str(n_loans), '1,503,400', '1,206,316', '26,209']])
+    text('未销户贷记卡信息汇总')
+    table([['发卡法人机构数', '发卡机构数', '账户数', '授信总额', '单家行最高授信额', '单家行最低授信额', '已用额度',
+            '最近6个月平均使用额度'],
+           ['9', '9', str(n_cards), '709,172', '233,377', '14,000', '520,364', '487,711']])
+    text('未销户准贷记卡信息汇总')
+    table([['发卡法人机构数', '发卡机构数', '账户数', '授信总额', '单家行最高授信额', '单家行最低授信额', '透支余额',
+            '最近6个月平均透支余额'],
+           ['1', '1', str(n_slc), '0', '50,000', '50,000', '0', '0']])
+    text('三 信贷交易信息明细')
+    text('（一）保证人代偿信息')
+    table([['编号', '代偿机构', '最近一次代偿日期', '累计代偿金额', '最近一次还款日期', '余额'],
+           ['1', 'YS', '2018.01.29', '433,883', '2018.01.30', '423,527']])
+    text('（二）贷款')
+    lenders = ['中国银行', '工商银行', '某小额贷款公司', '某消费金融公司']
+    types = ['个人住房贷款', '个人消费贷款', '个人经营性贷款', '个人汽车贷款']
+    guar = ['抵押担保', '信用/免担保', '保证', '组合（含保证）担保']
+
+    def states():
+        s = []
+        for _ in range(24):
+            r = rnd.random()
+            if r < overdue:
+                s.append(str(rnd.randint(1, 5)))
+            elif r < overdue + 0.1:
+                s.append(rnd.choice('*#/'))
+            else:
+                s.append('N')
+        return s
+
+    def overdue_rows():
+        rows = [['2014年11月-2016年12月的逾期记录'] * 24,
+                row24(['逾期月份', '逾期持续月数', '逾期金额'] * 2, [4] * 6)]
+        for k in range(rnd.randint(1, 3)):
+            rows.append(row24(['2016.0{0}'.format(k + 1), str(rnd.randint(1, 7)), '4{0}0,003'.format(k),
+                               '2015.1{0}'.format(k), str(rnd.randint(1, 7)), '1{0},472'.format(k)], [4] * 6))
+        return rows
+
+    for i in range(n_loans):
+        y = rnd.randint(2008, 2018)
+        lender = rnd.choice(lenders)
+        tp = rnd.choice(types)
+        settled = rnd.random() < 0.2
+        terms = rnd.choice([12, 24, 36, 120, 240])
+        st = ('{0}.{1}年{2:02d}月{3:02d}日{4}发放的{5}元（人民币）{6}，业务号X，{7}，{8}期，按月归还，'
+              '{9}年{2:02d}月{3:02d}日到期。').format(
+            i + 1, y, rnd.randint(1, 12), rnd.randint(1, 28), lender, '{:,}'.format(amount(1000000, 10000)),
+            tp, rnd.choice(guar), terms, y + terms // 12)
+        st += '截至2019年09月30日，' if not settled else '2019年01月已结清。'
+        text(st)
+        if settled:
+            table([['']])
+            continue
+        bal = amount(500000)
+        sched = amount(6000)
+        rows = [row24(['账户状态', '五级分类', '本金余额', '剩余还款期数', '本月应还款', '应还款日', '本月实还款',
+                       '最近一次还款日期'], [3] * 8),
+                row24(['正常', rnd.choice(['正常', '正常', '次级']), '{:,}'.format(bal), str(rnd.randint(1, 200)),
+                       '{:,}'.format(sched), '2019.09.30', '{:,}'.format(sched), '2019.09.20'], [3] * 8),
+                row24(['当前逾期期数', '当前逾期金额', '逾期31-60天未还本金', '逾期61－90天未还本金', '逾期91－180天未还本金',
+                       '逾期180天以上未还本金'], [4] * 6),
+                row24(['0', str(rnd.choice([0, 0, 1200])), '0', '0', '0', '0'], [4] * 6),
+                ['2017年10月-2019年09月的还款记录'] * 24,
+                states()]
+        if rnd.random() < overdue:
+            rows += overdue_rows()
+        table(rows)
+    text('（三）贷记卡')
+    for i in range(n_cards):
+        y = rnd.randint(2005, 2018)
+        lender = rnd.choice(lenders[:2] + ['招商银行'])
+        state = rnd.choice(['正常'] * 6 + ['销户', '未激活'])
+        st = ('{0}.{1}年{2:02d}月{3:02d}日{4}发放的贷记卡（{5}账户），业务号X，授信额度{6}元，共享授信额度{6}元，信用/免担保。'
+              ).format(i + 1, y, rnd.randint(1, 12), rnd.randint(1, 28), lender, rnd.choice(['人民币'] * 4 + ['美元']),
+                       '{:,}'.format(rnd.randint(0, 50) * 1000))
+        if state == '正常':
+            st += '截至2019年09月14日，'
+        else:
+            st += '截至2019年09月14日，账户状态为“{0}”。'.format(state)
+        text(st)
+        if state != '正常':
+            table([['']])
+            continue
+        rows = [row24(['账户状态', '已用额度', '最近6个月平均使用额度', '最大使用额度', '本月应还款'], [4, 4, 8, 4, 4]),
+                row24([state, '{:,}'.format(amount(40000)), '{:,}'.format(amount(40000)),
+                       '{:,}'.format(amount(90000)), '{:,}'.format(amount(4000))], [4, 4, 8, 4, 4]),
+                row24(['账单日', '本月实还款', '最近一次还款日期', '当前逾期期数', '当前逾期金额'], [4, 4, 8, 4, 4]),
+                row24(['2019.09.14', '{:,}'.format(rnd.randint(0, 4000)), '2019.09.07', '0',
+                       str(rnd.choice([0, 0, 1500]))], [4, 4, 8, 4, 4]),
+                ['2017年10月-2019年09月的还款记录'] * 24,
+                states()]
+        if rnd.random() < overdue:
+            rows += overdue_rows()
+        table(rows)
+    text('（四）准贷记卡')
+    for i in range(n_slc):
+        st = ('{0}.2012年03月05日中国银行发放的准贷记卡（人民币账户），业务号X，授信额度50,000元，共享授信额度50,000元，'
+              '信用/免担保。截至2019年09月14日，').format(i + 1)
+        text(st)
+        rows = [row24(['账户状态', '透支余额', '最近6个月平均透支余额', '最大透支余额', '账单日', '本月实还款',
+                       '最近一次还款日期', '透支180天以上未付余额'], [2, 2, 4, 3, 3, 3, 3, 4]),
+                row24(['正常', '1,200', '800', '5,000', '2019.09.14', '300', '2019.09.07', '0'],
+                      [2, 2, 4, 3, 3, 3, 3, 4]),
+                ['2017年10月-2019年09月的还款记录'] * 24,
+                states()]
+        table(rows)
+    text('四 公共信息明细')
+    text('住房公积金参缴记录')
+    table([['编号', '参缴地', '参缴日期', '初缴月份', '缴至月份', '缴费状态', '月缴存额', '个人缴存比例', '单位缴存比例', ''],
+           ['1', '天津', '2010.01.01', '2010.01', '2019.09', '缴交', '1,000', '12%', '12%', ''],
+           ['编号', '缴费单位', '', '', '', '', '', '', '', '信息更新日期'],
+           ['1', '公司A', '', '', '', '', '', '', '', '2019.09.01']])
+    text('五 查询记录')
+    text('查询记录汇总')
+    table([['最近1个月内的查询机构数'] * 2 + ['最近1个月内的查询次数'] * 3 + ['最近2年内的查询次数'] * 3,
+           ['贷款审批', '信用卡审批', '贷款审批', '信用卡审批', '本人查询', '贷后管理', '担保资格审查', '特约商户实名审查'],
+           ['1', '1', '1', '1', '0', '3', '0', '0']])
+    text('信贷审批查询记录明细')
+    rows = [['编号', '查询日期', '查询操作员', '查询原因']]
+    reasons = ['信用卡审批', '贷款审批', '贷后管理', '本人查询（互联网个人信用信息服务平台）']
+    for i in range(rnd.randint(1, 12)):
+        rows.append([str(i + 1), '2019.0{0}.1{1}'.format(rnd.randint(1, 9), rnd.randint(0, 9)),
+                     rnd.choice(lenders) + '/op', rnd.choice(reasons)])
+    table(rows)
+    text('报告说明')
+
+    outer = doc.add_table(rows=len(items), cols=1)
+    for row, (k, v) in zip(outer.rows, items):
+        c = row.cells[0]
+        if k == 't':
+            c.text = v
+        else:
+            c.text = ''
+            add_table(c, v)
+    doc.save(path)
+
+
+def report_name(size, density, seed):
+    return 'synthetic_{0}_{1}_{2}.docx'.format(size, density, seed)
+
+
+def make_corpus(out_dir, sizes=(0, 10, 50, 200), densities=(0, 0.1, 0.3), seeds=1, to_json=False):
+    """
+    生成一组合成报告, 已存在的文件不重新生成
+    :param out_dir:
+    :param sizes: 贷款/贷记卡账户数
+    :param densities: 逾期比例
+    :param seeds: 每种组合的份数
+    :param to_json: 是否同时输出解析后的json
+    :return: docx路径列表
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    files = []
+    for size in sizes:
+        for density in densities:
+            for seed in range(seeds):
+                path = os.path.join(out_dir, report_name(size, density, seed))
+                if not os.path.exists(path):
+                    make_report(path, size, size, 1 if size else 0, overdue=density,
+                                seed=size * 1000 + int(density * 100) * 10 + seed)
+                if to_json and not os.path.exists(path + '.json'):
+                    tojson.to_json(path, path + '.json')
+                files.append(path)
+    return files
+
+
+def parse_list(value, tp=float):
+    return [tp(v) for v in value.split(',') if v != '']
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    files = make_corpus(args['<out_dir>'], parse_list(args['--sizes'], int), parse_list(args['--densities']),
+                        int(args['--seeds']), args['--json'])
+    print('\n'.join(files))
@@ -0,0 +1,198 @@
+# coding: utf-8
+
+"""
+instrument.py
+
+按报告统计各解析阶段的耗时、行数及内存峰值. 默认关闭, 只有在`collect`上下文中调用被`stage`装饰的函数才会记录
+
+    with instrument.collect('a.docx', memory=True) as stats:
+        obj = tojson.to_dict('a.docx')
+        bom = pboc.pboc_bom(obj)
+    stats.to_dict()
+
+Usage:
+  instrument.py <stats_dir>
+  instrument.py -h | --help
+
+Options:
+  -h --help              Show this screen.
+  <stats_dir>            parse_pboc 输出的 *.stats.json 所在目录, 汇总输出各阶段的 p50/p95
+"""
+
+import os
+import json
+import math
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from docopt import docopt
+
+STATS_SUFFIX = '.stats.json'
+
+# 当前报告的统计, 为None时被装饰的函数直接调用
+_current = ContextVar('instrument_current', default=None)
+
+
+class ReportStats(object):
+    """单份报告的统计"""
+
+    def __init__(self, report=None, memory=False):
+        self.report = report
+        self.memory = memory
+        self.stages = {}
+        self.elapsed = None
+        # 嵌套阶段的内存统计: [进入时已分配内存, 子阶段的峰值]
+        self._frames = []
+
+    def enter(self):
+        if not self.memory:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        if self._frames:
+            self._frames[-1][1] = max(self._frames[-1][1], peak)
+        tracemalloc.reset_peak()
+        self._frames.append([current, 0])
+
+    def exit(self, name, seconds, rows):
+        st = self.stages.get(name)
+        if st is None:
+            st = self.stages[name] = {'calls': 0, 'seconds': 0., 'rows': None}
+            if self.memory:
+                st['peak_kb'] = 0.
+        st['calls'] += 1
+        st['seconds'] += seconds
+        if rows is not None:
+            st['rows'] = rows + (st['rows'] or 0)
+        if not self.memory:
+            return
+        _, peak = tracemalloc.get_traced_memory()
+        start, child_peak = self._frames.pop()
+        peak = max(peak, child_peak)
+        st['peak_kb'] = max(st['peak_kb'], (peak - start) / 1024.)
+        if self._frames:
+            self._frames[-1][1] = max(self._frames[-1][1], peak)
+        tracemalloc.reset_peak()
+
+    def to_dict(self):
+        stages = {}
+        for name, st in self.stages.items():
+            stages[name] = dict(st, seconds=round(st['seconds'], 6))
+            if 'peak_kb' in st:
+                stages[name]['peak_kb'] = round(st['peak_kb'], 1)
+        return {'report': self.report, 'elapsed': None if self.elapsed is None else round(self.elapsed, 6),
+                'stages': stages}
+
+
+@contextmanager
+def collect(report=None, memory=False):
+    """
+    统计上下文中被装饰函数的调用
+    :param report: 报告名
+    :param memory: 是否用tracemalloc统计内存峰值, 会明显拖慢解析
+    :return: ReportStats
+    """
+    stats = ReportStats(report, memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _current.set(stats)
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stats.elapsed = time.perf_counter() - start
+        _current.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+def _default_rows(result, *args, **kwargs):
+    try:
+        return len(result)
+    except TypeError:
+        return None
+
+
+def stage(name=None, rows=None):
+    """
+    登记一个解析阶段
+    :param name: 阶段名, 默认为函数的__qualname__
+    :param rows: rows(result, *args, **kwargs) 返回该阶段处理的行数, 默认取len(result)
+    :return:
+    """
+    rows = rows or _default_rows
+
+    def decorator(func):
+        stage_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stats = _current.get()
+            if stats is None:
+                return func(*args, **kwargs)
+            stats.enter()
+            start = time.perf_counter()
+            result, done = None, False
+            try:
+                result = func(*args, **kwargs)
+                done = True
+                return result
+            finally:
+                seconds = time.perf_counter() - start
+                stats.exit(stage_name, seconds, rows(result, *args, **kwargs) if done else None)
+
+        return wrapper
+
+    return decorator
+
+
+def dump(stats, stats_file):
+    """统计结果写为一行json"""
+    with open(stats_file, 'w', encoding='utf-8') as of:
+        json.dump(stats.to_dict(), of, ensure_ascii=False)
+        of.write('\n')
+
+
+def summarize(stats_dir):
+    """
+    汇总目录下各报告的统计
+    :param stats_dir:
+    :return: {阶段: {'reports': n, 'p50': 秒, 'p95': 秒, 'max': 秒, 'rows': 总行数}}
+    """
+    seconds, rows = {}, {}
+    for fl in sorted(os.listdir(stats_dir)):
+        if not fl.endswith(STATS_SUFFIX):
+            continue
+        with open(os.path.join(stats_dir, fl), encoding='utf-8') as f:
+            record = json.load(f)
+        for name, st in record['stages'].items():
+            seconds.setdefault(name, []).append(st['seconds'])
+            if st['rows'] is not None:
+                rows[name] = rows.get(name, 0) + st['rows']
+        if record.get('elapsed') is not None:
+            seconds.setdefault('total', []).append(record['elapsed'])
+    summary = {}
+    for name, v in seconds.items():
+        v = sorted(v)
+        summary[name] = {'reports': len(v), 'p50': _percentile(v, 50), 'p95': _percentile(v, 95), 'max': v[-1],
+                         'rows': rows.get(name)}
+    return summary
+
+
+def _percentile(values, q):
+    """values已排序, 取最近秩"""
+    return values[max(0, math.ceil(q / 100. * len(values)) - 1)]
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    summary = summarize(args['<stats_dir>'])
+    print('{0:<32}{1:>8}{2:>12}{3:>12}{4:>12}{5:>10}'.format('stage', 'reports', 'p50(ms)', 'p95(ms)', 'max(ms)',
+                                                              'rows'))
+    for name, st in sorted(summary.items(), key=lambda x: -x[1]['p50']):
+        print('{0:<32}{1:>8}{2:>12.3f}{3:>12.3f}{4:>12.3f}{5:>10}'.format(
+            name, st['reports'], st['p50'] * 1000, st['p95'] * 1000, st['max'] * 1000,
+            '-' if st['rows'] is None else st['rows']))
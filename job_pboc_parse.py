@@ -4,22 +4,35 @@
 job_pboc_parse.py
 
 Usage:
-  job_pboc_parse.py <work_dir> <report_dir> <bom_dir> <log_dir> <run_date>
+  job_pboc_parse.py <work_dir> <report_dir> <bom_dir> <log_dir> <run_date> [--workers=<n>] [--no-json] [--profile=<mode>]
+                    [--cache-dir=<dir>] [--cache-size=<mb>]
   job_pboc_parse.py -h | --helpa
   job_pboc_parse.py --version
 
 Options:
   -h --help              Show this screen.
   --version              Show version.
+  --workers=<n>          并行解析的进程数 [default: 1]
+  --no-json              不保存解析后的json报告
+  --profile=<mode>       按报告统计各阶段耗时及行数(time), 或同时统计内存峰值(memory), 结果与全量bom一起写入 *.stats.json
+  --cache-dir=<dir>      按报告内容缓存解析结果及bom的目录, 内容相同的报告不重复解析
+  --cache-size=<mb>      缓存容量上限(MB) [default: 1024]
 """
 
 import sys
 import json
 import os
 import shutil
+import time
+import hashlib
+import sqlite3
 import logging
+import logging.handlers
 import pathlib
 import traceback
+import multiprocessing
+from contextlib import nullcontext, closing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from docopt import docopt
 
@@ -28,11 +41,21 @@ sys.path.append(pathlib.Path(__file__).absolute().parent.parent.as_posix())
 # sys.path.append('/Users/tumixie/project/ffd/ds/root/project/job/huabei_loan_pboc')
 # import tojson, pboc
 
-from scripts import tojson, pboc
+from scripts import tojson, pboc, instrument, result_cache, serializer
 
+# bom文件名为报告文件名加此后缀
+BOM_SUFFIX = '.bom.txt'
 
-def parse_pboc(work_dir, word_file: str, out_dir: str = None, log_dir=None):
-    import traceback
+
+def parse_pboc(work_dir, word_file: str, out_dir: str = None, log_dir=None, persist_json=True, profile=None,
+               cache_dir=None, cache_size=1024):
+    """
+    解析报告并生成bom
+    :param persist_json: 是否将解析后的报告另存为json(仅用于留档,bom直接使用内存中的解析结果)
+    :param profile: None不统计, time统计各阶段耗时及行数, memory同时统计内存峰值
+    :param cache_dir: 结果缓存目录, None不使用缓存
+    :param cache_size: 缓存容量上限(MB)
+    """
     p = word_file.split(os.path.sep)
     d, f = '{0}'.format(os.path.sep).join(p[:-1]), p[-1]
     if out_dir is not None:
@@ -40,73 +63,258 @@ def parse_pboc(work_dir, word_file: str, out_dir: str = None, log_dir=None):
     if pathlib.Path(d, f).as_posix() != f:
         shutil.copy(word_file, pathlib.Path(log_dir, f).as_posix())
     json_file = pathlib.Path(log_dir, '{0}.json'.format(f)).as_posix()
-    bom_file = pathlib.Path(d, '{0}.bom.txt'.format(f)).as_posix()
+    bom_file = pathlib.Path(d, f + BOM_SUFFIX).as_posix()
     his_bom_all_dir = os.path.join(work_dir, 'all_var_bom_his')
     os.makedirs(his_bom_all_dir, exist_ok=True)
-    all_var_bom_file = pathlib.Path(his_bom_all_dir, '{0}.bom.txt'.format(f)).as_posix()
-    logger.info('to json: {0}'.format(word_file))
-    tojson.to_json(word_file, json_file)
-    with open(json_file, encoding='utf-8') as f:
-        obj = json.load(f)
-        logger.info('run pboc bom: {0}'.format(json_file))
-        bom = pboc.pboc_bom(obj)
-        logger.info('bom to file: {0}'.format(bom_file))
-        with open(bom_file, 'w', encoding='utf-8') as of:
-            all_var_bom = {}
-            export_vars = ['pboc_debt_loan', 'pboc_lc_ucl_pct_lf', 'pboc_lc_uclj6_pct_lf', 'pboc_hs_coffiecient_level1'
-                , 'pboc_hs_coffiecient_level2', 'pboc_hs_credit_limit_level1', 'pboc_hs_credit_limit_level2'
-                , 'pboc_hs_repay_monthly_coffiecient_level1', 'pboc_hs_repay_monthly_coffiecient_level2']
-            # all_var_bom['pboc_debt_loan'] = bom.get('pboc_debt_loan_004', 'C')
-            for v in export_vars:
-                all_var_bom[v] = bom.get(v, 'C')
-            json.dump(all_var_bom, of, ensure_ascii=False)
-        with open(all_var_bom_file, 'w', encoding='utf-8') as of:
-            json.dump(bom, of, ensure_ascii=False)
-
-
-def get_pboc_word_files(from_dir, bom_dir):
-    # f = [
-    #     # r'F:\rongsai\ds\root\project\dtils\tests\etl\pboc\7256_fanshaohua.docx',
-    #     '/home/taiping/pboc_jobs/scripts/7431_chenwenhong.docx',
-    # ]
-    dones = [os.path.basename(fl).split('.')[0] for fl in os.listdir(bom_dir)]
+    all_var_bom_file = pathlib.Path(his_bom_all_dir, f + BOM_SUFFIX).as_posix()
+    cache = None if cache_dir is None else _open_cache(cache_dir, cache_size)
+    sha256 = None if cache is None else file_sha256(word_file)
+    cached = None if cache is None else cache.get(sha256)
+    stats = None
+    if cached is not None:
+        logger.info('命中缓存: {0} {1}'.format(word_file, sha256))
+        obj_json, bom = cached
+        if persist_json:
+            logger.info('to json: {0}'.format(json_file))
+            with open(json_file, 'wb') as of:
+                of.write(obj_json)
+    else:
+        collector = nullcontext() if profile is None else instrument.collect(f, memory=profile == 'memory')
+        with collector as stats:
+            logger.info('to dict: {0}'.format(word_file))
+            obj = tojson.to_dict(word_file)
+            obj_json = serializer.dumps(obj) if persist_json or cache is not None else None
+            if persist_json:
+                logger.info('to json: {0}'.format(json_file))
+                with open(json_file, 'wb') as of:
+                    of.write(obj_json)
+            logger.info('run pboc bom: {0}'.format(word_file))
+            bom = pboc.pboc_bom(obj)
+        if cache is not None:
+            cache.put(sha256, obj_json, bom)
+    if stats is not None:
+        stats_file = pathlib.Path(his_bom_all_dir, '{0}{1}'.format(f, instrument.STATS_SUFFIX)).as_posix()
+        logger.info('stats to file: {0}'.format(stats_file))
+        instrument.dump(stats, stats_file)
+    logger.info('bom to file: {0}'.format(bom_file))
+    # all_var_bom['pboc_debt_loan'] = bom.get('pboc_debt_loan_004', 'C')
+    serializer.dump(pboc.export_bom(bom), bom_file)
+    serializer.dump(bom, all_var_bom_file)
+
+
+# 各进程打开的结果缓存
+_caches = {}
+
+
+def _open_cache(cache_dir, cache_size):
+    key = (cache_dir, cache_size)
+    if key not in _caches:
+        os.makedirs(cache_dir, exist_ok=True)
+        _caches[key] = result_cache.ResultCache(os.path.join(cache_dir, 'results.sqlite'),
+                                                result_cache.code_version(tojson, pboc),
+                                                max_bytes=cache_size * 1024 * 1024)
+    return _caches[key]
+
+
+def report_key(fl):
+    """报告名: 完整的文件名, bom文件名为报告名加 BOM_SUFFIX"""
+    return os.path.basename(fl)
+
+
+def file_sha256(fl, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(fl, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ProcessedIndex(object):
+    """
+    已解析报告的索引(sqlite), 按报告名(完整文件名)记录文件的sha256、mtime及大小
+    每份报告解析成功后单独提交, 任务中断时已完成的报告不会重复解析
+    """
+
+    def __init__(self, db_file, seed_dir=None):
+        """
+        :param db_file:
+        :param seed_dir: 索引为空时, 以该目录(bom_his)中已有的bom导入已解析的报告名
+        """
+        self.conn = sqlite3.connect(db_file)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS processed (name TEXT PRIMARY KEY, sha256 TEXT, mtime REAL, '
+                              'size INTEGER, updated TEXT)')
+            empty = self.conn.execute('SELECT COUNT(*) FROM processed').fetchone()[0] == 0
+            if empty and seed_dir is not None and os.path.exists(seed_dir):
+                now = time.strftime('%Y-%m-%d %H:%M:%S')
+                self.conn.executemany('INSERT OR IGNORE INTO processed VALUES (?, NULL, NULL, NULL, ?)',
+                                      ((fl[:-len(BOM_SUFFIX)], now) for fl in os.listdir(seed_dir)
+                                       if fl.endswith(BOM_SUFFIX)))
+
+    def is_done(self, word_file):
+        """
+        报告是否已解析; 同名报告内容变化(重新上传)时返回False
+        mtime及大小未变时不读取文件内容
+        """
+        row = self.conn.execute('SELECT sha256, mtime, size FROM processed WHERE name = ?',
+                                (report_key(word_file),)).fetchone()
+        if row is None:
+            return False
+        sha256, mtime, size = row
+        st = os.stat(word_file)
+        if sha256 is None:
+            # 由bom_his导入的记录没有文件指纹, 以当前文件为准
+            self.mark(word_file)
+            return True
+        if mtime == st.st_mtime and size == st.st_size:
+            return True
+        if size == st.st_size and file_sha256(word_file) == sha256:
+            self.mark(word_file, sha256)
+            return True
+        logger.info('报告内容有变化, 重新解析: {0}'.format(word_file))
+        return False
+
+    def mark(self, word_file, sha256=None):
+        """记录已解析的报告"""
+        st = os.stat(word_file)
+        sha256 = sha256 or file_sha256(word_file)
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?)',
+                              (report_key(word_file), sha256, st.st_mtime, st.st_size,
+                               time.strftime('%Y-%m-%d %H:%M:%S')))
+
+    def close(self):
+        self.conn.close()
+
+
+def get_pboc_word_files(from_dir, index: ProcessedIndex):
+    """
+    待解析的报告
+    :param from_dir: 报告目录
+    :param index: 已解析报告的索引
+    :return:
+    """
     lst = []
     for fl in os.listdir(from_dir):
-        if os.path.basename(fl).split('.')[0] in dones:
-            continue
-        lst.append(os.path.join(from_dir, fl))
+        fl = os.path.join(from_dir, fl)
+        if not index.is_done(fl):
+            lst.append(fl)
     return lst
 
 
-def run_job(work_dir, report_dir, bom_dir, log_dir):
+def run_job(work_dir, report_dir, bom_dir, log_dir, workers=1, persist_json=True, profile=None, cache_dir=None,
+            cache_size=1024):
     his_bom_all_dir = os.path.join(work_dir, 'bom_his')
     os.makedirs(his_bom_all_dir, exist_ok=True)
     if not os.path.exists(report_dir) or len(os.listdir(report_dir)) <= 0:
         logger.info('无报告')
         os.removedirs(bom_dir)
         return
-    word_files = get_pboc_word_files(report_dir, his_bom_all_dir)
-    # out_dir = r'F:\rongsai\ds\root\project\dtils\tests\etl\temp'
-    # out_dir = '/home/taiping/pboc_jobs/log'
-    # shutil.move(bom_dir, '{0}__bak'.format(bom_dir))
-    # logger.info('删除上次结果')
-    # if os.path.exists(bom_dir):
-    #    for fl in os.listdir(bom_dir):
-    #        os.remove(os.path.join(bom_dir, fl))
-    #    os.rmdir(bom_dir)
-    if len(word_files) == 0:
-        logger.info('无新文件')
-        os.removedirs(bom_dir)
-        return
-    os.makedirs(bom_dir, exist_ok=True)
-    for fl in word_files:
-        try:
-            logger.info('start {0}'.format(fl))
-            parse_pboc(work_dir, fl, bom_dir, log_dir)
-        except Exception as e:
-            logger.error(traceback.format_exc())
+    with closing(ProcessedIndex(os.path.join(work_dir, 'processed.sqlite'), seed_dir=his_bom_all_dir)) as index:
+        word_files = get_pboc_word_files(report_dir, index)
+        # out_dir = r'F:\rongsai\ds\root\project\dtils\tests\etl\temp'
+        # out_dir = '/home/taiping/pboc_jobs/log'
+        # shutil.move(bom_dir, '{0}__bak'.format(bom_dir))
+        # logger.info('删除上次结果')
+        # if os.path.exists(bom_dir):
+        #    for fl in os.listdir(bom_dir):
+        #        os.remove(os.path.join(bom_dir, fl))
+        #    os.rmdir(bom_dir)
+        if len(word_files) == 0:
+            logger.info('无新文件')
+            os.removedirs(bom_dir)
+            return
+        os.makedirs(bom_dir, exist_ok=True)
+        start = time.time()
+        if workers is None or workers <= 1:
+            results = []
+            for fl in word_files:
+                results.append(_parse_one(work_dir, fl, bom_dir, log_dir, persist_json, profile, cache_dir, cache_size))
+                _mark_done(index, *results[-1])
+        else:
+            results = _parse_parallel(work_dir, word_files, bom_dir, log_dir, workers, persist_json, profile, index,
+                                      cache_dir, cache_size)
     for fl in os.listdir(bom_dir):
         shutil.copy(pathlib.Path(bom_dir, fl).as_posix(), his_bom_all_dir)
+    summary = run_summary(results, time.time() - start)
+    logger.info('解析汇总: {0}'.format(json.dumps(summary, ensure_ascii=False)))
+    return summary
+
+
+def _parse_one(work_dir, fl, bom_dir, log_dir, persist_json=True, profile=None, cache_dir=None, cache_size=1024):
+    """
+    解析单个报告,异常只记录日志不抛出,保证单个文件失败不影响其他文件
+    :return: (文件, 错误信息), 成功时错误信息为None
+    """
+    try:
+        logger.info('start {0}'.format(fl))
+        parse_pboc(work_dir, fl, bom_dir, log_dir, persist_json=persist_json, profile=profile, cache_dir=cache_dir,
+                   cache_size=cache_size)
+        return fl, None
+    except Exception as e:
+        logger.error(traceback.format_exc())
+        return fl, '{0}: {1}'.format(type(e).__name__, e)
+
+
+def _mark_done(index, fl, err):
+    """解析成功的报告计入索引"""
+    if err is None and index is not None:
+        index.mark(fl)
+
+
+def _parse_parallel(work_dir, word_files, bom_dir, log_dir, workers, persist_json=True, profile=None, index=None,
+                    cache_dir=None, cache_size=1024):
+    """
+    多进程解析,子进程的日志通过队列回传到主进程,由`log_`配置的handler统一写入任务日志
+    """
+    log_queue = multiprocessing.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *logger.handlers, respect_handler_level=True)
+    listener.start()
+    results = []
+    try:
+        logger.info('并行解析: {0}个文件, {1}个进程'.format(len(word_files), workers))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(log_queue, logger.name)) as executor:
+            futures = {executor.submit(_parse_one, work_dir, fl, bom_dir, log_dir, persist_json, profile, cache_dir,
+                                       cache_size): fl
+                       for fl in word_files}
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:  # 子进程异常退出等
+                    logger.error('{0}: {1}'.format(futures[future], traceback.format_exc()))
+                    results.append((futures[future], '{0}: {1}'.format(type(e).__name__, e)))
+                _mark_done(index, *results[-1])
+    finally:
+        listener.stop()
+    return results
+
+
+def _init_worker(log_queue, name):
+    """子进程初始化: 日志全部写入队列"""
+    global logger
+    logger = logging.getLogger(name)
+    for h in list(logger.handlers):
+        logger.removeHandler(h)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG)
+
+
+def run_summary(results, elapsed):
+    """
+    汇总本次运行结果
+    :param results: [(文件, 错误信息)]
+    :param elapsed: 耗时(秒)
+    :return:
+    """
+    failed = {os.path.basename(fl): err for fl, err in results if err is not None}
+    return {
+        'total': len(results),
+        'success': len(results) - len(failed),
+        'failed': len(failed),
+        'failed_files': failed,
+        'elapsed': round(elapsed, 3),
+    }
 
 
 def log_(log_file_name=None, name=__name__, stdout_on=True):
@@ -151,6 +359,12 @@ if __name__ == '__main__':
     report_dir = args['<report_dir>']
     log_dir = args['<log_dir>']
     bom_dir = args['<bom_dir>']
+    workers = int(args['--workers'])
+    persist_json = not args['--no-json']
+    profile = args['--profile']
+    if profile not in (None, 'time', 'memory'):
+        print('--profile 只支持 time 或 memory')
+        sys.exit(1)
 
     from datetime import datetime
 
@@ -161,7 +375,8 @@ if __name__ == '__main__':
         logger = log_(log_file, name='scripts', stdout_on=True)
         logger.info('开始解析')
         logger.info('-' * 30)
-        run_job(work_dir, report_dir, bom_dir, log_dir)
+        run_job(work_dir, report_dir, bom_dir, log_dir, workers=workers, persist_json=persist_json, profile=profile,
+                cache_dir=args['--cache-dir'], cache_size=int(args['--cache-size']))
     except Exception as e:
         logger.error(traceback.format_exc())
         shutil.move(log_file, '{1}/ERROR_{0}'.format(os.path.basename(log_file), os.path.dirname(log_file)))
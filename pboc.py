@@ -3,24 +3,92 @@
 import re
 import json
 import logging
+import calendar
+from functools import lru_cache
+from collections import namedtuple
 from datetime import datetime, date
-from dateutil import relativedelta, parser
-from typing import List, Optional
-from collections import defaultdict
+from dateutil import parser
 
 import pandas as pd
 import numpy as np
-import jieba
-from sklearn.feature_extraction.text import CountVectorizer
-from scipy.linalg import norm
+
+try:
+    from . import instrument, tojson
+except ImportError:
+    import instrument
+    import tojson
 
 START_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+# 日期转换结果的缓存条数, 同一份报告中的日期/月份大量重复(如逐月的逾期记录)
+DATE_CACHE_SIZE = 4096
+DATE_SPLIT_PATTERN = re.compile(r'[^\d]')
 TIME_WINDOW = {'j1m': 30, 'j3m': 90, 'j6m': 180, 'j12m': 360, 'j24m': 720, 'lf': 99999}
 TIME_WINDOW_V2 = {'j3m': 3, 'j6m': 6, 'j12m': 12, 'j24m': 24, 'lf': 99999}
+# 账户描述(statements)的解析规则, 模块加载时一次编译
+STATEMENT_PATTERNS = {
+    'account': re.compile(r'业务号(?P<account>[A-Z\d]+)'),
+    'open_date': re.compile(r'\d{4}年\d{1,2}月\d{1,2}日'),
+    'up_to_date': re.compile(r'截至(?P<upToDate>[\d年月日]+)'),
+    'loan_from': re.compile(r'(?P<from>.*?)发放'),
+    'loan_credit_limit': re.compile(r'发放(.*?)(?P<creditLimit>[\d,\.]+)元'),
+    'loan_detail_type': re.compile(r'[)）](?P<type>.*?贷款)'),
+    'end_date': re.compile(r'(?P<endDate>[\d年月日]+)到期'),
+    'loan_terms': re.compile(r'，(?P<terms>\d+)期'),
+    'loan_type': re.compile(r'业务号.*?，(?P<type>.*?)，'),
+    'card_credit_limit': re.compile(r'授信额度(.*?)(?P<creditLimit>[\d,\.]+)'),
+    'account_type': re.compile(r'（(?P<accountType>.*?)账户）'),
+    'account_state': re.compile(r'账户状态为“(?P<accountState>.*?)”'),
+    'non_digit': re.compile(r'[^\d]+'),
+}
+LOAN_TYPE_STRIP = str.maketrans('', '', '（）()/')
+# 贷款/贷记卡明细中账户级别的列, 同一账户的多条逾期记录共享
+DETAIL_ACCOUNT_COLUMNS = ['currOverdueCyc', 'currOverdueAmount', 'overdue31To60Amount', 'overdue61To90Amount',
+                          'overdue91To180Amount', 'overdueOver180Amount', 'scheduledPaymentAmount',
+                          'actualPaymentAmount', 'remainPaymentCyc', 'scheduledPaymentDate', 'class5State', 'state',
+                          'type', 'loan_type', 'loan_terms', 'loan_from', 'credit_limit', 'used_credit_limit',
+                          'usedHighestAmount', 'latest6MonthUsedAvgAmount', 'openDate', 'upToDate', 'end_date',
+                          'account', 'accountType', 'accountState', 'balance', 'settle_type', 'loan_item']
+# 贷款负债分类, 按 非银行*2 + 期供 取值
+DEBT_CLASSES = np.array(['bank_nperiod', 'bank_period', 'nbank_nperiod', 'nbank_period'], dtype=object)
+# 房贷认定(hbxd_house_loan_type_check)依赖的列
+HOUSE_LOAN_COLUMNS = ['loan_from', 'loan_type', 'type', 'loan_terms']
+# 变量的编码方式(见 mapping), 由变量名决定: 笔数 / 百分比 / 金额
+ENCODE_COUNT, ENCODE_PCT, ENCODE_AMOUNT = 0, 1, 2
+AMOUNT_KEY_PARTS = ('cl', 'amt', 'amount', 'balance')
+AMOUNT_FEATURES = frozenset(['pboc_debt_ln_bank_nperiod', 'pboc_debt_ln_bank_period', 'pboc_debt_ln_nbank_nperiod',
+                             'pboc_debt_ln_nbank_period', 'pboc_debt_loan_004'])
+# 数字0-9依次编码为 C U M B E R L A N D
+CUMBERLAND = str.maketrans('0123456789', 'CUMBERLAND')
+# 对外输出的变量, 缺失时输出C
+EXPORT_VARS = ['pboc_debt_loan', 'pboc_lc_ucl_pct_lf', 'pboc_lc_uclj6_pct_lf', 'pboc_hs_coffiecient_level1',
+               'pboc_hs_coffiecient_level2', 'pboc_hs_credit_limit_level1', 'pboc_hs_credit_limit_level2',
+               'pboc_hs_repay_monthly_coffiecient_level1', 'pboc_hs_repay_monthly_coffiecient_level2']
 
 logger = logging.getLogger(__name__)
 
+# 地址解析相关的名称, 已移至 address 模块, 仍可通过 pboc.address_parse 等访问
+ADDRESS_NAMES = frozenset(['Address', 'Residence', 'address_parse', 'address_cell_cmp', 'string_similarity',
+                           'address_cls', 'address_cls_v1', 'address_vague_match', 'address_match_score',
+                           'address_cell_fill', 'address_tail_detail_parse', 'fix_jieba_over_cut',
+                           'address_prefix_detail_parse'])
+
+
+def _address_module():
+    """地址解析依赖 jieba/sklearn/scipy, 首次使用时才加载"""
+    try:
+        from . import address
+    except ImportError:
+        import address
+    return address
+
+
+def __getattr__(name):
+    if name in ADDRESS_NAMES:
+        return getattr(_address_module(), name)
+    raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
 
+
+@instrument.stage()
 def pboc_bom(obj, version=None):
     """
     输入原始的征信报文
@@ -28,23 +96,84 @@ def pboc_bom(obj, version=None):
     :param version
     :return:
     """
-    features = {}
     pboc = PBOCEntity(obj, _type=1)
+    return pboc_features(pboc, obj, query_info_bom(pboc.query_info), loan_info_bom(pboc.loan_detail),
+                         loan_card_bom(pboc.credit_card_detail))
+
+
+def export_bom(bom):
+    """
+    从全量bom中取对外输出的变量
+    :param bom: pboc_bom的结果
+    :return:
+    """
+    return {v: bom.get(v, 'C') for v in EXPORT_VARS}
+
+
+@instrument.stage()
+def pboc_bom_batch(objs, version=None):
+    """
+    批量计算征信报文的变量, 结果与逐份调用 pboc_bom 相同
+    各报告的查询/贷款/贷记卡明细按报告编号拼接成大表, 时间窗口变量、负债变量及负面规则一次分组算完, 最后一次编码,
+    避免每份报告各自构造大量小 DataFrame 的开销
+    :param objs: 原始征信报文列表
+    :param version:
+    :return: list, 与 objs 一一对应
+    """
+    pbocs = [PBOCEntity(obj, _type=1) for obj in objs]
+    n = len(pbocs)
+    query = concat_details([pboc.query_info for pboc in pbocs])
+    loan = concat_details([pboc.loan_detail for pboc in pbocs])
+    card = concat_details([pboc.credit_card_detail for pboc in pbocs])
+    standard_card = concat_details([pboc.standard_credit_card_detail for pboc in pbocs])
+
+    query_features = query_window_features(query, query['report_id'].values, n)
+    loan_features = loan_window_features(loan, loan['report_id'].values, n)
+    card_features = loan_card_window_features(card, card['report_id'].values, n)
+    debts = debt_features(loan, card, standard_card, n)
+    # 没有查询记录时规则结果为0, 没有贷款/贷记卡的报告不输出贷款/贷记卡的规则
+    query_rules = negative_rule_features(QUERY_NEGATIVE_RULES, query, query['report_id'].values, n)
+    loan_rules = negative_rule_features(LOAN_NEGATIVE_RULES, loan, loan['report_id'].values, n, skip_empty=True)
+    card_rules = negative_rule_features(LOAN_CARD_NEGATIVE_RULES, card, card['report_id'].values, n, skip_empty=True)
+
+    rs = []
+    for ii, (pboc, obj) in enumerate(zip(pbocs, objs)):
+        query_features[ii].update(query_rules[ii])
+        loan_features[ii].update(loan_rules[ii])
+        card_features[ii].update(card_rules[ii])
+        rs.append(pboc_features(pboc, obj, query_features[ii], loan_features[ii], card_features[ii],
+                                debts[ii], encode=False))
+    return encode_feature_dicts(rs)
+
+
+def pboc_features(pboc, obj, query_feature, loan_feature, card_feature, debt_feature=None, encode=True):
+    """
+    汇总一份报告的变量
+    :param pboc: PBOCEntity
+    :param obj: 原始征信报文
+    :param query_feature: 查询变量
+    :param loan_feature: 贷款变量
+    :param card_feature: 贷记卡变量
+    :param debt_feature: 负债变量, 为None时由 debt_variables 计算
+    :param encode: 是否编码(clean + mapping), 批量计算时由调用方统一编码
+    :return:
+    """
+    features = {}
 
     features['education_level'] = transfer_education_level(pboc.basic_info.get('eduLevel', None))
     features['pboc_lc_ucl_pct_lf'] = cal_used_credit_limit_percent(pboc.raw_data)
     features['pboc_lc_uclj6_pct_lf'] = cal_used_credit_limit_percent_j6m(pboc.raw_data)
     features.update(hbxd_house_loan_feature(pboc))
     features.update(summary_bom(pboc))
-    features.update(query_info_bom(pboc.query_info))
-    features.update(loan_info_bom(pboc.loan_detail))
-    features.update(loan_card_bom(pboc.credit_card_detail))
+    features.update(query_feature)
+    features.update(loan_feature)
+    features.update(card_feature)
     features.update(standard_loan_card_bom(pboc.standard_credit_card_detail))
     features.update(rule_direct_variables(pboc, obj))
-    features.update(debt_variables(pboc))
+    features.update(debt_variables(pboc) if debt_feature is None else debt_feature)
     features['credit_limit'] = calculate_credit_limit(features)
-    features = clean(features)
-    features = mapping(features)
+    if encode:
+        features = encode_features(features)
 
     # features = filter_feature(features)
 
@@ -65,45 +194,155 @@ def mapping(features):
     :param features:
     :return:
     """
-    n = {}
-    for k, v in features.items():
-        if isinstance(v, str):
-            n[k] = v
-        elif isinstance(v, (float, int)):
-            if 'pct' in k:
-                if np.isinf(v):
-                    v = 9999999
-                n[k] = number_to_string(int(v * 100))
-            elif 'cl' in k or 'amt' in k or 'amount' in k or 'balance' in k or k in ['pboc_debt_ln_bank_nperiod',
-                                                                                     'pboc_debt_ln_bank_period',
-                                                                                     'pboc_debt_ln_nbank_nperiod',
-                                                                                     'pboc_debt_ln_nbank_period',
-                                                                                     'pboc_debt_loan_004']:
-                if features[k] <= 10000:
-                    v = round(features[k], -2)
-                elif features[k] <= 100000:
-                    v = round(features[k], -3)
-                else:
-                    v = round(features[k], -4)
-                n[k] = number_to_string(int(v))
-            else:
-                n[k] = number_to_string(int(features[k]))
-
-    return n
+    keys = list(features)
+    codes = encode_values(list(features.values()), encoding_plan(keys), ndigits=None)
+    return {k: v for k, v in zip(keys, codes) if v is not None}
 
 
 def number_to_string(number):
     """
+    非负整数的CUMBERLAND编码
     :param number:
     :return:
     """
-    out = 'CUMBERLAND'
-    rs = ''
-    for v in str(number):
-        rs += out[int(v)]
+    rs = str(number)
+    if not rs.isdigit():
+        raise ValueError('CUMBERLAND编码只支持非负整数: {0}'.format(number))
+    return rs.translate(CUMBERLAND)
+
+
+@lru_cache(maxsize=None)
+def feature_encoding(key):
+    """
+    变量的编码方式, 每个变量名只判断一次
+    :param key: 变量名
+    :return: ENCODE_PCT / ENCODE_AMOUNT / ENCODE_COUNT
+    """
+    if 'pct' in key:
+        return ENCODE_PCT
+    if any(part in key for part in AMOUNT_KEY_PARTS) or key in AMOUNT_FEATURES:
+        return ENCODE_AMOUNT
+    return ENCODE_COUNT
+
+
+def encoding_plan(keys):
+    """
+    一组变量的编码方式
+    :param keys: 变量名
+    :return: np.ndarray
+    """
+    return np.fromiter((feature_encoding(k) for k in keys), dtype=np.int8, count=len(keys))
+
+
+def round_half_even(values, ndigits):
+    """
+    逐元素取整, 结果与 round(float, ndigits) 一致
+    np.round 先乘10**ndigits再取整, 在两个取值的中点附近(或乘后超出浮点数的整数精度)时可能与 round 不同, 这些值逐个用 round 计算
+    :param values: float数组
+    :param ndigits:
+    :return:
+    """
+    rs = np.round(values, ndigits)
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = np.abs(values) * 10. ** ndigits
+        fraction = scaled - np.floor(scaled)
+        exact = (np.abs(fraction - 0.5) > 4 * np.spacing(scaled)) & (scaled < 2. ** 52)
+    for ii in np.flatnonzero(~exact & np.isfinite(values)):
+        rs[ii] = round(float(values[ii]), ndigits)
+    return rs
+
+
+def encode_values(values, plan, ndigits=5):
+    """
+    按编码方式批量编码变量值: 字符串原样输出, 数值按 百分比/金额/笔数 取整后编码为CUMBERLAND字符串
+    :param values: 变量值
+    :param plan: 编码方式, 与values一一对应, 见 encoding_plan
+    :param ndigits: 数值先保留的小数位数, 同 clean, 空值及保留后为0的数值不输出; 为None时不做 clean
+    :return: np.ndarray, 不输出的值为None
+    """
+    values = np.asarray(values, dtype=object)
+    codes = np.full(len(values), None, dtype=object)
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+    codes[is_str] = values[is_str]
+    idx = np.flatnonzero(~is_str & ~pd.isnull(values))
+    if len(idx) == 0:
+        return codes
+    x = values[idx].astype(float)
+    if ndigits is not None:
+        x = round_half_even(x, ndigits)
+        idx, x = idx[x != 0], x[x != 0]
+    plan = np.asarray(plan)[idx]
+    pct = plan == ENCODE_PCT
+    if not np.isfinite(x[~pct]).all():
+        raise OverflowError('变量值为无穷大, 无法编码: {0}'.format(x[~pct][~np.isfinite(x[~pct])][0]))
+    x = np.where(pct, np.where(np.isinf(x), 9999999., x) * 100, x)
+    amount = plan == ENCODE_AMOUNT
+    for digits, mask in ((-2, amount & (x <= 10000)), (-3, amount & (x > 10000) & (x <= 100000)),
+                         (-4, amount & (x > 100000))):
+        if mask.any():
+            x[mask] = round_half_even(x[mask], digits)
+    x = np.trunc(x)
+    if (x < 0).any():
+        raise ValueError('CUMBERLAND编码只支持非负整数: {0}'.format(x[x < 0][0]))
+    # 全部数值拼成一个字符串, 一次完成数字到字母的转换
+    codes[idx] = ' '.join(map(str, map(int, x.tolist()))).translate(CUMBERLAND).split(' ')
+    return codes
+
+
+@instrument.stage()
+def encode_features(features):
+    """
+    一份报告的变量 clean 后 mapping
+    :param features:
+    :return:
+    """
+    return encode_feature_dicts([features])[0]
+
+
+def encode_feature_dicts(features_list):
+    """
+    多份报告的变量一次编码, 结果与逐份 encode_features 相同
+    :param features_list: [dict]
+    :return: [dict]
+    """
+    keys = [k for features in features_list for k in features]
+    codes = encode_values([v for features in features_list for v in features.values()], encoding_plan(keys))
+    rs, start = [], 0
+    for features in features_list:
+        end = start + len(features)
+        rs.append({k: v for k, v in zip(keys[start:end], codes[start:end]) if v is not None})
+        start = end
     return rs
 
 
+def encode_frame(df):
+    """
+    批量编码多份报告的变量, 每行一份报告, 每列一个变量, 编码方式按列名确定一次
+    :param df: DataFrame
+    :return: DataFrame, 不输出的值(空值及0)为None
+    """
+    values = df.to_numpy(dtype=object)
+    plan = np.tile(encoding_plan(df.columns), len(df))
+    codes = encode_values(values.ravel(), plan)
+    return pd.DataFrame(codes.reshape(values.shape), index=df.index, columns=df.columns)
+
+
+def clean(features):
+    """
+    去掉空值, 数值保留5位小数, 为0的数值不输出
+    :param features:
+    :return:
+    """
+    keys = list(features)
+    values = np.asarray(list(features.values()), dtype=object)
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=bool, count=len(values))
+    idx = np.flatnonzero(~is_str & ~pd.isnull(values))
+    values[idx] = round_half_even(values[idx].astype(float), 5).tolist()
+    keep = is_str.copy()
+    keep[idx] = values[idx] != 0
+    return {k: v for k, v, ok in zip(keys, values, keep) if ok}
+
+
 def transfer_education_level(education_level):
     """
     高中
@@ -137,102 +376,149 @@ def transfer_education_level(education_level):
     return 0
 
 
-def loan_debt_cal_logic(x, type_=1):
-    # 贷款本金余额为0，则默认结清，不计算负债
-    # 贷款“转出”的，不计负债  # TODO
-    # 贷款“已结清”的，不计负债
-    if x['settle_type'] == 'stl' or x['balance'] == 0:
-        return 0
-    if type_ == 1:
-        ########################
-        # 明确显示剩余还款期数、明确显示本月应还款额
-        # 明确显示剩余还款期数、未显示本月应还款额（显示为0、-等）
-        # 未明确显示剩余还款期数，明确显示本月应还款额的（例如：不定期归还、双周供、气球贷等）
-        # 未明确显示剩余还款期数，未明确显本月应还款额的
-        ########################
-        if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0:
-            """
-            本金余额*2＞本月应还款额*剩余还款期数＞本金余额，则按显示的本月应还款额计算
-            本月应还款额*剩余还款期数≤本金余额，则按贷款发放金额，按实际贷款期数摊算
-            本月应还款额*剩余贷款期数≥本金余额*2，则按贷款发放金额，按实际贷款期数摊算
-            """
-            if x['balance'] * 2 > x['scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
-                return x['scheduledPaymentAmount']
-            else:
-                return x['credit_limit'] / x['loan_terms']
-        elif not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] == 0:
-            """
-            按贷款发放金额，结合实际贷款期数摊算
-            """
-            if not pd.isnull(x['loan_terms']):
-                return x['credit_limit'] / x['loan_terms']
-            else:
-                return x['credit_limit'] / int((get_time(x['end_date']) - get_time(x['openDate'])).days / 30)
-        elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0:
-            """
-            贷款发放金额*2＞本月应还款额*贷款期数＞贷款发放金额，则按显示的本月应还款额计算
-            本月应还款额*贷款期数≤贷款发放金额，则按贷款发放金额，结合实际贷款期数摊算
-            本月应还款额*贷款期数≥贷款发放金额*2，则按贷款发放金额，结合实际贷款期数摊算
-            """
-            if x['credit_limit'] * 2 > x['scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
-                return x['scheduledPaymentAmount']
-            else:
-                return x['credit_limit'] / x['loan_terms']
-        else:
-            """
-            按贷款发放金额，结合贷款期限摊算，或贷款发放金额*3.5%折算
-            """
-            if not pd.isnull(x['loan_terms']):
-                return x['credit_limit'] / x['loan_terms']
-            elif not pd.isnull(x['end_date']):
-                return x['credit_limit'] / int((get_time(x['end_date']) - get_time(x['openDate'])).days / 30)
-            return x['credit_limit'] * 0.035
-    elif type_ == 2:
-        """简化版本"""
-        if x['loan_type'] == '抵押担保':
-            if x['scheduledPaymentAmount'] != 0:
-                return x['scheduledPaymentAmount']
-            else:
-                return x['credit_limit'] / x['loan_terms']
-        else:
-            if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0:
-                if x['scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
-                    return x['scheduledPaymentAmount']
-                else:
-                    return x['credit_limit'] * 0.035
-    elif type_ == 3:
-        """
-        期供类贷款：条件1或者条件2任意一条满足即可
-        条件1.明确显示剩余还款期数、明确显示本月应还款额的，
-        且本金余额*2＞本月应还款额*剩余还款期数＞本金余额
-        条件2.未明确显示剩余还款期数，明确显示本月应还款额的，
-        且贷款发放金额*2＞本月应还款额*贷款期数＞贷款发放金额
-        """
-        if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['balance'] * 2 > x[
-            'scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
-            return x['scheduledPaymentAmount']
-        elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['credit_limit'] * 2 > x[
-            'scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
-            return x['scheduledPaymentAmount']
-        else:
-            if '银行' in x['loan_from']:
-                if pd.isnull(x['loan_terms']):
-                    return x['credit_limit'] * 0.035
-                if x['loan_terms'] <= 12:
-                    return x['credit_limit'] * 0.09
-                elif x['loan_terms'] <= 35:
-                    return x['credit_limit'] * 0.049
-                else:
-                    return x['credit_limit'] * 0.035
-            else:
-                if pd.isnull(x['loan_terms']):
-                    return x['credit_limit'] * 0.04
-                if x['loan_terms'] <= 12:
-                    return x['credit_limit'] * 0.095
-                elif x['loan_terms'] <= 35:
-                    return x['credit_limit'] * 0.053
-                else:
-                    return x['credit_limit'] * 0.04
+def value_flags(values, predicate):
+    """
+    predicate 逐个判断 values 中不重复的值, 结果按行展开; 适合取值重复多的文本列
+    :param values:
+    :param predicate:
+    :return: bool数组, 空值为False
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    flags = np.zeros(len(uniques) + 1, dtype=bool)
+    flags[:-1] = [predicate(v) for v in uniques]
+    return flags[codes]
+
+
+def row_flags(df, columns, predicate):
+    """
+    predicate(x) 只依赖 columns 时, 按 columns 的不重复组合逐个判断, 结果按行展开
+    :param df:
+    :param columns:
+    :param predicate: 与 DataFrame.apply(predicate, axis=1) 的用法一致
+    :return: bool数组
+    """
+    _, first, inverse = np.unique(row_codes(df, columns), return_index=True, return_inverse=True)
+    values = [df[c].values for c in columns]
+    flags = np.array([bool(predicate(dict(zip(columns, [v[i] for v in values])))) for i in first], dtype=bool)
+    return flags[inverse].reshape(len(df))
+
+
+def row_codes(df, columns):
+    """
+    多列取值组合的编码, 空值视为相同的取值
+    :return: int数组
+    """
+    key = np.zeros(len(df), dtype=np.int64)
+    for c in columns:
+        codes, uniques = pd.factorize(df[c])
+        key = key * (len(uniques) + 1) + codes + 1
+    return key
+
+
+def first_rows(values, by):
+    """
+    每份报告中各取值首次出现的行, 同 drop_duplicates 保留的行
+    :param values:
+    :param by: 每行所属的报告编号
+    :return: bool数组
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    _, first = np.unique(by * (len(uniques) + 1) + codes + 1, return_index=True)
+    rs = np.zeros(len(codes), dtype=bool)
+    rs[first] = True
+    return rs
+
+
+def loan_debt(loan_df):
+    """
+    逐笔贷款的负债, 三种口径及负债分类一次算完
+    贷款本金余额为0, 或已结清的, 不计负债  # TODO 贷款“转出”的, 不计负债
+    debt_sum: 标准口径
+        明确显示剩余还款期数、明确显示本月应还款额:
+            本金余额*2＞本月应还款额*剩余还款期数＞本金余额, 则按显示的本月应还款额计算, 否则按贷款发放金额, 按实际贷款期数摊算
+        明确显示剩余还款期数、未显示本月应还款额(显示为0、-等):
+            按贷款发放金额, 结合实际贷款期数摊算, 没有贷款期数时按发放至到期的月数摊算
+        未明确显示剩余还款期数, 明确显示本月应还款额(例如: 不定期归还、双周供、气球贷等):
+            贷款发放金额*2＞本月应还款额*贷款期数＞贷款发放金额, 则按显示的本月应还款额计算, 否则按贷款发放金额, 结合实际贷款期数摊算
+        未明确显示剩余还款期数, 未明确显本月应还款额:
+            按贷款发放金额, 结合贷款期限摊算, 或贷款发放金额*3.5%折算
+    simple_debt_sum: 简化口径
+        抵押担保的按本月应还款额, 为0时按贷款发放金额按贷款期数摊算;
+        其他贷款明确显示剩余还款期数、本月应还款额的, 本月应还款额*剩余还款期数＞本金余额按本月应还款额, 否则按贷款发放金额*3.5%;
+        其余不计(为空)
+    period_debt_sum: 期供类贷款按本月应还款额, 其他贷款按贷款发放金额及贷款期数折算
+        期供类贷款: 条件1或者条件2任意一条满足即可
+        条件1.明确显示剩余还款期数、明确显示本月应还款额的, 且本金余额*2＞本月应还款额*剩余还款期数＞本金余额
+        条件2.未明确显示剩余还款期数, 明确显示本月应还款额的, 且贷款发放金额*2＞本月应还款额*贷款期数＞贷款发放金额
+    debt_cls: 负债分类, 银行/非银行 × 期供/非期供
+    :param loan_df: 贷款明细
+    :return: dict of 数组, 与 loan_df 的行一一对应
+    """
+    balance = loan_df['balance'].values.astype(float)
+    amount = loan_df['scheduledPaymentAmount'].values.astype(float)
+    remain = loan_df['remainPaymentCyc'].values.astype(float)
+    limit = loan_df['credit_limit'].values.astype(float)
+    terms = loan_df['loan_terms'].values.astype(float)
+    settled = (loan_df['settle_type'].values == 'stl') | (balance == 0)
+    bank = value_flags(loan_df['loan_from'], lambda v: '银行' in v)
+    mortgage = loan_df['loan_type'].values == '抵押担保'
+    has_cyc, has_terms = ~np.isnan(remain), ~np.isnan(terms)
+    # 空值与逐行判断时一致, 视为不等于0
+    has_amount = amount != 0
+    has_end = ~pd.isnull(loan_df['end_date'].values)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        by_terms = limit / terms
+        # 没有贷款期数时按发放至到期的月数摊算, 这类贷款很少, 逐笔计算
+        by_months = np.full(len(loan_df), np.nan)
+        for i in np.flatnonzero(~settled & ~has_amount & ~has_terms & has_end):
+            by_months[i] = limit[i] / int((get_time(loan_df['end_date'].values[i]) -
+                                           get_time(loan_df['openDate'].values[i])).days / 30)
+        remain_total = amount * remain
+        terms_total = amount * terms
+        in_remain = (balance * 2 > remain_total) & (remain_total > balance)
+        in_terms = (limit * 2 > terms_total) & (terms_total > limit)
+    period = (has_cyc & has_amount & in_remain) | (~has_cyc & has_amount & in_terms)
+
+    debt_sum = np.select(
+        [settled, has_cyc & has_amount & in_remain, has_cyc & has_amount, has_cyc & has_terms, has_cyc,
+         has_amount & in_terms, has_amount, has_terms, has_end],
+        [0., amount, by_terms, by_terms, by_months, amount, by_terms, by_terms, by_months], limit * 0.035)
+    simple_debt_sum = np.select(
+        [settled, mortgage & has_amount, mortgage, has_cyc & has_amount & (remain_total > balance),
+         has_cyc & has_amount],
+        [0., amount, by_terms, amount, limit * 0.035], np.nan)
+    rate = np.select([bank & ~has_terms, bank & (terms <= 12), bank & (terms <= 35), bank,
+                      ~has_terms, terms <= 12, terms <= 35], [0.035, 0.09, 0.049, 0.035, 0.04, 0.095, 0.053], 0.04)
+    period_debt_sum = np.select([settled, period], [0., amount], limit * rate)
+    return {'debt_sum': debt_sum, 'simple_debt_sum': simple_debt_sum, 'period_debt_sum': period_debt_sum,
+            'debt_cls': DEBT_CLASSES[(~bank) * 2 + period]}
+
+
+def card_debt(card_df):
+    """
+    贷记卡 准贷记卡
+    未销户贷记卡信息汇总中的已用额度,信用卡：已用额度 * 10 %
+    未销户准贷记卡信息汇总中的透支余额,准贷记卡：透支余额 * 10 %
+    """
+    return np.where(card_df['accountState'].values == '正常', card_df['used_credit_limit'].values.astype(float) * 0.1, 0.)
+
+
+def report_sums(values, by, n_reports, where=None):
+    """
+    各报告的和(忽略空值)及行数, 报告内按原顺序累加, 与逐份 np.sum 的结果一致
+    :param values:
+    :param by: 每行所属的报告编号
+    :param n_reports: 报告数
+    :param where: 参与计算的行
+    :return: (各报告的和, 各报告的行数)
+    """
+    if where is not None:
+        values, by = values[where], by[where]
+    order = np.argsort(by, kind='stable')
+    values, by = values[order], by[order]
+    bounds = np.searchsorted(by, np.arange(n_reports + 1))
+    return [np.nansum(values[bounds[i]:bounds[i + 1]]) for i in range(n_reports)], np.diff(bounds)
 
 
 def detail_processing(x):
@@ -265,64 +551,6 @@ def detail_processing(x):
                 return 2, x['credit_limit'] * 0.04, 0.04
 
 
-def credit_card_debt_cal_logic(x):
-    """
-    贷记卡 准贷记卡
-    未销户贷记卡信息汇总中的已用额度,信用卡：已用额度 * 10 %
-    未销户准贷记卡信息汇总中的透支余额,准贷记卡：透支余额 * 10 %
-    """
-    if x['accountState'] == '正常':
-        return x['used_credit_limit'] * 0.1
-    else:
-        return 0
-
-
-def pboc_debt_loan(loan_df, loan_card, standard_loan_card, type_=1):
-    debt_sum = 0
-    simple_debt_sum = 0
-    features = dict()
-
-    ldf = loan_df.copy()
-    if len(ldf) != 0:
-        ldf['debt_sum'] = ldf.apply(lambda x: loan_debt_cal_logic(x, type_=type_), axis=1)
-        ldf['debt_cls'] = ldf.apply(lambda x: loan_debt_cls(x), axis=1)
-        ldf['simple_debt_sum'] = ldf.apply(lambda x: loan_debt_cal_logic(x, type_=2), axis=1)
-        debt_sum = np.sum(ldf['debt_sum'])
-        simple_debt_sum = np.sum(ldf['simple_debt_sum'])
-        # 负债分类
-        rs = ldf.groupby(['debt_cls'])['debt_sum'].sum()
-        for ix in rs.index:
-            features['pboc_debt_ln_{0}'.format(ix)] = rs[ix]
-    if len(loan_card) != 0:
-        loan_card = loan_card.drop_duplicates(['account']).copy()
-        rs9 = np.sum(loan_card.apply(credit_card_debt_cal_logic, axis=1))
-        features['pboc_debt_loan_card'] = rs9
-        debt_sum += rs9
-        simple_debt_sum += rs9
-    if len(standard_loan_card) != 0:
-        standard_loan_card = standard_loan_card.drop_duplicates(['account']).copy()
-        rs10 = np.sum(standard_loan_card.apply(credit_card_debt_cal_logic, axis=1))
-        features['pboc_debt_standard_loan_card'] = rs10
-        debt_sum += rs10
-        simple_debt_sum += rs10
-
-    return round(debt_sum, 2), round(simple_debt_sum, 2), ldf[['debt_sum', 'account']] if len(ldf) > 0 else '', features
-
-
-def loan_debt_cls(x: pd.Series):
-    if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['balance'] * 2 > x[
-        'scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
-        return 'bank_period' if '银行' in x['loan_from'] else 'nbank_period'
-    elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['credit_limit'] * 2 > x[
-        'scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
-        return 'bank_period' if '银行' in x['loan_from'] else 'nbank_period'
-    else:
-        if '银行' in x['loan_from']:
-            return 'bank_nperiod'
-        else:
-            return 'nbank_nperiod'
-
-
 def detail_process_debt(loan_df):
     if len(loan_df) == 0:
         return ''
@@ -331,23 +559,75 @@ def detail_process_debt(loan_df):
     return se.to_json()
 
 
+@instrument.stage()
 def debt_variables(pboc):
     """负债计算变量"""
-    features = dict()
-    loan_df = pboc.loan_detail.copy()
-    loan_card = pboc.credit_card_detail.copy()
-    standard_loan_card = pboc.standard_credit_card_detail.copy()
-    features['pboc_debt_loan_001'], features['pboc_debt_loan_002'], _, _ = pboc_debt_loan(loan_df, loan_card,
-                                                                                          standard_loan_card)
-    loan_df = pboc.loan_detail.copy()
-    loan_df = loan_df.drop_duplicates(['account'])
-    # loan_df = loan_df[loan_df.apply(debt_type_check, axis=1)]
-    ld1 = loan_df[loan_df.apply(debt_type_check, axis=1)]
-    ld2 = loan_df[loan_df.apply(debt_type_check_v1, axis=1)]
-    features['pboc_debt_loan_003'] = pboc_debt_loan(ld1, loan_card, standard_loan_card, type_=1)[0]
-    features['pboc_debt_loan_004'], _, ldf, loan_features = pboc_debt_loan(ld2, loan_card, standard_loan_card, type_=3)
-    # features['pboc_debt_loan_004_dt'] = detail_process_debt(ld2) + '||' + str(ldf).replace('\n', '|')
-    features.update(loan_features)
+    return debt_features(pboc.loan_detail, pboc.credit_card_detail, pboc.standard_credit_card_detail)[0]
+
+
+def _report_ids(df, n_reports):
+    if n_reports is None:
+        return np.zeros(len(df), dtype=np.int64)
+    return df['report_id'].values.astype(np.int64)
+
+
+def debt_features(loan_df, loan_card, standard_loan_card, n_reports=None):
+    """
+    负债计算变量, 贷款的三种口径一次算完
+    pboc_debt_loan_001/002: 全部贷款的 debt_sum/simple_debt_sum
+    pboc_debt_loan_003: 按账户去重后, debt_type_check 计入负债的贷款的 debt_sum
+    pboc_debt_loan_004: 按账户去重后, debt_type_check_v1 计入负债的贷款的 period_debt_sum, 及按 debt_cls 的分类汇总
+    以上均加上去重后的贷记卡、准贷记卡负债
+    :param loan_df: 贷款明细
+    :param loan_card: 贷记卡明细
+    :param standard_loan_card: 准贷记卡明细
+    :param n_reports: 多份报告时为报告数, 明细为 concat_details 拼接的明细; 为None时明细属于同一份报告
+    :return: 各报告的变量
+    """
+    n = 1 if n_reports is None else n_reports
+    cards = []
+    for df in (loan_card, standard_loan_card):
+        if len(df) == 0:
+            cards.append(([0] * n, np.zeros(n, dtype=np.int64)))
+            continue
+        by = _report_ids(df, n_reports)
+        first = first_rows(df['account'], by)
+        cards.append(report_sums(card_debt(df), by, n, first))
+
+    def with_cards(sums, counts, r):
+        total = sums[r] if counts[r] else 0
+        for card_sums, card_counts in cards:
+            if card_counts[r]:
+                total += card_sums[r]
+        return round(total, 2)
+
+    if len(loan_df) != 0:
+        by = _report_ids(loan_df, n_reports)
+        debt = loan_debt(loan_df)
+        first = first_rows(loan_df['account'], by)
+        check = first & row_flags(loan_df, ['loan_from', 'loan_type', 'type'], debt_type_check)
+        check_v1 = first & row_flags(loan_df, ['loan_from', 'loan_type', 'type'], debt_type_check_v1)
+        sums = [report_sums(debt['debt_sum'], by, n), report_sums(debt['simple_debt_sum'], by, n),
+                report_sums(debt['debt_sum'], by, n, check), report_sums(debt['period_debt_sum'], by, n, check_v1)]
+        cls_sums = pd.Series(debt['period_debt_sum'][check_v1]).groupby(
+            [by[check_v1], debt['debt_cls'][check_v1]]).sum()
+    else:
+        sums = [([0] * n, np.zeros(n, dtype=np.int64))] * 4
+        cls_sums = pd.Series(dtype=float)
+
+    features = []
+    for r in range(n):
+        feature = dict()
+        for i, (s, c) in enumerate(sums):
+            feature['pboc_debt_loan_00{0}'.format(i + 1)] = with_cards(s, c, r)
+        features.append(feature)
+    # 负债分类
+    for (r, cls), v in cls_sums.items():
+        features[r]['pboc_debt_ln_{0}'.format(cls)] = v
+    for r in range(n):
+        for name, (card_sums, card_counts) in zip(['pboc_debt_loan_card', 'pboc_debt_standard_loan_card'], cards):
+            if card_counts[r]:
+                features[r][name] = card_sums[r]
     return features
 
 
@@ -495,49 +775,226 @@ def hbxd_house_loan_type_check(x, level=1):
                 return False
 
 
-def hbxd_house_loan_admission(x):
+def hbxd_house_loan_admission(loan_df):
     """
-
-    :param x:
-    :return:
+    房贷准入: 未结清, 贷款期数24期以上(没有期数的不限), 且按月还款
+    :param loan_df: 贷款明细
+    :return: bool数组
     """
-    if x['settle_type'] == 'stl':
-        return False
-    elif x['loan_terms'] <= 24:
-        return False
-    elif not _is_repay_monthly(x):
-        return False
-    return True
+    terms = loan_df['loan_terms'].values.astype(float)
+    return (loan_df['settle_type'].values != 'stl') & ~(terms <= 24) & _is_repay_monthly(loan_df)
 
 
-def _is_repay_monthly(x):
+def _is_repay_monthly(loan_df):
+    """
+    按月还款: 明确显示剩余还款期数、本月应还款额, 且本金余额*2＞本月应还款额*剩余还款期数＞本金余额;
+    或未明确显示剩余还款期数, 明确显示本月应还款额, 且贷款发放金额*2＞本月应还款额*贷款期数＞贷款发放金额
+    :param loan_df: 贷款明细
+    :return: bool数组
     """
+    balance = loan_df['balance'].values.astype(float)
+    amount = loan_df['scheduledPaymentAmount'].values.astype(float)
+    remain = loan_df['remainPaymentCyc'].values.astype(float)
+    limit = loan_df['credit_limit'].values.astype(float)
+    terms = loan_df['loan_terms'].values.astype(float)
+    has_cyc = ~np.isnan(remain)
+    remain_total, terms_total = amount * remain, amount * terms
+    in_remain = (balance * 2 > remain_total) & (remain_total > balance)
+    in_terms = (limit * 2 > terms_total) & (terms_total > limit)
+    # 空值与逐行判断时一致, 视为不等于0
+    return (amount != 0) & np.where(has_cyc, in_remain, in_terms)
 
-    :param x:
-    :return:
+
+def _any_hit(counts):
+    return counts['hit'] > 0
+
+
+# 负面规则: conditions 为 {条件名: 按列计算的逐行条件 f(RuleColumns) -> bool数组}, 只有一个条件时可直接给出函数(条件名为hit);
+# hit 由各报告满足各条件的行数(另有 rows 为明细行数)判定是否命中, 默认为有满足条件的行;
+# distinct 不为空时, 满足条件的行按这些列去重后再计数
+NegativeRule = namedtuple('NegativeRule', ['name', 'conditions', 'hit', 'distinct'], defaults=(_any_hit, None))
+
+
+class RuleColumns(object):
+    """
+    负面规则的取列: [col] 为原值数组, num(col) 为数值数组(空值为nan), 转换过的列缓存
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.cache = {}
+
+    def __getitem__(self, col):
+        return self.df[col].values
+
+    def num(self, col):
+        if col not in self.cache:
+            self.cache[col] = self.df[col].values.astype(float)
+        return self.cache[col]
+
+    def isin(self, col, values):
+        return value_flags(self.df[col], lambda v: v in values)
+
+
+def _normal(c):
+    return c['accountState'] == '正常'
+
+
+def _due(c, last_months, months):
+    """ 近months个月内出现连续逾期超过last_months个月的还款记录 """
+    return (c.num('due_last_months') > last_months) & (c.num('months') <= months)
+
+
+def _recent(c):
+    """ 近24个月内有更新 """
+    return c.num('up_to_days') <= 365 * 2
+
+
+def _unused(c):
+    """ 已激活但未使用 """
+    return ~c.isin('accountState', ('销户', '未激活')) & (c.num('usedHighestAmount') <= 0)
+
+
+def _due_3_or_6(counts):
+    # 出现连续3个月逾期，或者累计出现6次逾期记录
+    return (counts['due3'] > 0) | (counts['due'] >= 6)
+
+
+QUERY_NEGATIVE_RULES = [
+    # 在不含本笔的情况下，借款人的人行报告显示近2个月内分别有5次（含）以上信用查询记录，且查询原因是“贷款审批”或“信用卡审批”的，不予接受；但确认为同一银行在一个月（自然日）内同一原因查询的，可以算作一次查询记录；
+    NegativeRule('pboc_negative_query_001', lambda c: (c.num('days') <= 60) & (c['query_reason'] == 'xs'),
+                 lambda counts: counts['hit'] >= 5, distinct=['querier', 'query_reason']),
+]
+LOAN_NEGATIVE_RULES = [
+    # 24个月内出现4
+    NegativeRule('pboc_negative_loan_001', lambda c: _due(c, 3, 24)),
+    # 12个月内出现3
+    NegativeRule('pboc_negative_loan_002', lambda c: _due(c, 2, 12)),
+    # 6个月内出现2
+    NegativeRule('pboc_negative_loan_003', lambda c: _due(c, 1, 6)),
+    # 当前逾期，即最近一期出现1、2、3……
+    NegativeRule('pboc_negative_loan_004', lambda c: c.num('currOverdueAmount') > 0),
+    # 贷款五级分类：次级、可疑、损失
+    NegativeRule('pboc_negative_loan_005', lambda c: c.isin('class5State', ('次级', '可疑', '损失'))),
+    # 已到期未结清（“结清”文字优先，未结清看逻辑：到期时间早于报告时间，且本金余额>0为未结清）
+    NegativeRule('pboc_negative_loan_006', lambda c: (c.num('end_days') > 0) & (c['settle_type'] == 'ustl')),
+    # 近24个月内贷款，出现连续3个月逾期，或者累计出现6次逾期记录
+    NegativeRule('pboc_negative_loan_007', {'due3': lambda c: _due(c, 2, 24), 'due': lambda c: _due(c, 0, 24)},
+                 _due_3_or_6),
+]
+LOAN_CARD_NEGATIVE_RULES = [
+    # “最大使用额度”＞1000，且最近24个月内有1次（含）以上连续逾期91天记录；（出现4）
+    NegativeRule('pboc_negative_lc_001', lambda c: _normal(c) & (c.num('usedHighestAmount') > 1000) & _due(c, 3, 24)),
+    # “最大使用额度”＞1000，且最近6个月内有1次（含）以上逾期达61天记录；（出现3）
+    NegativeRule('pboc_negative_lc_002', lambda c: _normal(c) & (c.num('usedHighestAmount') > 1000) & _due(c, 2, 6)),
+    # “最大使用额度”＞1000，且最近3个月内有1次逾期达31天记录；（出现2）
+    NegativeRule('pboc_negative_lc_003', lambda c: _normal(c) & (c.num('usedHighestAmount') > 1000) & _due(c, 1, 3)),
+    # 当前逾期金额＞1000
+    NegativeRule('pboc_negative_lc_004', lambda c: _normal(c) & (c.num('currOverdueAmount') > 1000)),
+    # 近24个月内贷记卡，出现连续3个月逾期，或者累计出现6次逾期记录
+    NegativeRule('pboc_negative_lc_005', {'due3': lambda c: _normal(c) & _due(c, 2, 24),
+                                          'due': lambda c: _normal(c) & _due(c, 0, 24)}, _due_3_or_6),
+]
+STANDARD_LOAN_CARD_NEGATIVE_RULES = [
+    # “最大透支余额”＞1000，且最近24个月内有1次（含）以上连续逾期达91天记录；
+    NegativeRule('pboc_negative_slc_001', lambda c: _normal(c) & (c.num('usedHighestAmount') > 1000) & _due(c, 3, 24)),
+    # “最大透支余额”＞1000，且最近12个月内有1次（含）以上逾期达61天记录；
+    NegativeRule('pboc_negative_slc_002', lambda c: _normal(c) & (c.num('usedHighestAmount') > 1000) & _due(c, 2, 12)),
+    # 当期有“透支余额”＞1000，且还款记录出现“3”及以上状态的准贷记卡
+    NegativeRule('pboc_negative_slc_003', lambda c: _normal(c) & (c.num('used_credit_limit') > 1000) &
+                                                    (c.num('due_last_months') > 2)),
+    # 近24个月内准贷记卡，出现连续3个月逾期，或者累计出现6次逾期记录
+    NegativeRule('pboc_negative_slc_004', {'due3': lambda c: _normal(c) & _due(c, 2, 24),
+                                           'due': lambda c: _normal(c) & _due(c, 0, 24)}, _due_3_or_6),
+]
+# 在贷记卡明细上计算的空白报告规则
+BLANK_NEGATIVE_RULES = [
+    # 近24个月仅有未激活的信用卡
+    NegativeRule('pboc_negative_blank_002', {'only': lambda c: (c['accountState'] == '未激活') & _recent(c),
+                                             'other': lambda c: (c['accountState'] != '未激活') & _recent(c)},
+                 lambda counts: (counts['only'] > 0) & (counts['other'] == 0)),
+    # 近24个月仅有已销户且无正常还款记录的信用卡
+    # 无正常还款记录的判断条件无法确认 TODO
+    NegativeRule('pboc_negative_blank_003', {'only': lambda c: (c['accountState'] == '销户') & _recent(c),
+                                             'other': lambda c: (c['accountState'] != '销户') & _recent(c)},
+                 lambda counts: (counts['only'] > 0) & (counts['other'] == 0)),
+    # 贷记卡、准贷记卡近12个月无使用记录且授信额度为0
+    # 与原逐行判断的结果一致, 只看贷记卡: 有贷记卡且授信额度均为0
+    NegativeRule('pboc_negative_blank_005', {'zero': lambda c: c.num('credit_limit') == 0},
+                 lambda counts: (counts['rows'] > 0) & (counts['zero'] == counts['rows'])),
+    # 近24个月仅有已激活但未使用的信用卡
+    NegativeRule('pboc_negative_blank_006', {'only': lambda c: _recent(c) & _unused(c),
+                                             'other': lambda c: _recent(c) & ~_unused(c)},
+                 lambda counts: (counts['only'] > 0) & (counts['other'] == 0)),
+]
+NEGATIVE_RULES = {rule.name: rule for rules in (QUERY_NEGATIVE_RULES, LOAN_NEGATIVE_RULES, LOAN_CARD_NEGATIVE_RULES,
+                                                STANDARD_LOAN_CARD_NEGATIVE_RULES, BLANK_NEGATIVE_RULES)
+                  for rule in rules}
+
+
+def evaluate_rules(rules, df, by=None, n_reports=1):
+    """
+    一次计算多条负面规则: 各条件按列算出逐行的结果, 按报告统计满足条件的行数, 再由各规则的 hit 判定
+    :param rules: [NegativeRule]
+    :param df: 明细, 多份报告时为 concat_details 拼接的明细
+    :param by: 每行所属的报告编号
+    :param n_reports: 报告数
+    :return: (报告数, 规则数) 的0/1矩阵
+    """
+    by = np.zeros(len(df), dtype=np.int64) if by is None else np.asarray(by, dtype=np.int64)
+    rows = np.bincount(by, minlength=n_reports)
+    columns = RuleColumns(df)
+    hits = np.zeros((n_reports, len(rules)), dtype=np.int64)
+    for j, rule in enumerate(rules):
+        conditions = rule.conditions if isinstance(rule.conditions, dict) else {'hit': rule.conditions}
+        counts = {'rows': rows}
+        for key, condition in conditions.items():
+            if len(df) == 0:
+                counts[key] = np.zeros(n_reports, dtype=np.int64)
+                continue
+            idx = np.flatnonzero(condition(columns))
+            if rule.distinct is not None:
+                idx = idx[first_rows(row_codes(df.iloc[idx], rule.distinct), by[idx])]
+            counts[key] = np.bincount(by[idx], minlength=n_reports)
+        hits[:, j] = rule.hit(counts)
+    return hits
+
+
+def negative_rule_features(rules, df, by=None, n_reports=1, skip_empty=False):
     """
-    if not pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['balance'] * 2 > x[
-        'scheduledPaymentAmount'] * x['remainPaymentCyc'] > x['balance']:
-        return True
-    elif pd.isnull(x['remainPaymentCyc']) and x['scheduledPaymentAmount'] != 0 and x['credit_limit'] * 2 > x[
-        'scheduledPaymentAmount'] * x['loan_terms'] > x['credit_limit']:
-        return True
-    else:
-        return False
+    负面规则的变量
+    :param rules: [NegativeRule]
+    :param df: 明细, 多份报告时为 concat_details 拼接的明细
+    :param by: 每行所属的报告编号
+    :param n_reports: 报告数
+    :param skip_empty: 没有明细的报告不输出
+    :return: 各报告的 {变量名: 0/1}
+    """
+    hits = evaluate_rules(rules, df, by, n_reports)
+    empty = [len(df) == 0] if by is None else np.bincount(np.asarray(by, dtype=np.int64), minlength=n_reports) == 0
+    return [dict() if skip_empty and empty[r] else {rule.name: int(hits[r, j]) for j, rule in enumerate(rules)}
+            for r in range(n_reports)]
+
+
+def negative_rule(name, df):
+    """ 在一份报告的明细上计算一条负面规则 """
+    return int(evaluate_rules([NEGATIVE_RULES[name]], df)[0, 0])
 
 
+@instrument.stage()
 def rule_direct_variables(pboc, obj):
     features = dict()
     lc = pboc.credit_card_detail
     slc = pboc.standard_credit_card_detail
     loan = pboc.loan_detail
+    blank = negative_rule_features(BLANK_NEGATIVE_RULES, lc)[0]
     features['pboc_negative_blank_001'] = pboc_negative_blank_001(loan, lc, slc)
-    features['pboc_negative_blank_002'] = pboc_negative_blank_002(lc)
-    features['pboc_negative_blank_003'] = pboc_negative_blank_003(lc)
+    features['pboc_negative_blank_002'] = blank['pboc_negative_blank_002']
+    features['pboc_negative_blank_003'] = blank['pboc_negative_blank_003']
     # 近24个月有对外担保信息，但无其他当前正常使用的信贷记录
     features['pboc_negative_blank_004'] = 0  # TODO
-    features['pboc_negative_blank_005'] = pboc_negative_blank_005(lc, slc)
-    features['pboc_negative_blank_006'] = pboc_negative_blank_006(lc)
+    features['pboc_negative_blank_005'] = blank['pboc_negative_blank_005']
+    features['pboc_negative_blank_006'] = blank['pboc_negative_blank_006']
     #
     features['pboc_negative_black_001'] = pboc_negative_black_001(obj)
     features['pboc_negative_black_002'] = 0  # TODO
@@ -581,22 +1038,7 @@ def pboc_negative_blank_002(lc):
     :param lc:
     :return:
     """
-
-    def ck(x):
-        if x['accountState'] == '未激活' and not pd.isnull(x['up_to_days']) and x['up_to_days'] <= 365 * 2:
-            return 1
-        elif not pd.isnull(x['up_to_days']) and x['up_to_days'] <= 365 * 2:
-            return 2
-        else:
-            return 0
-
-    tag = lc.apply(ck, axis=1)
-    if len(tag[tag == 1]) == 0:
-        return 0
-    elif len(tag[tag == 2]) == 0:
-        return 1
-    else:
-        return 0
+    return negative_rule('pboc_negative_blank_002', lc)
 
 
 def pboc_negative_blank_003(lc):
@@ -605,50 +1047,17 @@ def pboc_negative_blank_003(lc):
     :param lc:
     :return:
     """
-
-    # 无正常还款记录的判断条件无法确认 TODO
-    def ck(x):
-        if x['accountState'] == '销户' and not pd.isnull(x['up_to_days']) and x['up_to_days'] <= 365 * 2:
-            return 1
-        elif not pd.isnull(x['up_to_days']) and x['up_to_days'] <= 365 * 2:
-            return 2
-        else:
-            return 0
-
-    tag = lc.apply(ck, axis=1)
-    if len(tag[tag == 1]) == 0:
-        return 0
-    elif len(tag[tag == 2]) == 0:
-        return 1
-    else:
-        return 0
+    return negative_rule('pboc_negative_blank_003', lc)
 
 
 def pboc_negative_blank_005(lc, slc):
     """
     贷记卡、准贷记卡近12个月无使用记录且授信额度为0
     :param lc:
-    :param slc:
+    :param slc: 与原逐行判断的结果一致, 不参与判断
     :return:
     """
-
-    def ck(x):
-        if not pd.isnull(x['up_to_days']) and x['up_to_days'] <= 365 and x['credit_limit'] == 0:
-            return True
-        elif x['credit_limit'] == 0:
-            return True
-        else:
-            return False
-
-    tag = lc.apply(ck, axis=1)
-    if len(lc) == 0 and len(slc) == 0:
-        return 0
-    elif len(lc) != 0 and len(lc[-tag]) != 0:
-        return 0
-    elif len(slc) != 0 and len(slc[-tag]) != 0:
-        return 0
-    else:
-        return 1
+    return negative_rule('pboc_negative_blank_005', lc)
 
 
 def pboc_negative_blank_006(lc):
@@ -657,226 +1066,83 @@ def pboc_negative_blank_006(lc):
     :param lc:
     :return:
     """
-
-    def ck(x):
-        if pd.isnull(x['up_to_days']):
-            return 0
-        elif x['up_to_days'] <= 365 * 2 and x['accountState'] not in ['销户', '未激活'] and x['usedHighestAmount'] <= 0:
-            return 1
-        elif x['up_to_days'] <= 365 * 2:
-            return 2
-        else:
-            return 0
-
-    tag = lc.apply(ck, axis=1)
-    if len(lc) == 0:
-        return 0
-    elif len(lc[tag == 1]) == 0:
-        return 0
-    elif len(lc[tag == 2]) == 0:
-        return 1
-    else:
-        return 0
+    return negative_rule('pboc_negative_blank_006', lc)
 
 
 def pboc_negative_black_001(obj):
     # 呆账、核销、（冻结、止付)、担保人代偿/保证人代偿、以资抵债
-    obj_str = obj['body_str']
-    for kw in ['呆账', '核销', '冻结', '止付', '担保人代偿', '保证人代偿', '以资抵债']:
-        if kw in obj_str:
+    hits = obj.get('keyword_hits')
+    if hits is None:
+        # 旧版json没有关键词索引, 只有文字版报告
+        hits = {kw: int(kw in obj['body_str']) for kw in tojson.KEYWORDS}
+    # 关键词在 tojson.KEYWORDS 中统一维护, 较早解析的json可能缺少新增的关键词
+    for kw in tojson.KEYWORDS:
+        if hits.get(kw, 0) > 0:
             return 1
 
 
 def pboc_negative_loan_001(loan_info):
-    def ck(x):
-        # 24个月内出现4
-        if x['due_last_months'] > 3 and x['months'] <= 24:
-            return True
-        return False
-
-    return 1 if len(loan_info[loan_info.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_loan_001', loan_info)
 
 
 def pboc_negative_loan_002(loan_info):
-    def ck(x):
-        # 12个月内出现3
-        if x['due_last_months'] > 2 and x['months'] <= 12:
-            return True
-        return False
-
-    return 1 if len(loan_info[loan_info.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_loan_002', loan_info)
 
 
 def pboc_negative_loan_003(loan_info):
-    def ck(x):
-        # 6个月内出现2
-        if x['due_last_months'] > 1 and x['months'] <= 6:
-            return True
-        return False
-
-    return 1 if len(loan_info[loan_info.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_loan_003', loan_info)
 
 
 def pboc_negative_loan_004(loan_info):
-    def ck(x):
-        # 当前逾期，即最近一期出现1、2、3……
-        if x['currOverdueAmount'] > 0:
-            return True
-        return False
-
-    return 1 if len(loan_info[loan_info.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_loan_004', loan_info)
 
 
 def pboc_negative_loan_005(loan_info):
-    def ck(x):
-        # 贷款五级分类：次级、可疑、损失
-        if x['class5State'] in ('次级', '可疑', '损失'):
-            return True
-        return False
-
-    return 1 if len(loan_info[loan_info.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_loan_005', loan_info)
 
 
 def pboc_negative_loan_006(loan_info):
-    def ck(x):
-        # 已到期未结清（“结清”文字优先，未结清看逻辑：到期时间早于报告时间，且本金余额>0为未结清）
-        if x['end_days'] is not None and x['end_days'] > 0 and x['settle_type'] == 'ustl':
-            return True
-        return False
-
-    return 1 if len(loan_info[loan_info.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_loan_006', loan_info)
 
 
 def pboc_negative_loan_007(loan_info):
-    def ck1(x):
-        # 近24个月内贷款，出现连续3个月逾期，或者累计出现6次逾期记录
-        if x['due_last_months'] >= 3 and x['months'] <= 24:
-            return True
-        return False
-
-    def ck2(x):
-        # 近24个月内贷款，出现连续3个月逾期，或者累计出现6次逾期记录
-        if x['due_last_months'] >= 1 and x['months'] <= 24:
-            return True
-        return False
-
-    if len(loan_info[loan_info.apply(ck1, axis=1)]) > 0 or len(loan_info[loan_info.apply(ck2, axis=1)]) >= 6:
-        return 1
-    else:
-        return 0
+    return negative_rule('pboc_negative_loan_007', loan_info)
 
 
 def pboc_negative_lc_001(lc):
-    def ck(x):
-        # “最大使用额度”＞1000，且最近24个月内有1次（含）以上连续逾期91天记录；（出现4）
-        if x['accountState'] == '正常' and x['usedHighestAmount'] > 1000 and x['due_last_months'] > 3 and x[
-            'months'] <= 24:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_lc_001', lc)
 
 
 def pboc_negative_lc_002(lc):
-    def ck(x):
-        # “最大使用额度”＞1000，且最近6个月内有1次（含）以上逾期达61天记录；（出现3）
-        if x['accountState'] == '正常' and x['usedHighestAmount'] > 1000 and x['due_last_months'] > 2 and x[
-            'months'] <= 6:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_lc_002', lc)
 
 
 def pboc_negative_lc_003(lc):
-    def ck(x):
-        # “最大使用额度”＞1000，且最近3个月内有1次逾期达31天记录；（出现2）
-        if x['accountState'] == '正常' and x['usedHighestAmount'] > 1000 and x['due_last_months'] > 1 and x[
-            'months'] <= 3:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_lc_003', lc)
 
 
 def pboc_negative_lc_004(lc):
-    def ck(x):
-        # “最大使用额度”＞1000，且最近3个月内有1次逾期达31天记录；（出现2）
-        if x['accountState'] == '正常' and x['currOverdueAmount'] > 1000:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_lc_004', lc)
 
 
 def pboc_negative_lc_005(lc):
-    def ck1(x):
-        # 近24个月内贷记卡，出现连续3个月逾期，或者累计出现6次逾期记录
-        if x['accountState'] == '正常' and x['due_last_months'] >= 3 and x['months'] <= 24:
-            return True
-        return False
-
-    def ck2(x):
-        # 近24个月内贷记卡，出现连续3个月逾期，或者累计出现6次逾期记录
-        if x['accountState'] == '正常' and x['due_last_months'] >= 1 and x['months'] <= 24:
-            return True
-        return False
-
-    if len(lc[lc.apply(ck1, axis=1)]) > 0 or len(lc[lc.apply(ck2, axis=1)]) >= 6:
-        return 1
-    else:
-        return 0
+    return negative_rule('pboc_negative_lc_005', lc)
 
 
 def pboc_negative_slc_001(lc):
-    def ck(x):
-        # “最大透支余额”＞1000，且最近24个月内有1次（含）以上连续逾期达91天记录；
-        if x['accountState'] == '正常' and x['usedHighestAmount'] > 1000 and x['due_last_months'] > 3 and x[
-            'months'] <= 24:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_slc_001', lc)
 
 
 def pboc_negative_slc_002(lc):
-    def ck(x):
-        # “最大透支余额”＞1000，且最近12个月内有1次（含）以上逾期达61天记录；
-        if x['accountState'] == '正常' and x['usedHighestAmount'] > 1000 and x['due_last_months'] > 2 and x[
-            'months'] <= 12:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_slc_002', lc)
 
 
 def pboc_negative_slc_003(lc):
-    def ck(x):
-        # 当期有“透支余额”＞1000，且还款记录出现“3”及以上状态的准贷记卡
-        if x['accountState'] == '正常' and x['used_credit_limit'] > 1000 and x['due_last_months'] > 2:
-            return True
-        return False
-
-    return 1 if len(lc[lc.apply(ck, axis=1)]) > 0 else 0
+    return negative_rule('pboc_negative_slc_003', lc)
 
 
 def pboc_negative_slc_004(lc):
-    def ck1(x):
-        # 近24个月内准贷记卡，出现连续3个月逾期，或者累计出现6次逾期记录
-        if x['accountState'] == '正常' and x['due_last_months'] >= 3 and x['months'] <= 24:
-            return True
-        return False
-
-    def ck2(x):
-        # 近24个月内准贷记卡，出现连续3个月逾期，或者累计出现6次逾期记录
-        if x['accountState'] == '正常' and x['due_last_months'] >= 1 and x['months'] <= 24:
-            return True
-        return False
-
-    if len(lc[lc.apply(ck1, axis=1)]) > 0 or len(lc[lc.apply(ck2, axis=1)]) >= 6:
-        return 1
-    else:
-        return 0
+    return negative_rule('pboc_negative_slc_004', lc)
 
 
 def cal_used_credit_limit_percent(obj):
@@ -955,6 +1221,170 @@ def filter_feature(features):
     return rs_features
 
 
+def window_membership(values, windows):
+    """
+    每行是否落在各时间窗口内(<=), 空值不属于任何窗口
+    :param values: 天数/月数
+    :param windows: TIME_WINDOW/TIME_WINDOW_V2
+    :return: (行数, 窗口数) 的bool矩阵
+    """
+    values = np.asarray(values, dtype=float)
+    return values[:, None] <= np.array(list(windows.values()), dtype=float)
+
+
+def token_membership(values, tokens):
+    """
+    逗号分隔的取值(如 'bank,hs', 'xs,dq')是否包含各类别
+    :param values:
+    :param tokens: 类别列表, None表示不限
+    :return: (行数, 类别数) 的bool矩阵
+    """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    table = np.array([[t is None or t in u.split(',') for t in tokens] for u in uniques], dtype=bool)
+    return table.reshape(len(uniques), len(tokens))[codes]
+
+
+def _factorize(values):
+    """ 编码, 空值单独为一类(同 set() 的计数方式) """
+    codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+    return np.where(codes < 0, len(uniques), codes)
+
+
+def _starts(codes):
+    """ 已排序的编码中每段的起始位置 """
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+
+
+class WindowGroups(object):
+    """
+    (报告 ×) 时间窗口 × 类别 的分组聚合
+    每行对各维度的归属只判断一次, 笛卡尔积后得到 (行数, 分组数) 的bool矩阵, 各聚合在矩阵上一次算完,
+    多份报告时行按报告编号排好序, 用 reduceat 按报告分段归约.
+    结果第一维为报告, 其余按维度排列, 用下标取值: agg[report, i_tw, i_s2, i_s3]
+    聚合均忽略空值, 与 pandas 的 max/min/sum 一致, 分组内没有有效值时为nan
+    """
+    __slots__ = ('mask', 'shape', 'by', 'n_reports', 'starts', 'count')
+
+    def __init__(self, *memberships, by=None, n_reports=1):
+        """
+        :param memberships: 各维度的 (行数, 类别数) bool矩阵
+        :param by: 每行所属报告的编号(0 ~ n_reports-1, 升序), 为None时只有一份报告
+        :param n_reports:
+        """
+        mask = memberships[0]
+        for m in memberships[1:]:
+            mask = (mask[:, :, None] & m[:, None, :]).reshape(len(mask), mask.shape[1] * m.shape[1])
+        self.mask = mask
+        self.shape = tuple(m.shape[1] for m in memberships)
+        self.by = np.zeros(len(mask), dtype=np.int64) if by is None else np.asarray(by, dtype=np.int64)
+        self.n_reports = n_reports
+        self.starts = _starts(self.by)
+        self.count = self._reduce(np.add, mask.astype(np.int64), 0)
+
+    def _reduce(self, ufunc, values, fill, by=None, starts=None):
+        """ 按报告分段归约 (行数, 分组数) -> (报告数,) + 分组维度 """
+        by, starts = (self.by, self.starts) if by is None else (by, starts)
+        rs = np.full((self.n_reports, values.shape[1]), fill, dtype=values.dtype)
+        if len(starts):
+            rs[by[starts]] = ufunc.reduceat(values, starts, axis=0)
+        return rs.reshape((self.n_reports,) + self.shape)
+
+    def _valid(self, values, where=None):
+        values = np.asarray(values, dtype=float)
+        mask = self.mask & ~np.isnan(values)[:, None]
+        if where is not None:
+            mask = mask & np.asarray(where, dtype=bool)[:, None]
+        return values, mask
+
+    def valid(self, values, where=None):
+        """ 非空值个数 """
+        return self._reduce(np.add, self._valid(values, where)[1].astype(np.int64), 0)
+
+    def sum(self, values, where=None):
+        values, mask = self._valid(values, where)
+        return self._reduce(np.add, np.where(mask, values[:, None], 0.), 0.)
+
+    def mean(self, values, where=None):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sum(values, where) / self.valid(values, where)
+
+    def max(self, values, where=None):
+        values, mask = self._valid(values, where)
+        rs = self._reduce(np.maximum, np.where(mask, values[:, None], -np.inf), -np.inf)
+        rs[self.valid(values, where) == 0] = np.nan
+        return rs
+
+    def min(self, values, where=None):
+        values, mask = self._valid(values, where)
+        rs = self._reduce(np.minimum, np.where(mask, values[:, None], np.inf), np.inf)
+        rs[self.valid(values, where) == 0] = np.nan
+        return rs
+
+    def idxmax(self, values):
+        """ 分组内最大值所在的行号(取第一个, 同 idxmax), 分组为空时为-1 """
+        return self._first(values, self.max(values))
+
+    def idxmin(self, values):
+        """ 分组内最小值所在的行号(取第一个, 同 idxmin), 分组为空时为-1 """
+        return self._first(values, self.min(values))
+
+    def _first(self, values, target):
+        values, mask = self._valid(values)
+        n = len(values)
+        target = target.reshape(self.n_reports, -1)[self.by]
+        rows = np.where(mask & (values[:, None] == target), np.arange(n)[:, None], n)
+        rs = self._reduce(np.minimum, rows, n)
+        rs[rs == n] = -1
+        return rs
+
+    def key_stats(self, keys, where=None):
+        """
+        分组内按key计数, 相当于每个分组做一次 groupby(key).apply(len), 只统计出现过的key
+        :return: 不同key数, 最大次数(无记录为nan), 总次数, 平均次数(无记录为nan)
+        """
+        mask = self.mask if where is None else self.mask & np.asarray(where, dtype=bool)[:, None]
+        codes = _factorize(keys)
+        n_keys = codes.max() + 1 if len(codes) else 1
+        composite = self.by * n_keys + codes
+        order = np.argsort(composite, kind='stable')
+        composite = composite[order]
+        key_starts = _starts(composite)
+        counts = np.add.reduceat(mask[order].astype(np.int64), key_starts, axis=0) if len(key_starts) else \
+            np.zeros((0, mask.shape[1]), dtype=np.int64)
+        key_by = composite[key_starts] // n_keys
+        by_starts = _starts(key_by)
+        nunique = self._reduce(np.add, (counts > 0).astype(np.int64), 0, key_by, by_starts)
+        total = self._reduce(np.add, counts, 0, key_by, by_starts)
+        cnt_max = self._reduce(np.maximum, counts, 0, key_by, by_starts).astype(float)
+        cnt_max[nunique == 0] = np.nan
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return nunique, cnt_max, total, total / nunique
+
+    def nunique(self, values, where=None):
+        """ 分组内不同取值的个数 """
+        return self.key_stats(values, where)[0]
+
+
+def concat_details(details):
+    """
+    多份报告的明细拼接成一张表, report_id 为报告在列表中的下标
+    :param details: 各报告的明细
+    :return:
+    """
+    frames = [df.assign(report_id=ii) for ii, df in enumerate(details) if len(df) != 0]
+    if not frames:
+        return pd.DataFrame(columns=['report_id'])
+    return pd.concat(frames, ignore_index=True, sort=False)
+
+
+def _input_rows(result, dt, *args, **kwargs):
+    """明细类bom按输入明细的行数计"""
+    return len(dt)
+
+
+@instrument.stage(rows=_input_rows)
 def query_info_bom(query_info):
     """
     查询
@@ -972,6 +1402,24 @@ def query_info_bom(query_info):
     4.
         cnt,min,max,sum
 
+    """
+    feature = query_window_features(query_info)[0]
+    feature.update(negative_rule_features(QUERY_NEGATIVE_RULES, query_info)[0])
+
+    return feature
+
+
+def pboc_negative_query_001(dt):
+    return negative_rule('pboc_negative_query_001', dt)
+
+
+def query_window_features(dt, by=None, n_reports=1):
+    """
+    查询记录的时间窗口变量
+    :param dt: 查询明细, 多份报告时为 concat_details 拼接的明细
+    :param by: 每行所属的报告编号
+    :param n_reports: 报告数
+    :return: 各报告的变量
     """
     reason = {'xs': u'信用卡审批', 'dg': u'贷后管理', 'bcn': u'本人查询（互联网个人信用信息服务平台）',
               'ot': u'其他查询', 'bc': u'本人查询（商业银行网上银行）', 'tot': None, 'dk': u'贷款审批', 'dq': '贷前审批'}
@@ -980,38 +1428,34 @@ def query_info_bom(query_info):
     #             'tb': u'其他银行', 'nf': u'非银机构', 'ot': u'其他', 'own': u'本人', 'tot': None}
 
     source = ['pboc_qr']
-    feature = dict()
-    dt = query_info
-
-    for s1 in source:
-        for tw in TIME_WINDOW:
-            df1 = dt[dt['days'] <= TIME_WINDOW[tw]].copy()
-            for s2 in reason:
-                if reason[s2] is not None:
-                    df2 = df1[df1['query_reason'].apply(lambda x: s2 in x.split(','))]
-                else:
-                    df2 = df1
-                if len(df2) == 0:
-                    continue
-                s1234 = s1 + '_' + s2
-                feature[s1234 + '_dsst_max_' + tw] = df2['days'].max()  # 最早一次查询
-                feature[s1234 + '_dsst_min_' + tw] = df2['days'].min()  # 最晚一次查询
-                feature[s1234 + '_days_sum_' + tw] = len(df2['days'].drop_duplicates())  # 有查询的天数
-                feature[s1234 + '_rcrd_cnt_' + tw] = len(df2['query_reason'])  # 查询次数
-                feature[s1234 + '_org_nno_' + tw] = len(set(df2['querier']))  # 机构数
-
-    def condition001(x):
-        # 在不含本笔的情况下，借款人的人行报告显示近2个月内分别有5次（含）以上信用查询记录，且查询原因是“贷款审批”或“信用卡审批”的，不予接受；但确认为同一银行在一个月（自然日）内同一原因查询的，可以算作一次查询记录；
-        if x['days'] <= 60 and x['query_reason'] == 'xs':
-            return True
-        return False
-
-    feature['pboc_negative_query_001'] = 1 if len(
-        dt[dt.apply(condition001, axis=1)].drop_duplicates(['querier', 'query_reason'])) >= 5 else 0
+    features = [dict() for _ in range(n_reports)]
+    if len(dt) == 0:
+        return features
 
-    return feature
+    groups = WindowGroups(window_membership(dt['days'], TIME_WINDOW),
+                          token_membership(dt['query_reason'], [s2 if reason[s2] is not None else None for s2 in reason]),
+                          by=by, n_reports=n_reports)
+    dsst_max = groups.max(dt['days'])
+    dsst_min = groups.min(dt['days'])
+    days_sum = groups.nunique(dt['days'])
+    org_nno = groups.nunique(dt['querier'])
+    for r, feature in enumerate(features):
+        for s1 in source:
+            for i, tw in enumerate(TIME_WINDOW):
+                for j, s2 in enumerate(reason):
+                    idx = r, i, j
+                    if groups.count[idx] == 0:
+                        continue
+                    s1234 = s1 + '_' + s2
+                    feature[s1234 + '_dsst_max_' + tw] = dsst_max[idx]  # 最早一次查询
+                    feature[s1234 + '_dsst_min_' + tw] = dsst_min[idx]  # 最晚一次查询
+                    feature[s1234 + '_days_sum_' + tw] = days_sum[idx]  # 有查询的天数
+                    feature[s1234 + '_rcrd_cnt_' + tw] = groups.count[idx]  # 查询次数
+                    feature[s1234 + '_org_nno_' + tw] = org_nno[idx]  # 机构数
+    return features
 
 
+@instrument.stage(rows=_input_rows)
 def loan_info_bom(loan_info):
     """
     贷款
@@ -1031,229 +1475,292 @@ def loan_info_bom(loan_info):
     5.
         min,max,sum,average,cnt
     """
+    if len(loan_info) == 0:
+        return dict()
+    feature = loan_window_features(loan_info)[0]
+
+    feature.update(negative_rule_features(LOAN_NEGATIVE_RULES, loan_info)[0])
+
+    return feature
+
+
+def loan_window_features(loan_info, by=None, n_reports=1):
+    """
+    贷款的时间窗口变量
+    按 时间窗口 × 结清状态 × 贷款类型 分组一次算完, 不区分贷款类型的变量(cl/term/ppct 及逾期变量)
+    与原逐个过滤的写法一致, 取最后一个非空类型分组的值
+    :param loan_info: 贷款明细, 多份报告时为 concat_details 拼接的明细
+    :param by: 每行所属的报告编号
+    :param n_reports: 报告数
+    :return: 各报告的变量, 没有贷款的报告为空
+    """
     source = ['pboc_ln']
-    feature = dict()
     # settle_type = ['ustl', 'ustl1', 'stl', 'tot']
     settle_type = ['ustl1', 'tot']
     # items_type = {'mngm': u'经营', 'cnsm': u'消费', 'stdt': u'助学', 'car': u'汽车', 'frmr': u'农户', 'othr': u'其他',
     #               'hs': u'住房', 'tot': None}
     items_type = {'hs': u'住房', 'tot': None, 'bank': u'银行', 'nbank': u'非银行'}
     # due_flag = {'due': 1, 'nml': 0}
+    features = [dict() for _ in range(n_reports)]
     if len(loan_info) == 0:
-        return feature
-    for s1 in source:
-        for tw in TIME_WINDOW:
-            df1 = loan_info[loan_info['open_days'] <= TIME_WINDOW[tw]].copy()
-            if len(df1) == 0:
-                continue
-            # 贷款发放机构数
-            feature['pboc_ln_org_nno_{0}'.format(tw)] = len(set(df1['loan_from']))
-            feature['pboc_ln_blc_org_nno_{0}'.format(tw)] = len(set(df1[df1['balance'] > 0]['loan_from']))
-            # 基本信息
-            for s2 in settle_type:
-                if s2 == 'tot':
-                    df2 = df1
-                else:
-                    df2 = df1[df1['settle_type'] == s2]
-                for s3 in items_type:
-                    if items_type[s3] is not None:
-                        df3 = df2[df2['loan_item'].apply(lambda x: s3 in x.split(','))]
-                    else:
-                        df3 = df2
-                    if len(df3) == 0:
+        return features
+    in_window = window_membership(loan_info['open_days'], TIME_WINDOW)
+    in_settle = np.column_stack([np.ones(len(loan_info), dtype=bool) if s2 == 'tot' else
+                                 (loan_info['settle_type'] == s2).values for s2 in settle_type])
+    in_item = token_membership(loan_info['loan_item'], [s3 if items_type[s3] is not None else None for s3 in items_type])
+    reports = WindowGroups(np.ones((len(loan_info), 1), dtype=bool), by=by, n_reports=n_reports)
+    windowed = WindowGroups(in_window, by=by, n_reports=n_reports)
+    groups = WindowGroups(in_window, in_settle, in_item, by=by, n_reports=n_reports)
+
+    # 贷款发放机构数
+    org_nno = windowed.nunique(loan_info['loan_from'])
+    blc_org_nno = windowed.nunique(loan_info['loan_from'], where=loan_info['balance'] > 0)
+    open_days_max, open_days_min = groups.max(loan_info['open_days']), groups.min(loan_info['open_days'])
+    cl_sum, cl_max, cl_min = [f(loan_info['credit_limit']) for f in (groups.sum, groups.max, groups.min)]
+    term_max, term_min = groups.max(loan_info['loan_terms']), groups.min(loan_info['loan_terms'])
+    term_valid, term_avg = groups.valid(loan_info['loan_terms']), groups.mean(loan_info['loan_terms'])
+    balance_min, balance_max, balance_avg = [f(loan_info['balance']) for f in (groups.min, groups.max, groups.mean)]
+    # 已还与应还的占比
+    ppct = (loan_info['actualPaymentAmount'] / loan_info['scheduledPaymentAmount']).replace(np.inf, np.nan)
+    ppct_max, ppct_min = groups.max(ppct), groups.min(ppct)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ppct_avg = groups.sum(loan_info['actualPaymentAmount']) / groups.sum(loan_info['scheduledPaymentAmount'])
+
+    in_months = window_membership(loan_info['months'], TIME_WINDOW_V2)
+    due_groups = WindowGroups(in_months, in_item, by=by, n_reports=n_reports)
+    due_months = loan_info['due_last_months']
+    months_min, months_max = due_groups.min(loan_info['months']), due_groups.max(loan_info['months'])
+    due_months_max, due_months_avg = due_groups.max(due_months), due_groups.mean(due_months)
+    cdue_amount_max = due_groups.max(loan_info['currOverdueAmount'])
+    due_rcrd_nno, due_rcrd_max = due_groups.key_stats(loan_info['account'])[:2]
+    due90p_max, due90p_sum, due90p_avg = due_groups.key_stats(loan_info['account'], due_months >= 4)[1:]
+    due30p_max, due30p_sum, due30p_avg = due_groups.key_stats(loan_info['account'], due_months >= 2)[1:]
+    # 当期逾期期数为字符串, 按字符串取最大
+    curr_due_cyc = pd.Series(loan_info['currOverdueCyc'].values)
+    curr_due_cyc_max = [curr_due_cyc[in_months[:, i]].groupby(reports.by[in_months[:, i]]).max()
+                        for i in range(len(TIME_WINDOW_V2))]
+
+    for r, feature in enumerate(features):
+        if reports.count[r, 0] == 0:
+            continue
+        for s1 in source:
+            for i, tw in enumerate(TIME_WINDOW):
+                if windowed.count[r, i] == 0:
+                    continue
+                feature['pboc_ln_org_nno_{0}'.format(tw)] = org_nno[r, i]
+                feature['pboc_ln_blc_org_nno_{0}'.format(tw)] = blc_org_nno[r, i]
+                # 基本信息
+                for j, s2 in enumerate(settle_type):
+                    for k, s3 in enumerate(items_type):
+                        idx = r, i, j, k
+                        if groups.count[idx] == 0:
+                            continue
+                        # 记录
+                        feature['{0}_{1}_{2}_rcrd_sum_{3}'.format(s1, s2, s3, tw)] = groups.count[idx]
+                        # day since first record or last record (dsst)
+                        feature['{0}_{1}_{2}_dsst_max_{3}'.format(s1, s2, s3, tw)] = open_days_max[idx]
+                        feature['{0}_{1}_{2}_dsst_min_{3}'.format(s1, s2, s3, tw)] = open_days_min[idx]
+                        feature['{0}_{1}_{2}_msst_max_{3}'.format(s1, s2, s3, tw)] = open_days_max[idx] / 30
+                        # 额度
+                        feature['{0}_{1}_cl_sum_{2}'.format(s1, s2, tw)] = cl_sum[idx]
+                        feature['{0}_{1}_cl_max_{2}'.format(s1, s2, tw)] = cl_max[idx]
+                        feature['{0}_{1}_cl_min_{2}'.format(s1, s2, tw)] = cl_min[idx]
+                        feature['{0}_{1}_cl_avg_{2}'.format(s1, s2, tw)] = cl_sum[idx] / groups.count[idx]
+                        # 期数
+                        feature['{0}_{1}_term_max_{2}'.format(s1, s2, tw)] = term_max[idx]
+                        feature['{0}_{1}_term_min_{2}'.format(s1, s2, tw)] = term_min[idx]
+                        if term_valid[idx] > 0:
+                            feature['{0}_{1}_term_avg_{2}'.format(s1, s2, tw)] = term_avg[idx]
+
+                        # balance
+                        feature['{0}_{1}_{2}_balance_min_{3}'.format(s1, s2, s3, tw)] = balance_min[idx]
+                        feature['{0}_{1}_{2}_balance_max_{3}'.format(s1, s2, s3, tw)] = balance_max[idx]
+                        feature['{0}_{1}_{2}_balance_avg_{3}'.format(s1, s2, s3, tw)] = balance_avg[idx]
+                        # 已还与应还的占比
+                        feature['{0}_{1}_ppct_max_{2}'.format(s1, s2, tw)] = ppct_max[idx]
+                        feature['{0}_{1}_ppct_min_{2}'.format(s1, s2, tw)] = ppct_min[idx]
+                        feature['{0}_{1}_ppct_avg_{2}'.format(s1, s2, tw)] = ppct_avg[idx]
+
+            for i, tw in enumerate(TIME_WINDOW_V2):
+                for k, s3 in enumerate(items_type):
+                    idx = r, i, k
+                    if due_groups.count[idx] == 0:
                         continue
-                    # 记录
-                    feature['{0}_{1}_{2}_rcrd_sum_{3}'.format(s1, s2, s3, tw)] = len(df3)
                     # day since first record or last record (dsst)
-                    feature['{0}_{1}_{2}_dsst_max_{3}'.format(s1, s2, s3, tw)] = max(df3['open_days'])
-                    feature['{0}_{1}_{2}_dsst_min_{3}'.format(s1, s2, s3, tw)] = min(df3['open_days'])
-                    feature['{0}_{1}_{2}_msst_max_{3}'.format(s1, s2, s3, tw)] = max(df3['open_days']) / 30
-                    # 额度
-                    feature['{0}_{1}_cl_sum_{2}'.format(s1, s2, tw)] = sum(df3['credit_limit'])
-                    feature['{0}_{1}_cl_sum_{2}'.format(s1, s2, tw)] = sum(df3['credit_limit'])
-                    feature['{0}_{1}_cl_max_{2}'.format(s1, s2, tw)] = max(df3['credit_limit'])
-                    feature['{0}_{1}_cl_min_{2}'.format(s1, s2, tw)] = min(df3['credit_limit'])
-                    feature['{0}_{1}_cl_avg_{2}'.format(s1, s2, tw)] = sum(df3['credit_limit']) / len(df3)
-                    # 期数
-                    feature['{0}_{1}_term_max_{2}'.format(s1, s2, tw)] = np.max(df3['loan_terms'])
-                    feature['{0}_{1}_term_min_{2}'.format(s1, s2, tw)] = np.min(df3['loan_terms'])
-                    v = df3['loan_terms'][df3['loan_terms'].apply(lambda x: not pd.isnull(x))]
-                    if len(v) > 0:
-                        feature['{0}_{1}_term_avg_{2}'.format(s1, s2, tw)] = np.average(v)
-
-                    # balance
-                    feature['{0}_{1}_{2}_balance_min_{3}'.format(s1, s2, s3, tw)] = np.min(df3['balance'])
-                    feature['{0}_{1}_{2}_balance_max_{3}'.format(s1, s2, s3, tw)] = np.max(df3['balance'])
-                    feature['{0}_{1}_{2}_balance_avg_{3}'.format(s1, s2, s3, tw)] = np.average(df3['balance'])
-                    # 已还与应还的占比
-                    feature['{0}_{1}_ppct_max_{2}'.format(s1, s2, tw)] = np.max(
-                        (df3['actualPaymentAmount'] / df3['scheduledPaymentAmount']).apply(
-                            lambda x: None if np.inf == x else x))
-                    feature['{0}_{1}_ppct_min_{2}'.format(s1, s2, tw)] = np.min(
-                        (df3['actualPaymentAmount'] / df3['scheduledPaymentAmount']).apply(
-                            lambda x: None if np.inf == x else x))
-                    feature['{0}_{1}_ppct_avg_{2}'.format(s1, s2, tw)] = np.sum(df3['actualPaymentAmount']) / np.sum(
-                        df3['scheduledPaymentAmount'].apply(lambda x: None if np.inf == x else x))
-
-        for tw in TIME_WINDOW_V2:
-            df1 = loan_info[loan_info['months'] <= TIME_WINDOW_V2[tw]].copy()
-            for s3 in items_type:
-                if items_type[s3] is not None:
-                    df3 = df1[df1['loan_item'].apply(lambda x: s3 in x.split(','))]
-                else:
-                    df3 = df1
-                if len(df3) == 0:
-                    continue
-                # day since first record or last record (dsst)
-                feature['{0}_due_msst_min_{1}'.format(s1, tw)] = np.min(df3['months'])
-                feature['{0}_due_msst_max_{1}'.format(s1, tw)] = np.max(df3['months'])
-                # 最大逾期次数
-                feature['{0}_due_rcrd_max_{1}'.format(s1, tw)] = np.max(df3.groupby(['account']).apply(len))
-                # 逾期次数
-                se31 = df3[df3['due_last_months'] >= 4].groupby(['account'])['account'].apply(len)
-                feature['{0}_due90p_rcrd_max_{1}'.format(s1, tw)] = np.max(se31)
-                feature['{0}_due90p_rcrd_sum_{1}'.format(s1, tw)] = np.sum(se31)
-                feature['{0}_due90p_rcrd_avg_{1}'.format(s1, tw)] = np.average(se31)
-                se32 = df3[df3['due_last_months'] >= 2].groupby(['account'])['account'].apply(len)
-                feature['{0}_due30p_rcrd_max_{1}'.format(s1, tw)] = np.max(se32)
-                feature['{0}_due30p_rcrd_sum_{1}'.format(s1, tw)] = np.sum(se32)
-                feature['{0}_due30p_rcrd_avg_{1}'.format(s1, tw)] = np.average(se32)
-                feature['{0}_due_rcrd_sum_{1}'.format(s1, tw)] = len(df3.index)
-                feature['{0}_due_months_max_{1}'.format(s1, tw)] = np.max(df3['due_last_months'])
-                feature['{0}_due_months_avg_{1}'.format(s1, tw)] = np.average(df3['due_last_months'])
-                feature['{0}_cdue_amount_sum_{1}'.format(s1, tw)] = np.max(df3['currOverdueAmount'])
-                # 逾期账户数
-                feature['{0}_due_rcrd_nno_{1}'.format(s1, tw)] = len(set(df3['account']))
+                    feature['{0}_due_msst_min_{1}'.format(s1, tw)] = months_min[idx]
+                    feature['{0}_due_msst_max_{1}'.format(s1, tw)] = months_max[idx]
+                    # 最大逾期次数
+                    feature['{0}_due_rcrd_max_{1}'.format(s1, tw)] = due_rcrd_max[idx]
+                    # 逾期次数
+                    feature['{0}_due90p_rcrd_max_{1}'.format(s1, tw)] = due90p_max[idx]
+                    feature['{0}_due90p_rcrd_sum_{1}'.format(s1, tw)] = due90p_sum[idx]
+                    feature['{0}_due90p_rcrd_avg_{1}'.format(s1, tw)] = due90p_avg[idx]
+                    feature['{0}_due30p_rcrd_max_{1}'.format(s1, tw)] = due30p_max[idx]
+                    feature['{0}_due30p_rcrd_sum_{1}'.format(s1, tw)] = due30p_sum[idx]
+                    feature['{0}_due30p_rcrd_avg_{1}'.format(s1, tw)] = due30p_avg[idx]
+                    feature['{0}_due_rcrd_sum_{1}'.format(s1, tw)] = due_groups.count[idx]
+                    feature['{0}_due_months_max_{1}'.format(s1, tw)] = due_months_max[idx]
+                    feature['{0}_due_months_avg_{1}'.format(s1, tw)] = due_months_avg[idx]
+                    feature['{0}_cdue_amount_sum_{1}'.format(s1, tw)] = cdue_amount_max[idx]
+                    # 逾期账户数
+                    feature['{0}_due_rcrd_nno_{1}'.format(s1, tw)] = due_rcrd_nno[idx]
+
+                feature['{0}_curr_due_cyc_max_{1}'.format(s1, tw)] = curr_due_cyc_max[i].get(r, np.nan)
+    return features
 
-            feature['{0}_curr_due_cyc_max_{1}'.format(s1, tw)] = np.max(df1['currOverdueCyc'])
 
-    feature['pboc_negative_loan_001'] = pboc_negative_loan_001(loan_info)
-    feature['pboc_negative_loan_002'] = pboc_negative_loan_002(loan_info)
-    feature['pboc_negative_loan_003'] = pboc_negative_loan_003(loan_info)
-    feature['pboc_negative_loan_004'] = pboc_negative_loan_004(loan_info)
-    feature['pboc_negative_loan_005'] = pboc_negative_loan_005(loan_info)
-    feature['pboc_negative_loan_006'] = pboc_negative_loan_006(loan_info)
-    feature['pboc_negative_loan_007'] = pboc_negative_loan_007(loan_info)
+@instrument.stage(rows=_input_rows)
+def loan_card_bom(credit_analyzes):
+    """
+    信用卡
+    1.贷记卡状态: 销户,未激活,正常
+    """
+    dt = credit_analyzes
+    if len(dt) == 0:
+        return dict()
+    feature = loan_card_window_features(dt)[0]
+
+    feature.update(negative_rule_features(LOAN_CARD_NEGATIVE_RULES, dt)[0])
 
     return feature
 
 
-def loan_card_bom(credit_analyzes):
+def loan_card_window_features(dt, by=None, n_reports=1):
     """
-    信用卡
-    1.贷记卡状态: 销户,未激活,正常
+    贷记卡的时间窗口变量
+    :param dt: 贷记卡明细, 多份报告时为 concat_details 拼接的明细
+    :param by: 每行所属的报告编号
+    :param n_reports: 报告数
+    :return: 各报告的变量, 没有贷记卡的报告为空
     """
     source = ['pboc_lc']
-    feature = dict()
     # account_state = {'nml': ['正常', '销户'], 'nml1': ['正常'], 'cl': ['未激活', '销户'], 'tot': None}
     account_state = {'nml1': ['正常'], 'tot': None}
-    dt = credit_analyzes
+    features = [dict() for _ in range(n_reports)]
     if len(dt) == 0:
-        return feature
+        return features
+    reports = WindowGroups(np.ones((len(dt), 1), dtype=bool), by=by, n_reports=n_reports)
     # 币种
-    feature['pboc_lc_tot_ncur_lf'] = len(set(dt['accountType']))
-    feature['pboc_lc_nml_ncur_lf'] = len(set(dt[dt['accountState'] == '正常']['accountType']))
-
-    for s1 in source:
-        for tw in TIME_WINDOW:
-            df1 = dt[dt['open_days'] <= TIME_WINDOW[tw]].copy()
-            if len(df1) == 0:
-                continue
-            # 发卡机构数
-            feature['pboc_lc_org_nno_{0}'.format(tw)] = len(set(df1['loan_from']))
-            feature['pboc_lc_blc_org_nno_{0}'.format(tw)] = len(
-                set(df1[df1['credit_limit'] > df1['used_credit_limit']]['loan_from']))
-            for s2, v in account_state.items():
-                df2 = df1[df1['accountState'].isin(v)].copy() if v is not None else df1.copy()
-                df21 = df2[df2['accountType'].apply(lambda x: '人民币' in x)]
-                if len(df2) == 0:
+    ncur = reports.nunique(dt['accountType'])
+    nml_ncur = reports.nunique(dt['accountType'], where=dt['accountState'] == '正常')
+
+    in_window = window_membership(dt['open_days'], TIME_WINDOW)
+    in_state = np.column_stack([np.ones(len(dt), dtype=bool) if v is None else dt['accountState'].isin(v).values
+                                for v in account_state.values()])
+    # 额度等只考虑人民币账户
+    rmb = np.array(['人民币' in x for x in dt['accountType']], dtype=bool)
+    windowed = WindowGroups(in_window, by=by, n_reports=n_reports)
+    groups = WindowGroups(in_window, in_state, by=by, n_reports=n_reports)
+    rmb_groups = WindowGroups(in_window, in_state & rmb[:, None], by=by, n_reports=n_reports)
+
+    org_nno = windowed.nunique(dt['loan_from'])
+    blc_org_nno = windowed.nunique(dt['loan_from'], where=dt['credit_limit'] > dt['used_credit_limit'])
+    rcrd_nno = groups.nunique(dt['loan_from'])
+    uclj6_max, uclj6_min, uclj6_avg = [f(dt['latest6MonthUsedAvgAmount'])
+                                       for f in (rmb_groups.max, rmb_groups.min, rmb_groups.mean)]
+    ppct = (dt['actualPaymentAmount'] / dt['scheduledPaymentAmount']).replace(np.inf, np.nan)
+    ppct_max, ppct_min = rmb_groups.max(ppct), rmb_groups.min(ppct)
+    actual_sum, scheduled_sum = rmb_groups.sum(dt['actualPaymentAmount']), rmb_groups.sum(dt['scheduledPaymentAmount'])
+    cl_sum, cl_max, cl_min = [f(dt['credit_limit']) for f in (rmb_groups.sum, rmb_groups.max, rmb_groups.min)]
+    ucl_sum, ucl_max, ucl_min = [f(dt['used_credit_limit']) for f in (rmb_groups.sum, rmb_groups.max, rmb_groups.min)]
+    open_days_max, open_days_min = rmb_groups.max(dt['open_days']), rmb_groups.min(dt['open_days'])
+    credit_limit, open_days = dt['credit_limit'].values, dt['open_days'].values
+    latest = rmb_groups.idxmin(dt['open_days'])
+    highest = rmb_groups.idxmax(dt['credit_limit'])
+
+    # 逾期情况
+    due_nno = reports.nunique(dt['account'], where=dt['months'].notnull())
+    due_groups = WindowGroups(window_membership(dt['months'], TIME_WINDOW), by=by, n_reports=n_reports)
+    due_rcrd_nno, due_rcrd_max = due_groups.key_stats(dt['account'])[:2]
+    due90p_max = due_groups.key_stats(dt['account'], dt['due_last_months'] >= 4)[1]
+    due30p_max = due_groups.key_stats(dt['account'], dt['due_last_months'] >= 2)[1]
+    due_months_max, cdue_amount_max = due_groups.max(dt['due_last_months']), due_groups.max(dt['currOverdueAmount'])
+    months_max, months_min = due_groups.max(dt['months']), due_groups.min(dt['months'])
+
+    for r, feature in enumerate(features):
+        if reports.count[r, 0] == 0:
+            continue
+        feature['pboc_lc_tot_ncur_lf'] = ncur[r, 0]
+        feature['pboc_lc_nml_ncur_lf'] = nml_ncur[r, 0]
+        for s1 in source:
+            for i, tw in enumerate(TIME_WINDOW):
+                if windowed.count[r, i] == 0:
                     continue
-                feature['{0}_{1}_rcrd_sum_{2}'.format(s1, s2, tw)] = len(df2)  # 贷记卡数量
-                feature['{0}_{1}_rcrd_nno_{2}'.format(s1, s2, tw)] = len(set(df2['loan_from']))  # 不同银行的贷记卡数量
+                # 发卡机构数
+                feature['pboc_lc_org_nno_{0}'.format(tw)] = org_nno[r, i]
+                feature['pboc_lc_blc_org_nno_{0}'.format(tw)] = blc_org_nno[r, i]
+                for j, s2 in enumerate(account_state):
+                    idx = r, i, j
+                    if groups.count[idx] == 0:
+                        continue
+                    n = rmb_groups.count[idx]
+                    feature['{0}_{1}_rcrd_sum_{2}'.format(s1, s2, tw)] = groups.count[idx]  # 贷记卡数量
+                    feature['{0}_{1}_rcrd_nno_{2}'.format(s1, s2, tw)] = rcrd_nno[idx]  # 不同银行的贷记卡数量
 
-                if len(df21) == 0:
+                    if n == 0:
+                        continue
+                    # 最近6个月平均使用额度
+                    feature['{0}_{1}_uclj6_max_{2}'.format(s1, s2, tw)] = uclj6_max[idx]
+                    feature['{0}_{1}_uclj6_min_{2}'.format(s1, s2, tw)] = uclj6_min[idx]
+                    feature['{0}_{1}_uclj6_avg_{2}'.format(s1, s2, tw)] = uclj6_avg[idx]
+
+                    # 信用卡已还与应还的占比
+                    feature['{0}_{1}_ppct_max_{2}'.format(s1, s2, tw)] = ppct_max[idx]
+                    feature['{0}_{1}_ppct_min_{2}'.format(s1, s2, tw)] = ppct_min[idx]
+                    feature['{0}_{1}_ppct_avg_{2}'.format(s1, s2, tw)] = actual_sum[idx] / scheduled_sum[idx] if \
+                        scheduled_sum[idx] != 0 else 0
+
+                    # 额度(只考虑人民币账户)
+                    feature['{0}_{1}_cl_sum_{2}'.format(s1, s2, tw)] = cl_sum[idx]
+                    feature['{0}_{1}_cl_max_{2}'.format(s1, s2, tw)] = cl_max[idx]
+                    feature['{0}_{1}_cl_min_{2}'.format(s1, s2, tw)] = cl_min[idx]
+                    feature['{0}_{1}_cl_avg_{2}'.format(s1, s2, tw)] = cl_sum[idx] / n
+                    feature['{0}_{1}_cl_latest_{2}'.format(s1, s2, tw)] = credit_limit[latest[idx]]
+                    # 已使用额度(只考虑人民币账户)
+                    feature['{0}_{1}_ucl_sum_{2}'.format(s1, s2, tw)] = ucl_sum[idx]
+                    feature['{0}_{1}_ucl_max_{2}'.format(s1, s2, tw)] = ucl_max[idx]
+                    feature['{0}_{1}_ucl_min_{2}'.format(s1, s2, tw)] = ucl_min[idx]
+                    feature['{0}_{1}_ucl_avg_{2}'.format(s1, s2, tw)] = ucl_sum[idx] / n
+                    # 已使用额度占比(只考虑人民币账户)
+                    feature['{0}_{1}_ucl_pct_{2}'.format(s1, s2, tw)] = ucl_sum[idx] / cl_sum[idx] if \
+                        cl_sum[idx] != 0 else 0
+
+                    # 开卡距今天数
+                    feature['{0}_{1}_dsst_max_{2}'.format(s1, s2, tw)] = open_days_max[idx]
+                    feature['{0}_{1}_dsst_min_{2}'.format(s1, s2, tw)] = open_days_min[idx]
+                    feature['{0}_{1}_dscl_max_{2}'.format(s1, s2, tw)] = open_days[highest[idx]]  # 最高额度贷记卡距申请天数
+
+            # 逾期情况
+            feature['{0}_due_rcrd_nno_lf'.format(s1)] = due_nno[r, 0]  # 逾期过的贷记卡总数
+            for i, tw in enumerate(TIME_WINDOW):
+                idx = r, i
+                if due_groups.count[idx] == 0:
                     continue
-                # 最近6个月平均使用额度
-                feature['{0}_{1}_uclj6_max_{2}'.format(s1, s2, tw)] = np.max(df21['latest6MonthUsedAvgAmount'])
-                feature['{0}_{1}_uclj6_min_{2}'.format(s1, s2, tw)] = np.min(df21['latest6MonthUsedAvgAmount'])
-                feature['{0}_{1}_uclj6_avg_{2}'.format(s1, s2, tw)] = np.average(df21['latest6MonthUsedAvgAmount'])
-
-                # 信用卡已还与应还的占比
-                feature['{0}_{1}_ppct_max_{2}'.format(s1, s2, tw)] = np.max(
-                    (df21['actualPaymentAmount'] / df21['scheduledPaymentAmount']).apply(
-                        lambda x: None if np.inf == x else x))
-                feature['{0}_{1}_ppct_min_{2}'.format(s1, s2, tw)] = np.min(
-                    (df21['actualPaymentAmount'] / df21['scheduledPaymentAmount']).apply(
-                        lambda x: None if np.inf == x else x))
-                feature['{0}_{1}_ppct_avg_{2}'.format(s1, s2, tw)] = np.sum(df21['actualPaymentAmount']) / np.sum(
-                    df21['scheduledPaymentAmount']) if np.sum(df21['scheduledPaymentAmount']) != 0 else 0
-
-                # 额度(只考虑人民币账户)
-                feature['{0}_{1}_cl_sum_{2}'.format(s1, s2, tw)] = sum(df21['credit_limit'])
-                feature['{0}_{1}_cl_max_{2}'.format(s1, s2, tw)] = max(df21['credit_limit'])
-                feature['{0}_{1}_cl_min_{2}'.format(s1, s2, tw)] = min(df21['credit_limit'])
-                feature['{0}_{1}_cl_avg_{2}'.format(s1, s2, tw)] = sum(df21['credit_limit']) / len(df21)
-                feature['{0}_{1}_cl_latest_{2}'.format(s1, s2, tw)] = dt['credit_limit'][df21['open_days'].idxmin()]
-                # 已使用额度(只考虑人民币账户)
-                feature['{0}_{1}_ucl_sum_{2}'.format(s1, s2, tw)] = sum(df21['used_credit_limit'])
-                feature['{0}_{1}_ucl_max_{2}'.format(s1, s2, tw)] = max(df21['used_credit_limit'])
-                feature['{0}_{1}_ucl_min_{2}'.format(s1, s2, tw)] = min(df21['used_credit_limit'])
-                feature['{0}_{1}_ucl_avg_{2}'.format(s1, s2, tw)] = sum(df21['used_credit_limit']) / len(df21)
-                # 已使用额度占比(只考虑人民币账户)
-                feature['{0}_{1}_ucl_pct_{2}'.format(s1, s2, tw)] = sum(df21['used_credit_limit']) / sum(
-                    df21['credit_limit']) if sum(df21['credit_limit']) != 0 else 0
-
-                # 开卡距今天数
-                feature['{0}_{1}_dsst_max_{2}'.format(s1, s2, tw)] = max(df21['open_days'])
-                feature['{0}_{1}_dsst_min_{2}'.format(s1, s2, tw)] = min(df21['open_days'])
-                feature['{0}_{1}_dscl_max_{2}'.format(s1, s2, tw)] = df21['open_days'][
-                    df21['credit_limit'].idxmax()]  # 最高额度贷记卡距申请天数
-
-        # 逾期情况
-        df = dt[dt['months'].apply(lambda x: not pd.isnull(x))]
-        feature['{0}_due_rcrd_nno_lf'.format(s1)] = len(set(df['account']))  # 逾期过的贷记卡总数
-        for tw in TIME_WINDOW:
-            df1 = dt[dt['months'] <= TIME_WINDOW[tw]].copy()
-            if len(df1) == 0:
-                continue
-            # 最大逾期次数
-            feature['{0}_due_rcrd_max_{1}'.format(s1, tw)] = np.max(df1.groupby(['account']).apply(len))
-            # 逾期次数
-            feature['{0}_due90p_rcrd_max_{1}'.format(s1, tw)] = np.max(
-                df1[df1['due_last_months'] >= 4].groupby(['account'])['account'].apply(len))
-            feature['{0}_due30p_rcrd_max_{1}'.format(s1, tw)] = np.max(
-                df1[df1['due_last_months'] >= 2].groupby(['account'])['account'].apply(len))
-            feature['{0}_due_rcrd_sum_{1}'.format(s1, tw)] = len(df1.index)
-            feature['{0}_due_months_max_{1}'.format(s1, tw)] = np.max(df1['due_last_months'])
-            feature['{0}_cdue_amount_sum_{1}'.format(s1, tw)] = np.max(df1['currOverdueAmount'])
-            # 逾期账户数
-            feature['{0}_due_rcrd_nno_{1}'.format(s1, tw)] = len(set(df1['account']))
-            # 逾期距离申请日天数
-            feature['{0}_due_msst_max_{1}'.format(s1, tw)] = np.max(df1['months'])
-            feature['{0}_due_msst_min_{1}'.format(s1, tw)] = np.min(df1['months'])
-
-    feature['pboc_negative_lc_001'] = pboc_negative_lc_001(dt)
-    feature['pboc_negative_lc_002'] = pboc_negative_lc_002(dt)
-    feature['pboc_negative_lc_003'] = pboc_negative_lc_003(dt)
-    feature['pboc_negative_lc_004'] = pboc_negative_lc_004(dt)
-    feature['pboc_negative_lc_005'] = pboc_negative_lc_005(dt)
-
-    return feature
+                # 最大逾期次数
+                feature['{0}_due_rcrd_max_{1}'.format(s1, tw)] = due_rcrd_max[idx]
+                # 逾期次数
+                feature['{0}_due90p_rcrd_max_{1}'.format(s1, tw)] = due90p_max[idx]
+                feature['{0}_due30p_rcrd_max_{1}'.format(s1, tw)] = due30p_max[idx]
+                feature['{0}_due_rcrd_sum_{1}'.format(s1, tw)] = due_groups.count[idx]
+                feature['{0}_due_months_max_{1}'.format(s1, tw)] = due_months_max[idx]
+                feature['{0}_cdue_amount_sum_{1}'.format(s1, tw)] = cdue_amount_max[idx]
+                # 逾期账户数
+                feature['{0}_due_rcrd_nno_{1}'.format(s1, tw)] = due_rcrd_nno[idx]
+                # 逾期距离申请日天数
+                feature['{0}_due_msst_max_{1}'.format(s1, tw)] = months_max[idx]
+                feature['{0}_due_msst_min_{1}'.format(s1, tw)] = months_min[idx]
+    return features
 
 
+@instrument.stage(rows=_input_rows)
 def standard_loan_card_bom(dt):
-    feature = dict()
-    feature['pboc_negative_slc_001'] = pboc_negative_slc_001(dt)
-    feature['pboc_negative_slc_002'] = pboc_negative_slc_002(dt)
-    feature['pboc_negative_slc_003'] = pboc_negative_slc_003(dt)
-    feature['pboc_negative_slc_004'] = pboc_negative_slc_004(dt)
-
-    return feature
+    return negative_rule_features(STANDARD_LOAN_CARD_NEGATIVE_RULES, dt)[0]
 
 
 class PBOCEntity(object):
     """征信报告实体类"""
 
+    @instrument.stage(rows=lambda _, self, *args, **kwargs: self.detail_rows())
     def __init__(self, obj, version=None, _type=0):
         self.raw_data, self.version = self.load_pboc(obj)
         self._type = _type
@@ -1261,6 +1768,8 @@ class PBOCEntity(object):
             assert self.version == version
         self.query_time = self.get_query_time()
         self.basic_info = self.get_basic_info()
+        # 各类账户 latest24State 的解码结果, 见 decode_latest24_states
+        self.latest24 = {}
         # self.residence = self.get_residence()
 
         self.query_info = self.get_query_info_detail()
@@ -1268,6 +1777,11 @@ class PBOCEntity(object):
         self.standard_credit_card_detail = self.get_loan_or_credit_detail(context='standardLoanCard')
         self.loan_detail = self.get_loan_or_credit_detail()
 
+    def detail_rows(self):
+        """查询、贷记卡、准贷记卡、贷款明细的行数"""
+        return sum(len(df) for df in (self.query_info, self.credit_card_detail, self.standard_credit_card_detail,
+                                       self.loan_detail))
+
     def load_pboc(self, obj):
         """获取pboc报文"""
         if not isinstance(obj, dict):
@@ -1357,16 +1871,17 @@ class PBOCEntity(object):
         居住地址信息
         :return:
         """
+        address = _address_module()
         residence = get_value('personalInfo,residence', self.raw_data)
-        address_parsed = [address_parse(rd.get('address')) for rd in residence]
+        address_parsed = [address.address_parse(rd.get('address')) for rd in residence]
         rs1 = []
         for ii, rd1 in enumerate(address_parsed):
             rs2 = []
             for jj, rd2 in enumerate(address_parsed):
-                rs2.append(sum(address_match_score(rd1, rd2)))
+                rs2.append(sum(address.address_match_score(rd1, rd2)))
             rs1.append(rs2)
         sim_score = pd.DataFrame(rs1)
-        residence = address_cls(residence, sim_score)
+        residence = address.address_cls(residence, sim_score)
         return pd.DataFrame(residence)
 
     def get_query_info_detail(self):
@@ -1386,9 +1901,11 @@ class PBOCEntity(object):
             query_info = get_value('queryRecord,recordInfo', self.raw_data)
             query_info = pd.DataFrame(query_info, columns=["queryReason", "queryDate", 'querier'])
             query_info['query_reason'] = query_info['queryReason'].apply(transfer_query_reason)
-            query_info['query_date'] = query_info['queryDate'].apply(lambda x: get_time(transfer_date(x)))
+            query_info['query_date'] = pd.to_datetime(transfer_date_series(query_info['queryDate']),
+                                                      format=START_TIME_FORMAT)
             query_info['querier'] = query_info['querier']
-            query_info['days'] = query_info['query_date'].apply(lambda x: (self.query_time.date() - x.date()).days)
+            query_info['days'] = _nullable_days(_days_between(np.datetime64(self.query_time.date(), 'D'),
+                                                              query_info['query_date'].values.astype('datetime64[D]')))
         else:
             """
             version 2
@@ -1772,616 +2289,271 @@ class PBOCEntity(object):
         return li_df
 
     def get_loan_or_credit_detail(self, context='loan'):
+        """
+        贷款/贷记卡/准贷记卡明细, 每条逾期记录一行(无逾期的账户一行)
+        按列构造: 账户表只解析一次, 逾期事件表记录所属账户的下标, 按下标展开后再统一计算天数/月数等衍生列
+        :param context: loan/loanCard/standardLoanCard
+        :return:
+        """
         loan_info_detail = get_value('creditDetail,{0}'.format(context), self.raw_data)
-        loan_info_list = []
         if loan_info_detail is None:
             return pd.DataFrame()
+        accounts = {col: [] for col in DETAIL_ACCOUNT_COLUMNS}
+        event_account, event_month, event_last_months = [], [], []
+        # 没有latest24Date的账户不解析还款状态
+        latest24_dates = [get_value('latest24Date', li) for li in loan_info_detail]
+        latest24 = decode_latest24_states([None if d is None else get_value('latest24State', li)
+                                           for d, li in zip(latest24_dates, loan_info_detail)])
+        self.latest24[context] = latest24
+        bounds = np.searchsorted(latest24.account, np.arange(len(loan_info_detail) + 1)).tolist()
+        offsets, states = latest24.offset.tolist(), latest24.status.tolist()
         for ii, li in enumerate(loan_info_detail):
-            loan_from, loan_detail_type, end_date, loan_terms, loan_type, account_type, account_state = [None] * 7
             statements = get_value('statements', li)
-            account_no = re.search('业务号(?P<account>[A-Z\d]+)', statements).group('account')
-            account_no = '{0}{1}'.format(account_no, ii)
-            open_date = re.search('\d{4}年\d{1,2}月\d{1,2}日', statements).group()
-            up2date = re.search('截至(?P<upToDate>[\d年月日]+)', statements)
-            loan_from = re.search('{0}(?P<from>.*?)发放'.format(open_date), statements).group('from')
-            if context == 'loan':
-                credit_limit = re.search('发放(.*?)(?P<creditLimit>[\d,\.]+)元', statements).group('creditLimit')
-                loan_detail_type = re.search('[)）](?P<type>.*?贷款)', statements).group('type')
-                end_date = re.search('(?P<endDate>[\d年月日]+)到期', statements)
-                loan_terms = re.search('，(?P<terms>\d+)期', statements)
-                loan_type = re.search('业务号.*?，(?P<type>.*?)，', statements).group('type')
-                loan_type = loan_type.replace('（', '').replace('）', '').replace('(', '').replace(')', '').replace(
-                    '/', '')
-            else:
-                credit_limit = re.search('授信额度(.*?)(?P<creditLimit>[\d,\.]+)', statements).group('creditLimit')
-                account_type = re.search('（(?P<accountType>.*?)账户）', statements).group('accountType')
-                account_state = re.search('账户状态为“(?P<accountState>.*?)”', statements)
-                account_state = "正常" if account_state is None else account_state.group('accountState')
-            if end_date is not None:
-                end_date = end_date.group('endDate')
-            if up2date is not None:
-                up2date = up2date.group('upToDate')
-            if loan_terms is not None:
-                loan_terms = float(loan_terms.group('terms'))
-            else:
-                if '一次性归还' in statements:
-                    loan_terms = 1
-                else:
-                    if end_date is not None:
-                        loan_terms = (parser.parse(re.sub('[^\d]+', '', end_date)).date() - parser.parse(
-                            re.sub('[^\d]+', '', open_date)).date()).days / 30
-                        loan_terms = int(loan_terms)
-
-            settle_type = '结清' if '结清' in statements else None
+            st = parse_statement(statements, context)
             overdue_records = get_value('overdueRecord', li, {})
-            latest24_date = get_value('latest24Date', li)
-            latest24_state = get_value('latest24State', li)
-            latest24_overdue_info = get_overdue_info_from_latest24State(latest24_date, latest24_state)
-            if len(latest24_overdue_info) != 0 or get_value('overdueRecordDetail', overdue_records) is not None:
-                overdue_record_detail = get_value('overdueRecordDetail', overdue_records, [])
-                overdue_record_detail += latest24_overdue_info
-                for rd in overdue_record_detail:
+            idx = len(accounts['account'])
+            n_events = len(event_account)
+            lo, hi = bounds[ii], bounds[ii + 1]
+            overdue_record_detail = get_value('overdueRecordDetail', overdue_records)
+            if hi > lo or overdue_record_detail is not None:
+                for rd in overdue_record_detail or []:
                     if get_value('lastMonths', rd) == '--':
                         continue
-                    record = dict()
-                    record['due_month'] = transfer_month(get_value('month', rd))
-                    record['due_last_months'] = float(get_value('lastMonths', rd))
-                    record['currOverdueCyc'] = get_value('currOverdueCyc', li, '0')
-                    record['currOverdueAmount'] = transfer_amount(get_value('currOverdueAmount', li, '0'))
-                    record['overdue31To60Amount'] = transfer_amount(get_value('overdue31To60Amount', li, '0'))
-                    record['overdue61To90Amount'] = transfer_amount(get_value('overdue61To90Amount', li, '0'))
-                    record['overdue91To180Amount'] = transfer_amount(get_value('overdue91To180Amount', li, '0'))
-                    record['overdueOver180Amount'] = transfer_amount(get_value('overdueOver180Amount', li, '0'))
-                    record['scheduledPaymentAmount'] = transfer_amount(get_value('scheduledPaymentAmount', li, '0'))
-                    record['actualPaymentAmount'] = transfer_amount(get_value('actualPaymentAmount', li, '0'))
-                    remain_cycle = get_value('remainPaymentCyc', li, '0')
-                    record['remainPaymentCyc'] = None if remain_cycle == '--' else float(remain_cycle)
-                    record['scheduledPaymentDate'] = transfer_date(get_value('scheduledPaymentDate', li))
-                    record['class5State'] = get_value('class5State', li)
-                    record['state'] = get_value('state', li, '正常')
-                    record['type'] = loan_detail_type
-                    record['loan_type'] = loan_type
-                    record['loan_terms'] = loan_terms
-                    record['loan_from'] = loan_from
-                    record['credit_limit'] = transfer_amount(credit_limit)
-                    record['used_credit_limit'] = transfer_amount(get_value('usedCreditLimitAmount', li, '0'))
-                    record['usedHighestAmount'] = transfer_amount(get_value('usedHighestAmount', li, '0'))
-                    record['latest6MonthUsedAvgAmount'] = transfer_amount(
-                        get_value('latest6MonthUsedAvgAmount', li, '0'))
-                    record['openDate'] = open_date
-                    record['upToDate'] = transfer_date(up2date)
-                    record['end_date'] = transfer_date(end_date)
-                    record['account'] = account_no
-                    record['accountType'] = account_type
-                    record['accountState'] = account_state
-                    record['balance'] = transfer_amount(get_value('balance', li, '0'))
-                    record['settle_type'] = settle_type
-                    loan_info_list.append(record)
+                    event_account.append(idx)
+                    event_month.append(transfer_month(get_value('month', rd)))
+                    event_last_months.append(float(get_value('lastMonths', rd)))
+                if hi > lo:
+                    # latest24State中的逾期月份, 排在逾期记录之后
+                    month = transfer_month(latest24_dates[ii].split('-')[0])
+                    event_account.extend([idx] * (hi - lo))
+                    event_month.extend(month_adjust(month, offset) for offset in offsets[lo:hi])
+                    event_last_months.extend(map(float, states[lo:hi]))
             else:
-                record = dict()
-                record['due_month'] = None
-                record['due_last_months'] = 0
-                record['scheduledPaymentAmount'] = transfer_amount(get_value('scheduledPaymentAmount', li, '0'))
-                record['actualPaymentAmount'] = transfer_amount(get_value('actualPaymentAmount', li, '0'))
-                remain_cycle = get_value('remainPaymentCyc', li, '0')
-                record['remainPaymentCyc'] = None if remain_cycle == '--' else float(remain_cycle)
-                record['scheduledPaymentDate'] = transfer_date(get_value('scheduledPaymentDate', li))
-                record['currOverdueCyc'] = get_value('currOverdueCyc', li, '0')
-                record['currOverdueAmount'] = transfer_amount(get_value('currOverdueAmount', li, '0'))
-                record['overdue31To60Amount'] = transfer_amount(get_value('overdue31To60Amount', li, '0'))
-                record['overdue61To90Amount'] = transfer_amount(get_value('overdue61To90Amount', li, '0'))
-                record['overdue91To180Amount'] = transfer_amount(get_value('overdue91To180Amount', li, '0'))
-                record['overdueOver180Amount'] = transfer_amount(get_value('overdueOver180Amount', li, '0'))
-                record['state'] = get_value('state', li, '正常')
-                record['class5State'] = get_value('class5State', li)
-                record['credit_limit'] = transfer_amount(credit_limit)
-                record['used_credit_limit'] = transfer_amount(get_value('usedCreditLimitAmount', li, '0'))
-                record['usedHighestAmount'] = transfer_amount(get_value('usedHighestAmount', li, '0'))
-                record['latest6MonthUsedAvgAmount'] = transfer_amount(get_value('latest6MonthUsedAvgAmount', li, '0'))
-                record['type'] = loan_detail_type
-                record['loan_from'] = loan_from
-                record['loan_terms'] = loan_terms
-                record['openDate'] = open_date
-                record['end_date'] = end_date
-                record['upToDate'] = transfer_date(up2date)
-                record['account'] = account_no
-                record['accountType'] = account_type
-                record['accountState'] = account_state
-                record['loan_type'] = loan_type
-                record['balance'] = transfer_amount(get_value('balance', li, '0'))
-                record['settle_type'] = '结清' if '结清' in statements else None
-                loan_info_list.append(record)
-        li_df = pd.DataFrame(loan_info_list)
-        li_df['openDate'] = li_df['openDate'].apply(transfer_date)
-        li_df['end_date'] = li_df['end_date'].apply(transfer_date)
-        li_df['end_days'] = li_df.apply(self.get_end_days, axis=1)
-        li_df['up_to_days'] = li_df['upToDate'].apply(self.get_up_to_days)
-        li_df['open_days'] = li_df['openDate'].apply(
-            lambda x: (self.query_time.date() - get_time(x).date()).days)
-        li_df['activate_days'] = li_df['scheduledPaymentDate'].apply(
-            lambda x: (self.query_time.date() - get_time(x).date()).days if x is not None else None)
+                event_account.append(idx)
+                event_month.append(None)
+                event_last_months.append(0)
+            if len(event_account) == n_events:
+                # 逾期记录全部为'--'的账户不产生明细行
+                continue
+
+            remain_cycle = get_value('remainPaymentCyc', li, '0')
+            values = {
+                'currOverdueCyc': get_value('currOverdueCyc', li, '0'),
+                'currOverdueAmount': transfer_amount(get_value('currOverdueAmount', li, '0')),
+                'overdue31To60Amount': transfer_amount(get_value('overdue31To60Amount', li, '0')),
+                'overdue61To90Amount': transfer_amount(get_value('overdue61To90Amount', li, '0')),
+                'overdue91To180Amount': transfer_amount(get_value('overdue91To180Amount', li, '0')),
+                'overdueOver180Amount': transfer_amount(get_value('overdueOver180Amount', li, '0')),
+                'scheduledPaymentAmount': transfer_amount(get_value('scheduledPaymentAmount', li, '0')),
+                'actualPaymentAmount': transfer_amount(get_value('actualPaymentAmount', li, '0')),
+                'remainPaymentCyc': None if remain_cycle == '--' else float(remain_cycle),
+                'scheduledPaymentDate': transfer_date(get_value('scheduledPaymentDate', li)),
+                'class5State': get_value('class5State', li),
+                'state': get_value('state', li, '正常'),
+                'type': st['type'],
+                'loan_type': st['loan_type'],
+                'loan_terms': st['loan_terms'],
+                'loan_from': st['loan_from'],
+                'credit_limit': transfer_amount(st['credit_limit']),
+                'used_credit_limit': transfer_amount(get_value('usedCreditLimitAmount', li, '0')),
+                'usedHighestAmount': transfer_amount(get_value('usedHighestAmount', li, '0')),
+                'latest6MonthUsedAvgAmount': transfer_amount(get_value('latest6MonthUsedAvgAmount', li, '0')),
+                'openDate': transfer_date(st['open_date']),
+                'upToDate': transfer_date(st['up_to_date']),
+                'end_date': transfer_date(st['end_date']),
+                'account': '{0}{1}'.format(st['account'], ii),
+                'accountType': st['account_type'],
+                'accountState': st['account_state'],
+                'balance': transfer_amount(get_value('balance', li, '0')),
+                'settle_type': '结清' if '结清' in statements else None,
+            }
+            values['loan_item'] = transfer_loan_item_v1(values)
+            for col in DETAIL_ACCOUNT_COLUMNS:
+                accounts[col].append(values[col])
+
+        events = pd.DataFrame({'due_month': event_month, 'due_last_months': event_last_months})
+        account_df = pd.DataFrame(accounts, columns=DETAIL_ACCOUNT_COLUMNS)
+        li_df = pd.concat([events, account_df.take(event_account).reset_index(drop=True)], axis=1)
+
+        query_date = np.datetime64(self.query_time.date(), 'D')
+        open_date = _to_datetime64(li_df['openDate'])
+        up_to_date = _to_datetime64(li_df['upToDate'])
+        end_date = _to_datetime64(li_df['end_date'])
+        due_month = _to_datetime64(li_df['due_month'])
+        end_days = _days_between(np.where(np.isnat(up_to_date), query_date, up_to_date), end_date)
+        li_df['end_days'] = _nullable_days(end_days)
+        li_df['up_to_days'] = np.nan_to_num(_days_between(query_date, up_to_date)).astype(np.int64)
+        li_df['open_days'] = _days_between(query_date, open_date).astype(np.int64)
+        li_df['activate_days'] = _nullable_days(_days_between(query_date, _to_datetime64(li_df['scheduledPaymentDate'])))
         if context == 'loan':
-            li_df['settle_type'] = li_df.apply(transfer_settle_type, axis=1)
-        li_df['loan_item'] = li_df.apply(transfer_loan_item_v1, axis=1)
-        li_df['months'] = li_df['due_month'].apply(
-            lambda x: round((self.query_time - get_time(x)).days / 30) if not pd.isnull(x) else None)
-        li_df['is_dued'] = li_df['due_month'].apply(lambda x: 1 if x is not None else 0)
+            # 同 transfer_settle_type
+            settled = li_df['settle_type'].values == '结清'
+            unsettled = li_df['settle_type'].isnull().values & (li_df['balance'].values > 0)
+            li_df['settle_type'] = np.select([settled, unsettled & (end_days >= 0), unsettled & (end_days < 0)],
+                                             ['stl', 'ustl', 'ustl1'], None)
+        li_df['loan_item'] = li_df.pop('loan_item')
+        li_df['months'] = _nullable_days(np.round(_days_between(query_date, due_month) / 30))
+        li_df['is_dued'] = li_df['due_month'].notnull().astype(np.int64)
 
         return li_df
 
-    def get_end_days(self, x):
-        end = self.query_time.date() if pd.isnull(x['upToDate']) else get_time(x['upToDate']).date()
-        return (end - get_time(x['end_date']).date()).days if not pd.isnull(x['end_date']) else None
-
-    def get_up_to_days(self, up2date):
-        if pd.isnull(up2date):
-            return 0
-        else:
-            return (self.query_time.date() - get_time(up2date).date()).days
-
 
+@instrument.stage()
 def hbxd_house_loan_feature(pboc_entity: PBOCEntity):
     """
-
+    华北小贷房贷系数
+    按账户去重后的贷款中, 取宽松认定为房贷、满足准入且已还款6个月以上的贷款; 同一天发放的房贷, 或同一天同一机构同一担保方式的贷款
+    视为同一笔, 合并本月应还款额; 月供2000以上的贷款中取 月还款系数*月供 最大的一笔, 严格认定的房贷另取一笔
     :param pboc_entity:
     :return:
     """
     features = dict()
 
-    ldf = pboc_entity.loan_detail.copy()
+    ldf = pboc_entity.loan_detail
     if len(ldf) == 0:
         return features
     ldf = ldf.drop_duplicates(['account'])
-    ldf['hs_type_check_level1'] = ldf.apply(lambda x: hbxd_house_loan_type_check(x, 1), axis=1)
-    ldf['hs_type_check_level2'] = ldf.apply(lambda x: hbxd_house_loan_type_check(x, 2), axis=1)
-    ldf['hs_admission'] = ldf.apply(hbxd_house_loan_admission, axis=1)
-    ldf.index = ldf['account']
-    accounts = set(ldf.index)
-    rs_lst = []
-    cmp_dct = {}
-    counter = 0
-    for ii, record in enumerate(get_value('creditDetail,loan', pboc_entity.raw_data, [])):
-        if 'X{0}'.format(ii) not in accounts:
-            continue
-        dct = dict(ldf.ix['X{0}'.format(ii)])
-        if not dct['hs_type_check_level1'] or not dct['hs_admission']:
-            continue
-        states = record.get('latest24State', '')
-        dct['repay_months'] = len(re.split('[^/*#]', states, 1)[-1]) + 1 + max(int(dct['open_days']) // 30 - 24, 0)
-        if dct['repay_months'] < 6:
-            continue
-        open_date = dct['openDate']
-        hs = 'hs' if '个人住房' in dct['type'] or '公积金' in dct['type'] else 'ot'
-        loan_from = dct['loan_from']
-        loan_type = dct['loan_type']
+    records = get_value('creditDetail,loan', pboc_entity.raw_data, [])
+    # 报文中第ii笔贷款对应账户为 X{ii} 的明细
+    rows = pd.Index(ldf['account'].values).get_indexer(['X{0}'.format(ii) for ii in range(len(records))])
+    record_index = np.flatnonzero(rows >= 0)
+    loans = ldf.take(rows[record_index])
+    selected = row_flags(loans, HOUSE_LOAN_COLUMNS, lambda x: hbxd_house_loan_type_check(x, 1)) & \
+        hbxd_house_loan_admission(loans)
+    record_index, loans = record_index[selected], loans[selected]
+    repay_months = np.array([_repaid_months(records[ii].get('latest24State', '')) for ii in record_index],
+                            dtype=np.int64).reshape(len(loans))
+    repay_months += np.maximum(loans['open_days'].values.astype(np.int64) // 30 - 24, 0)
+    loans, repay_months = loans[repay_months >= 6], repay_months[repay_months >= 6]
+    if len(loans) == 0:
+        return features
+
+    # 同一天发放的房贷, 或同一天同一机构同一担保方式的贷款合并; 键首次出现时记为下一笔合并后贷款的下标
+    is_hs = value_flags(loans['type'], lambda v: '个人住房' in v or '公积金' in v)
+    day_keys = row_codes(loans, ['openDate'])
+    loan_keys = row_codes(loans, ['openDate', 'loan_from', 'loan_type'])
+    amounts = loans['scheduledPaymentAmount'].values.astype(float)
+    day_index, loan_index = {}, {}
+    merged, merged_amounts = [], []
+    for i in range(len(loans)):
         select = None
-        if hs == 'hs':
-            k1 = '{0},{1}'.format(open_date, hs)
-            if k1 not in cmp_dct:
-                cmp_dct[k1] = counter
+        if is_hs[i]:
+            if day_keys[i] in day_index:
+                select = day_index[day_keys[i]]
             else:
-                select = cmp_dct[k1]
-        k2 = '{0},{1},{2}'.format(open_date, loan_from, loan_type)
-        if k2 not in cmp_dct:
-            cmp_dct[k2] = counter
+                day_index[day_keys[i]] = len(merged)
+        if loan_keys[i] in loan_index:
+            select = loan_index[loan_keys[i]]
         else:
-            select = cmp_dct[k2]
-        if select is not None:
-            rs_lst[select]['scheduledPaymentAmount'] += dct['scheduledPaymentAmount']
+            loan_index[loan_keys[i]] = len(merged)
+        if select is None:
+            merged.append(i)
+            merged_amounts.append(amounts[i])
         else:
-            rs_lst.append(dct)
-            counter += 1
-    ldf = pd.DataFrame(rs_lst)
-    if len(ldf) == 0:
-        return features
-    ldf = ldf[ldf['scheduledPaymentAmount'] >= 2000]
-    if len(ldf) == 0:
+            merged_amounts[select] += amounts[i]
+
+    amounts = np.array(merged_amounts, dtype=float)
+    repay_months = repay_months[merged]
+    level2 = row_flags(loans, HOUSE_LOAN_COLUMNS, lambda x: hbxd_house_loan_type_check(x, 2))[merged]
+    keep = amounts >= 2000
+    amounts, repay_months, level2 = amounts[keep], repay_months[keep], level2[keep]
+    if len(amounts) == 0:
         return features
-    ldf = ldf[['open_days', 'repay_months', 'hs_type_check_level2', 'scheduledPaymentAmount']].copy()
-    ldf['repay_amount_monthly_coefficient'] = ldf.apply(_cal_repay_amount_monthly_coefficient, axis=1)
-    ldf['credit_limit_coefficient'] = ldf.apply(_cal_amount_coefficient, axis=1)
-
-    idxmax = (ldf['repay_amount_monthly_coefficient'] * ldf['scheduledPaymentAmount']).idxmax()
+    weights = _repay_amount_monthly_coefficient(repay_months) * amounts
+    coefficients = _amount_coefficient(repay_months)
+    for level, candidates in ((1, np.arange(len(amounts))), (2, np.flatnonzero(level2))):
+        if len(candidates) == 0:
+            continue
+        i = candidates[np.argmax(weights[candidates])]
+        features['pboc_hs_coffiecient_level{0}'.format(level)] = coefficients[i]
+        features['pboc_hs_repay_monthly_coffiecient_level{0}'.format(level)] = coefficients[i]
+        features['pboc_hs_credit_limit_level{0}'.format(level)] = coefficients[i] * amounts[i]
 
-    features['pboc_hs_coffiecient_level1'] = ldf.loc[idxmax, 'credit_limit_coefficient']
-    features['pboc_hs_repay_monthly_coffiecient_level1'] = ldf.loc[idxmax, 'credit_limit_coefficient']
-    features['pboc_hs_credit_limit_level1'] = ldf.loc[idxmax, 'credit_limit_coefficient'] * ldf.loc[idxmax, 'scheduledPaymentAmount']
+    return features
 
-    ldf2 = ldf[ldf['hs_type_check_level2']]
-    if len(ldf2) > 0:
-        idxmax2 = (ldf2['repay_amount_monthly_coefficient'] * ldf2['scheduledPaymentAmount']).idxmax()
-        features['pboc_hs_coffiecient_level2'] = ldf2.loc[idxmax2, 'credit_limit_coefficient']
-        features['pboc_hs_repay_monthly_coffiecient_level2'] = ldf2.loc[idxmax2, 'credit_limit_coefficient']
-        features['pboc_hs_credit_limit_level2'] = ldf2.loc[idxmax2, 'credit_limit_coefficient'] * ldf2.loc[idxmax2, 'scheduledPaymentAmount']
 
-    return features
+def _repaid_months(latest24_state):
+    """
+    还款记录中首个还款状态起的月数(/ * # 之外为还款状态), 没有还款状态时为记录长度+1
+    """
+    rest = latest24_state.lstrip('/*#')
+    return len(rest) if rest else len(latest24_state) + 1
 
 
-def _cal_repay_amount_monthly_coefficient(x):
+def _repay_amount_monthly_coefficient(repay_months):
     """
 
-    :param x:
+    :param repay_months: 已还款月数数组
     :return:
     X≥36个月	房贷月还款额×8	40
 12个月≤X<36个月	房贷月还款额×8	25
 6个月≤X<12个月	房贷月还款额×6	12
     """
-    if x['repay_months'] >= 36:
-        return 8
-    elif x['repay_months'] >= 12:
-        return 8
-    elif x['repay_months'] >= 6:
-        return 8
-    else:
-        return 0
+    return np.where(repay_months >= 6, 8, 0)
 
 
-def _cal_amount_coefficient(x):
+def _amount_coefficient(repay_months):
     """
 
-    :param x:
+    :param repay_months: 已还款月数数组
     :return:
     X≥36个月	房贷月还款额×8	40
 12个月≤X<36个月	房贷月还款额×8	25
 6个月≤X<12个月	房贷月还款额×6	12
     """
-    if x['repay_months'] >= 36:
-        return 40
-    elif x['repay_months'] >= 12:
-        return 25
-    elif x['repay_months'] >= 6:
-        return 12
-    else:
-        return 0
-
-
-class Address(object):
-    """
-    province	string	是	省
-    city	string	是	市
-    district	string	是	区，可能为空字串
-    street	string	是	街道，可能为空字串
-    """
-    prefix = None
-    tail = None
-    province = None
-    city = None
-    district = None
-    street = None
-    detail = None
-
-    def __init__(self, *args):
-        if len(args) != 0:
-            self.province, self.city, self.district, self.street, self.detail = args
-
-    def value_count(self) -> List[int]:
-        prefix_cnt, tail_cnt, cnt = 0, 0, 0
-        if self.province is not None:
-            prefix_cnt += 1
-            cnt += 1
-        if self.city is not None:
-            prefix_cnt += 1
-            cnt += 1
-        if self.district is not None:
-            prefix_cnt += 1
-            cnt += 1
-        if self.street is not None:
-            tail_cnt += 1
-            cnt += 1
-        if self.detail is not None:
-            tail_cnt += 1
-            cnt += 1
-        return [prefix_cnt, tail_cnt, cnt]
-
-
-class Residence(object):
-    """
-    pass
-    """
-    residence_type = None
-    get_time = None
-    address = None
-    address_his = None
-
-    def __init__(self, *args):
-        if len(args) > 0:
-            self.residence_type, self.get_time, self.address = args
-            self.address_his = self.address
-        else:
-            self.address_his = []
-
-    def union(self, residence):
-        if isinstance(self.address_his, list):
-            self.address_his.append(residence.address)
-        else:
-            self.address_his = [self.address, residence.address]
-        if self.residence_type is None:
-            self.residence_type = residence.residence_type
-        if self.get_time is None:
-            self.get_time = residence.get_time
-        if self.address is None:
-            self.address = residence.address
-        return self
-
-
-def address_parse(address) -> Address:
-    """
-    居住地址解析
-    :param address:
-    :return:
-    """
-    #
-    address = re.sub('(^中国)|(--)|(待补充)|(UNKNOW)', '', address)
-    # model 1
-    province_pattern = '(?P<province>.*?省)?'
-    city_pattern = '(?P<city>.*?((自治州)|市(?!场)))?'
-    district_pattern = '(?P<district>(((.*[^社工业市\d一二三四五六七八九东南])区)|((.*?[^城])市)|(.*?县))?)'
-    prefix_pattern = '(?P<prefix>{0}{1}{2})'.format(province_pattern, city_pattern, district_pattern)
-    street_pattern = '(?P<street>((.+路(\d+号)?)|(.+[街道](\d+号)?)|(.*?[镇乡].*?村)))?'
-    detail_pattern = '(?P<detail>.*)'
-    tail_pattern = '(?P<tail>{0}{1})'.format(street_pattern, detail_pattern)
-    pattern = prefix_pattern + tail_pattern
-    rs = re.search(pattern, address)
-    add = Address()
-    prefix = rs.group('prefix')
-    tail = rs.group('tail')
-    province = rs.group('province')
-    city = rs.group('city')
-    district = rs.group('district')
-    street = rs.group('street')
-    detail = rs.group('detail')
-
-    address_prefix_detail_parse(prefix, add, **{'province': province, 'city': city, 'district': district})
-    address_tail_detail_parse(tail, add)
-    add.street = street
-    add.detail = detail
-
-    return add
-
-
-def address_cell_cmp(x1, x2) -> bool:
-    if x1 is None or x2 is None:
-        return True
+    return np.select([repay_months >= 36, repay_months >= 12, repay_months >= 6], [40, 25, 12], 0)
+
+
+def parse_statement(statements, context='loan'):
+    """
+    解析账户描述, 例如:
+    1.2015年03月10日中国银行发放的100,000元（人民币）个人住房贷款，业务号X123，组合（含保证）担保，240期，按月归还，2035年03月10日到期。截至2019年09月，...
+    所有规则均为预编译的 STATEMENT_PATTERNS, 不再按开户日期动态拼接正则
+    :param statements: 账户描述
+    :param context: loan/loanCard/standardLoanCard
+    :return: dict, 未解析到的可选字段为None
+    """
+    pat = STATEMENT_PATTERNS
+    rs = dict.fromkeys(['type', 'end_date', 'loan_terms', 'loan_type', 'account_type', 'account_state'])
+    account = pat['account'].search(statements)
+    open_date = pat['open_date'].search(statements)
+    if account is None or open_date is None:
+        raise ValueError('账户描述无法解析: {0}'.format(statements))
+    rs['account'] = account.group('account')
+    rs['open_date'] = open_date.group()
+    up2date = pat['up_to_date'].search(statements)
+    rs['up_to_date'] = None if up2date is None else up2date.group('upToDate')
+    # 发放机构紧跟开户日期
+    loan_from = pat['loan_from'].match(statements, open_date.end())
+    if loan_from is None:
+        raise ValueError('账户描述缺少发放机构: {0}'.format(statements))
+    rs['loan_from'] = loan_from.group('from')
+    if context == 'loan':
+        rs['credit_limit'] = pat['loan_credit_limit'].search(statements).group('creditLimit')
+        rs['type'] = pat['loan_detail_type'].search(statements).group('type')
+        end_date = pat['end_date'].search(statements)
+        rs['end_date'] = None if end_date is None else end_date.group('endDate')
+        loan_terms = pat['loan_terms'].search(statements)
+        if loan_terms is not None:
+            loan_terms = float(loan_terms.group('terms'))
+        rs['loan_terms'] = loan_terms
+        rs['loan_type'] = pat['loan_type'].search(statements).group('type').translate(LOAN_TYPE_STRIP)
     else:
-        return x1 in x2 or x2 in x1
-
-
-def string_similarity(x1: str, x2: str) -> float:
-    def add_space(s: str):
-        return ' '.join(list(s))
-
-    # 将字中间加入空格
-    s1, s2 = add_space(x1), add_space(x2)
-    # 转化为TF矩阵
-    cv = CountVectorizer(tokenizer=lambda s: s.split())
-    corpus = [s1, s2]
-    vectors = cv.fit_transform(corpus).toarray()
-    # 计算TF系数
-    rs = np.dot(vectors[0], vectors[1]) / (norm(vectors[0]) * norm(vectors[1]))
-    return rs
-
-
-def address_cls(address: List[dict], sim_score: pd.DataFrame) -> List[dict]:
-    """
-    score > 8 即可视为一类
-    :param address:
-    :param sim_score:
-    :return:
-    """
-    cls = defaultdict(list)
-    cls_count = 0
-    cutoff = 8
-    for ii, row in sim_score.iterrows():
-        for jj, score in enumerate(row):
-            if jj < ii:
-                continue
-            find = False
-            if score >= cutoff:
-                for k, v in cls.items():
-                    if ii in v and jj not in v:
-                        v.append(jj)
-                        find = True
-                    elif ii not in v and jj in v:
-                        v.append(ii)
-                        find = True
-                    elif ii in v and jj in v:
-                        find = True
-            else:
-                for k, v in cls.items():
-                    if jj in v:
-                        find = True
-            if not find and jj == ii:
-                cls[cls_count].append(jj)
-                cls_count += 1
-
-    rs = []
-    for k, v in cls.items():
-        r = Residence()
-        for index in v:
-            add = address[index]
-            r = r.union(Residence(add.get('residenceType'), add.get('getTime'), add.get('address')))
-        rs.append(r.__dict__)
+        rs['credit_limit'] = pat['card_credit_limit'].search(statements).group('creditLimit')
+        rs['account_type'] = pat['account_type'].search(statements).group('accountType')
+        account_state = pat['account_state'].search(statements)
+        rs['account_state'] = '正常' if account_state is None else account_state.group('accountState')
+    if rs['loan_terms'] is None:
+        if '一次性归还' in statements:
+            rs['loan_terms'] = 1
+        elif rs['end_date'] is not None:
+            non_digit = pat['non_digit']
+            days = (parser.parse(non_digit.sub('', rs['end_date'])).date() - parser.parse(
+                non_digit.sub('', rs['open_date'])).date()).days
+            rs['loan_terms'] = int(days / 30)
     return rs
 
 
-def address_cls_v1(address: List[str]):
-    rs = defaultdict(list)
-    adds = address
-    cls_counter = 0
-    cls = [None] * len(adds)
-    cutoff = 8
-    for ii, add1 in enumerate(adds):
-        for jj, add2 in enumerate(adds):
-            if jj < ii:
-                continue
-            if cls[jj] is not None:
-                continue
-            if jj == ii:
-                cls[jj] = cls_counter
-                rs[cls_counter].append(address[jj])
-                cls_counter += 1
-                continue
-            score = int(string_similarity(add1, add2) * 10)
-            if score > cutoff:
-                cls[jj] = cls[ii]
-                rs[cls[ii]].append(address[jj])
-    return rs
-
-
-def address_vague_match(address: str, adds: List[str], num: int = 1) -> List[str]:
-    """
-    地址模糊匹配
-    :param address:
-    :param adds:
-    :param num: 若num==-1,返回所有匹配成功的结果,否则返回指定数量的结果
-    :return:
-    """
-    cutoff = 7
-    matched_address, final_matched_address = [], []
-    final_matched_counter = 0
-    for ii, add in enumerate(adds):
-        score = int(string_similarity(address, add) * 10)
-        if score >= cutoff:
-            matched_address.append(add)
-    print(json.dumps(matched_address, ensure_ascii=False, indent=4))
-    matched_address = [address_parse(add) for add in matched_address]
-    parsed_add = address_parse(address)
-    for ii, add in enumerate(matched_address):
-        prefix_score, tail_score = address_match_score(parsed_add, add)
-        final_matched_address.append((add.prefix + add.tail, tail_score))
-        if prefix_score >= 3 and tail_score >= 0.75:
-            # final_matched_address.append((add.prefix + add.tail, tail_score))
-            final_matched_counter += 1
-    final_matched_address = sorted(final_matched_address, key=lambda x: x[1], reverse=True)
-    print(json.dumps(final_matched_address, ensure_ascii=False, indent=4))
-    final_matched_address = [v[0] for v in final_matched_address]
-    return final_matched_address if num == -1 else final_matched_address[:num]
-
-
-def address_match_score(address1: Address, address2: Address):
-    """
-    地址匹配相似的得分
-    :param address1:
-    :param address2:
-    :return:
-    """
-    score = 0
-    if address_cell_cmp(address1.province, address2.province):
-        score += 1
-    if address_cell_cmp(address1.city, address2.city):
-        score += 1
-    if address_cell_cmp(address1.district, address2.district):
-        score += 1
-    return score, string_similarity(address1.tail, address2.tail)
-
-
-def address_cell_fill(add: Address, p: str, index: int) -> Address:
-    if '省' in p or '自治区' in p:
-        add.province = p if add.province is None else add.province
-    if '市' in p or '自治州' in p:
-        if index < 2:
-            add.city = p if add.city is None else add.city
-    if '区' in p or '县' in p:
-        add.district = p if add.district is None else add.district
-    return add
-
-
-def address_tail_detail_parse(tail: str, add: Address) -> Address:
-    """
-    区县级以下具体地址解构
-    :param tail:
-    :param add:
-    :return:
-    """
-    add.tail = tail
-    return add
-
-
-def fix_jieba_over_cut(prefix_lst: List[str], **kwargs) -> List[str]:
-    lst = []
-    province, city, district = kwargs.get('province'), kwargs.get('city'), kwargs.get('district')
-    for ii, p in enumerate(prefix_lst):
-        match = False
-        for c in ['市', '区', '县', '新区']:
-            # 过度分词
-            if p == c:
-                lst[-1] = lst[-1] + p
-                match = True
-                break
-        if match:
-            continue
-        for c in ['镇', '村', '乡', '街道', '路', '号']:
-            # 过度匹配
-            if p.endswith(c):
-                lst.pop()
-                match = True
-                break
-        if match:
-            continue
-        for jj, n in enumerate(lst):
-            # 词重复
-            if n in p:
-                lst[jj] = p
-                match = True
-                break
-            elif p in n:
-                match = True
-                break
-        if not match:
-            lst.append(p)
-    if len(lst) > 3:
-        last = ''.join(lst[2:])
-        lst = lst[:2] + [last]
-    return lst
-
-
-def address_prefix_detail_parse(prefix: str, add: Address, **kwargs) -> Address:
-    """
-    区县级以上地址解构
-    :param prefix:
-    :param add:
-    :return:
-    """
-    if len(prefix) == 0:
-        return
-    prefix_lst = list(jieba.cut(prefix))
-    prefix_lst = fix_jieba_over_cut(prefix_lst, **kwargs)
-    if ''.join(prefix_lst) != prefix:
-        prefix = ''.join(prefix_lst)
-        prefix_lst = list(jieba.cut(prefix))
-        prefix_lst = fix_jieba_over_cut(prefix_lst)
-    for ii, p in enumerate(prefix_lst):
-        address_cell_fill(add, p, ii)
-    prefix_value_count = add.value_count()[0]
-    if len(prefix_lst) == 3 and prefix_value_count < 3:
-        if add.province is None:
-            add.province = prefix_lst[0]
-        if add.city is None:
-            add.city = prefix_lst[1]
-        if add.district is None:
-            add.district = prefix_lst[2]
-    elif len(prefix_lst) == 1 and prefix_value_count < 1:
-        if add.district is None:
-            add.district = prefix_lst[0]
-    elif len(prefix_lst) == 2 and prefix_value_count < 2:
-        if add.city is None:
-            add.city = prefix_lst[0]
-        else:
-            if prefix_lst.index(add.city) == 0:
-                add.district = prefix_lst[1]
-            else:
-                add.province = prefix_lst[0]
-    elif len(prefix_lst) > 3:
-        print('位置情况: {0}'.format(prefix))
-        if add.district is not None:
-            add.district = prefix
-    if add.district is not None and '市' in add.district:
-        add.city = add.district
-        add.district = None
-    add.prefix = prefix
-    return add
-
-
 def transfer_settle_type(x):
     """
     已到期未结清（“结清”文字优先，未结清看逻辑：到期时间早于报告时间，且本金余额>0为未结清）
@@ -2418,21 +2590,40 @@ def get_overdue_info_from_latest24State(latest24Date, latest24State):
     rs = []
     if latest24Date is None:
         return rs
-    month = latest24Date.split('-')[0]
-    month = transfer_month(month)
+    month = transfer_month(latest24Date.split('-')[0])
     for ii, v in enumerate(latest24State):
         if v.isdigit():
-            dct = {}
-            dct['month'] = month_adjust(month, ii)
-            dct['lastMonths'] = v
-            rs.append(dct)
+            rs.append({'month': month_adjust(month, ii), 'lastMonths': v})
     return rs
 
 
+Latest24Events = namedtuple('Latest24Events', ['grid', 'account', 'offset', 'status'])
+
+
+def decode_latest24_states(states):
+    """
+    一次解码一批账户的24个月还款状态(latest24State)
+    :param states: latest24State 列表, None视为空
+    :return: Latest24Events
+        grid: (账户数, 最长状态长度) 的状态矩阵, 元素为单个字符('N', '*', '#', '/', 数字等), 不足的部分为''
+        account, offset, status: 数字状态(逾期月数)所在的账户下标、距首月的月数及逾期月数, 按账户、月份排序
+    """
+    states = ['' if v is None else v for v in states]
+    width = max(1, max(map(len, states), default=0))
+    codes = np.array(states, dtype='<U{0}'.format(width)).view(np.uint32).reshape(len(states), width)
+    account, offset = np.nonzero((codes >= ord('0')) & (codes <= ord('9')))
+    status = (codes[account, offset] - ord('0')).astype(np.int64)
+    return Latest24Events(codes.view('<U1'), account, offset, status)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def month_adjust(datestr, diff_month=0):
-    now = datetime.strptime(datestr, '%Y-%m-%d %H:%M:%S')
-    now = now + relativedelta.relativedelta(months=diff_month)
-    return now.strftime('%Y-%m-%d %H:%M:%S')
+    """ 加减月份, 日期超过当月天数时取月末(同relativedelta) """
+    now = get_time(datestr)
+    year, month = divmod(now.month - 1 + diff_month, 12)
+    year, month = now.year + year, month + 1
+    now = now.replace(year=year, month=month, day=min(now.day, calendar.monthrange(year, month)[1]))
+    return now.strftime(START_TIME_FORMAT)
 
 
 def transfer_query_operator(query_operator):
@@ -2507,6 +2698,7 @@ def transfer_amount(amount):
     return float(re.sub('[^\d\.]', '', amount))
 
 
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def transfer_date(datestr):
     """
     transfer date string like '2019.01.01' or '2019年11月11日' or '2019年1月1日'
@@ -2515,20 +2707,21 @@ def transfer_date(datestr):
     """
     if datestr is None or datestr == '':
         return
-    splits = re.split('[^\d]', datestr)
+    splits = DATE_SPLIT_PATTERN.split(datestr)
     year = splits[0]
     month = splits[1] if len(splits[1]) >= 2 else '0' + splits[1]
     day = splits[2] if len(splits[2]) >= 2 else '0' + splits[2]
     return '{0}-{1}-{2} 00:00:00'.format(year, month, day)
 
 
+@lru_cache(maxsize=DATE_CACHE_SIZE)
 def transfer_month(datestr):
     """
     transfer date string like '2019.01' or '2019年11月' or '2019年1月'
     :param datestr:
     :return:
     """
-    splits = re.split('[^\d]', datestr)
+    splits = DATE_SPLIT_PATTERN.split(datestr)
     year = splits[0]
     month = splits[1] if len(splits[1]) >= 2 else '0' + splits[1]
     return '{0}-{1}-01 00:00:00'.format(year, month)
@@ -2536,31 +2729,45 @@ def transfer_month(datestr):
 
 def get_value(key_str, obj, default=None):
     """获取指定key的值,key的格式为`node1,node2`"""
+    return compile_path(key_str)(obj, default)
 
-    def g_val(key_, obj_):
-        val = None
-        if isinstance(obj_, str):
-            obj_ = json.loads(obj_)
-        elif isinstance(obj_, bytes):
-            obj_ = json.loads(str(obj, encoding="utf8"))
-        if isinstance(obj_, list):
-            val = obj_[key_]
-        elif isinstance(obj_, dict):
-            val = obj_.get(key_)
-        return default if empty_judge(val) else val
-
-    if empty_judge(obj):
-        return default
-    key_lst = key_str.split(',')
-    try:
-        key = int(key_lst[0])
-    except ValueError:
-        key = key_lst[0]
-    tp_obj = g_val(key, obj)
-    if len(key_lst) <= 1 or empty_judge(tp_obj):
-        return tp_obj
-    else:
-        return get_value(','.join(key_lst[1:]), tp_obj, default)
+
+@lru_cache(maxsize=None)
+def compile_path(key_str):
+    """
+    预先解析 get_value 的路径, 返回 getter(obj, default=None)
+    逐层迭代取值, 只对最终结果做空值判断; 中间节点为空或不是dict/list时返回default, 为json字符串时先解析
+    :param key_str: 如 'currOverdue,currOverdueAmount', 整数为列表下标
+    :return:
+    """
+    keys = []
+    for key in key_str.split(','):
+        try:
+            keys.append(int(key))
+        except ValueError:
+            keys.append(key)
+    keys = tuple(keys)
+
+    def getter(obj, default=None):
+        for key in keys:
+            if obj.__class__ is not dict:
+                if isinstance(obj, (str, bytes)):
+                    if len(obj) == 0:
+                        return default
+                    obj = json.loads(obj)
+                if isinstance(obj, list):
+                    if len(obj) == 0:
+                        return default
+                    obj = obj[key]
+                    continue
+                if not isinstance(obj, dict):
+                    return default
+            obj = obj.get(key)
+        if obj.__class__ is str:
+            return obj if obj != '' else default
+        return default if empty_judge(obj) else obj
+
+    return getter
 
 
 def empty_judge(obj):
@@ -2584,28 +2791,57 @@ def get_time(tm, fmt=START_TIME_FORMAT):
     if isinstance(tm, datetime):
         return tm
     elif isinstance(tm, str):
-        return datetime.strptime(tm, fmt)
+        return _strptime(tm, fmt)
     elif isinstance(tm, date):
         return datetime.strptime(tm.strftime('%Y-%m-%d'), '%Y-%m-%d')
     else:
         raise TypeError("can not recognized the time[%s] type!" % str(tm))
 
 
-def clean(features):
-    rs = {}
-    for k in features:
-        if pd.isnull(features[k]):
-            features[k] = None
-        elif not isinstance(features[k], str):
-            features[k] = round(float(features[k]), 5)
-            if features[k] == 0:
-                continue
-            rs[k] = features[k]
-        else:
-            rs[k] = features[k]
-    return rs
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def _strptime(tm, fmt):
+    # datetime不可变, 可直接共享缓存的结果
+    return datetime.strptime(tm, fmt)
+
+
+def map_unique(func, series):
+    """
+    func 逐个转换 series 中不重复的值, 适合重复值多的日期列
+    :return: 与 series 索引一致的 object 列, 空值(None/nan)转换为 func(None)
+    """
+    codes, uniques = pd.factorize(series)
+    values = np.empty(len(uniques) + 1, dtype=object)
+    values[:-1] = [func(v) for v in uniques]
+    values[-1] = func(None)
+    return pd.Series(values[codes], index=series.index, name=series.name)
+
+
+def transfer_date_series(series):
+    """ transfer_date 的 Series 版本 """
+    return map_unique(transfer_date, series)
+
+
+def _to_datetime64(series):
+    """ 'YYYY-MM-DD HH:MM:SS' 字符串列转 datetime64[D], 空值为NaT """
+    return pd.to_datetime(series, format=START_TIME_FORMAT).values.astype('datetime64[D]')
+
+
+def _days_between(end, start):
+    """ 相差天数, 任一为NaT时为nan """
+    return (end - start) / np.timedelta64(1, 'D')
+
+
+def _nullable_days(days):
+    """ 与逐行返回 int/None 时 pandas 推断的类型一致: 无空值为int, 全为空为None, 否则为float """
+    isnull = np.isnan(days)
+    if not isnull.any():
+        return days.astype(np.int64)
+    if isnull.all():
+        return np.full(len(days), None, dtype=object)
+    return days
 
 
+@instrument.stage()
 def summary_bom(pboc: PBOCEntity):
     """
 
@@ -0,0 +1,338 @@
+# coding: utf-8
+
+"""
+pboc_service.py
+
+常驻的征信评分服务: 进程常驻, 省去每次任务启动时加载 pandas/jieba/sklearn 等的时间
+
+  POST /bom       请求体为docx报告或解析后的json报告(Content-Type: application/json), 返回对外输出的变量
+                  ?all=1 返回全量bom
+  GET  /health    服务状态, 计算进程异常退出时返回503并重建进程池
+  GET  /metrics   请求数、排队数及耗时统计
+
+Usage:
+  pboc_service.py [--host=<host>] [--port=<port>] [--workers=<n>] [--queue=<n>] [--timeout=<s>] [--max-body=<mb>]
+                  [--cache-dir=<dir>] [--cache-size=<mb>]
+  pboc_service.py -h | --help
+
+Options:
+  -h --help              Show this screen.
+  --host=<host>          监听地址 [default: 127.0.0.1]
+  --port=<port>          监听端口 [default: 8086]
+  --workers=<n>          并行计算的进程数 [default: 2]
+  --queue=<n>            排队等待的请求数上限, 超过时返回503 [default: 16]
+  --timeout=<s>          单个请求的超时时间(秒), 超时返回504 [default: 30]
+  --max-body=<mb>        请求体大小上限(MB) [default: 20]
+  --cache-dir=<dir>      按报告内容缓存解析结果及bom的目录
+  --cache-size=<mb>      缓存容量上限(MB) [default: 1024]
+"""
+
+import io
+import sys
+import zipfile
+import time
+import hashlib
+import logging
+import pathlib
+import threading
+import traceback
+from collections import deque
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from docopt import docopt
+from lxml import etree
+
+sys.path.append(pathlib.Path(__file__).absolute().parent.parent.as_posix())
+
+from scripts import tojson, pboc, result_cache, serializer
+
+logger = logging.getLogger('scripts.service')
+
+# 计算进程内的结果缓存
+_cache = None
+
+
+def _init_worker(cache_dir, cache_size):
+    global _cache
+    if cache_dir is not None:
+        pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        _cache = result_cache.ResultCache(pathlib.Path(cache_dir, 'results.sqlite').as_posix(),
+                                          result_cache.code_version(tojson, pboc), max_bytes=cache_size * 1024 * 1024)
+
+
+class InvalidReport(ValueError):
+    """请求体不是合法的docx或json报告"""
+
+
+def load_report(payload: bytes, is_json=False):
+    """
+    解析请求体
+    :param payload: docx文件内容, 或json报告
+    :param is_json: payload是否为json报告
+    :return: 报告
+    """
+    if is_json:
+        try:
+            obj = serializer.loads(payload)
+        except ValueError as e:
+            raise InvalidReport('不是合法的json: {0}'.format(e))
+        if not isinstance(obj, dict):
+            raise InvalidReport('json报告应为对象')
+        missing = [k for k in tojson.REPORT_SECTIONS if k not in obj]
+        if missing:
+            raise InvalidReport('json报告缺少章节: {0}'.format(','.join(missing)))
+        # 负面规则使用关键词索引, 较早的json只有文字版报告
+        if 'keyword_hits' not in obj and 'body_str' not in obj:
+            raise InvalidReport('json报告缺少 keyword_hits 或 body_str')
+        return obj
+    try:
+        with zipfile.ZipFile(io.BytesIO(payload)) as zf:
+            zf.getinfo('word/document.xml')
+    except (zipfile.BadZipFile, KeyError) as e:
+        raise InvalidReport('不是合法的docx: {0}'.format(e))
+    try:
+        return tojson.to_dict(io.BytesIO(payload))
+    except etree.XMLSyntaxError as e:
+        raise InvalidReport('不是合法的docx: {0}'.format(e))
+
+
+def score(payload: bytes, is_json=False):
+    """
+    计算一份报告的bom, 在计算进程中执行
+    :param payload: docx文件内容, 或json报告
+    :param is_json: payload是否为json报告
+    :return: 全量bom
+    """
+    sha256 = None
+    if _cache is not None and not is_json:
+        sha256 = hashlib.sha256(payload).hexdigest()
+        cached = _cache.get(sha256)
+        if cached is not None:
+            return cached[1]
+    obj = load_report(payload, is_json)
+    if is_json:
+        return pboc.pboc_bom(obj)
+    obj_json = None if sha256 is None else serializer.dumps(obj)
+    bom = pboc.pboc_bom(obj)
+    if sha256 is not None:
+        _cache.put(sha256, obj_json, bom)
+    return bom
+
+
+class ServiceMetrics(object):
+    """请求计数及最近请求的耗时"""
+
+    def __init__(self, window=1000):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {'requests': 0, 'success': 0, 'failed': 0, 'rejected': 0, 'timeout': 0, 'invalid': 0,
+                       'broken': 0, 'restarts': 0}
+        self.in_flight = 0
+        self.latencies = deque(maxlen=window)
+
+    def incr(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def begin(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def end(self, key, seconds):
+        with self.lock:
+            self.counts[key] += 1
+            self.latencies.append(seconds)
+
+    def release(self):
+        """请求占用的名额释放: 超时的请求在计算真正结束后才释放"""
+        with self.lock:
+            self.in_flight -= 1
+
+    def to_dict(self, workers):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            rs = dict(self.counts, in_flight=self.in_flight, queued=max(0, self.in_flight - workers),
+                      uptime=round(time.time() - self.started, 3))
+        for q in (50, 95, 99):
+            rs['p{0}_ms'.format(q)] = round(latencies[int(q / 100. * (len(latencies) - 1))] * 1000, 3) \
+                if latencies else None
+        return rs
+
+
+class PBOCService(object):
+    """
+    计算进程池及并发控制: 最多workers个请求同时计算, 另有queue个请求排队, 其余请求直接拒绝
+    请求的名额在计算结束后才释放(超时的请求也是如此), 已超时但仍在计算的请求同样计入上限
+    计算进程异常退出(如内存不足被杀)后进程池不再可用, 发现时重建
+    """
+
+    def __init__(self, workers=2, queue=16, timeout=30., cache_dir=None, cache_size=1024):
+        self.workers = workers
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self.metrics = ServiceMetrics()
+        self.lock = threading.Lock()
+        self.executor = self._new_executor()
+
+    def _new_executor(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=(self.cache_dir, self.cache_size))
+        # 启动时即创建计算进程, 首个请求不必等待进程启动
+        for f in [executor.submit(int) for _ in range(self.workers)]:
+            f.result()
+        return executor
+
+    def _restart(self, broken):
+        """
+        重建不可用的进程池, 并发的请求只重建一次
+        :param broken: 不可用的进程池
+        """
+        with self.lock:
+            if self.executor is not broken:
+                return
+            logger.error('计算进程异常退出, 重建进程池')
+            self.metrics.incr('restarts')
+            broken.shutdown(wait=False, cancel_futures=True)
+            self.executor = self._new_executor()
+
+    def check(self):
+        """
+        进程池是否可用, 不可用时重建
+        :return: 检查时是否可用
+        """
+        executor = self.executor
+        try:
+            # 有计算进程异常退出后 submit 即抛出 BrokenProcessPool; 探测任务不等待执行, 直接取消
+            executor.submit(int).cancel()
+        except BrokenProcessPool:
+            self._restart(executor)
+            return False
+        return True
+
+    def bom(self, payload, is_json=False):
+        """
+        :return: (http状态码, 结果)
+        """
+        self.metrics.incr('requests')
+        if not self.slots.acquire(blocking=False):
+            self.metrics.incr('rejected')
+            return 503, {'error': '服务繁忙'}
+        start = time.perf_counter()
+        self.metrics.begin()
+        status = 'failed'
+        executor, future = self.executor, None
+        try:
+            future = executor.submit(score, payload, is_json)
+            rs = 200, future.result(timeout=self.timeout)
+            status = 'success'
+        except TimeoutError:
+            # 排队中的请求可以取消, 已开始的计算无法中止, 结束后才释放名额
+            future.cancel()
+            status = 'timeout'
+            rs = 504, {'error': '计算超时'}
+        except BrokenProcessPool:
+            logger.error(traceback.format_exc())
+            self._restart(executor)
+            status = 'broken'
+            rs = 503, {'error': '计算进程异常退出, 请重试'}
+        except InvalidReport as e:
+            status = 'invalid'
+            rs = 400, {'error': str(e)}
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            rs = 500, {'error': '{0}: {1}'.format(type(e).__name__, e)}
+        finally:
+            self.metrics.end(status, time.perf_counter() - start)
+            if future is None:
+                self._release()
+            else:
+                future.add_done_callback(lambda _: self._release())
+        return rs
+
+    def _release(self):
+        self.metrics.release()
+        self.slots.release()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None  # type: PBOCService
+    max_body = 20 * 1024 * 1024
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            if self.service.check():
+                self._reply(200, {'status': 'ok', 'workers': self.service.workers})
+            else:
+                self._reply(503, {'status': 'broken', 'workers': self.service.workers,
+                                  'error': '计算进程异常退出, 已重建进程池'})
+        elif path == '/metrics':
+            self._reply(200, self.service.metrics.to_dict(self.service.workers))
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/bom':
+            self._reply(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            self._reply(400, {'error': 'Content-Length 不是整数'})
+            return
+        if length <= 0:
+            self._reply(400, {'error': '请求体为空'})
+            return
+        if length > self.max_body:
+            self._reply(413, {'error': '请求体过大'})
+            return
+        payload = self.rfile.read(length)
+        is_json = self.headers.get('Content-Type', '').startswith('application/json')
+        code, rs = self.service.bom(payload, is_json)
+        if code == 200 and parse_qs(url.query).get('all', ['0'])[0] in ('0', ''):
+            rs = pboc.export_bom(rs)
+        self._reply(code, rs)
+
+    def _reply(self, code, obj):
+        body = serializer.dumps(obj)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        logger.info('{0} {1}'.format(self.address_string(), fmt % args))
+
+
+def serve(host='127.0.0.1', port=8086, workers=2, queue=16, timeout=30., max_body=20, cache_dir=None,
+          cache_size=1024):
+    service = PBOCService(workers, queue, timeout, cache_dir, cache_size)
+    handler = type('PBOCHandler', (Handler,), {'service': service, 'max_body': max_body * 1024 * 1024})
+    server = ThreadingHTTPServer((host, port), handler)
+    logger.info('listening on {0}:{1}, workers: {2}, queue: {3}'.format(host, port, workers, queue))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s.%(msecs)d][%(name)s][process:%(process)d][%(levelname)s]%(message)s',
+                        datefmt='%Y-%m-%d %H:%M:%S')
+    serve(args['--host'], int(args['--port']), int(args['--workers']), int(args['--queue']), float(args['--timeout']),
+          int(args['--max-body']), args['--cache-dir'], int(args['--cache-size']))
@@ -0,0 +1,103 @@
+# coding: utf-8
+
+"""
+result_cache.py
+
+按报告内容(sha256)缓存解析结果及bom, 同一份报告换名重新上传时不再重复解析
+缓存按代码版本区分, 解析或特征逻辑变化后旧的缓存自动失效; 超过容量时按最近访问时间淘汰
+"""
+
+import time
+import zlib
+import sqlite3
+import hashlib
+import inspect
+import logging
+
+try:
+    from . import serializer
+except ImportError:
+    import serializer
+
+logger = logging.getLogger(__name__)
+
+
+def code_version(*modules):
+    """
+    以模块源码的sha256作为版本号, 源码任何改动都会使缓存失效
+    :param modules: 如 tojson, pboc
+    :return:
+    """
+    h = hashlib.sha256()
+    for m in modules:
+        with open(inspect.getsourcefile(m), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+class ResultCache(object):
+    """
+    sqlite存储的LRU缓存, 值为(报告json, bom)
+    """
+
+    def __init__(self, db_file, version, max_bytes=1 << 30):
+        """
+        :param db_file:
+        :param version: 代码版本, 与当前版本不一致的缓存在打开时清除
+        :param max_bytes: 缓存内容(压缩后)的总大小上限
+        """
+        self.version = version
+        self.max_bytes = max_bytes
+        self.conn = sqlite3.connect(db_file, timeout=60)
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS results (sha256 TEXT, version TEXT, obj BLOB, bom BLOB, '
+                              'size INTEGER, accessed REAL, PRIMARY KEY (sha256, version))')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+            n = self.conn.execute('DELETE FROM results WHERE version != ?', (version,)).rowcount
+        if n > 0:
+            logger.info('清除旧版本缓存: {0}条'.format(n))
+
+    def get(self, sha256):
+        """
+        :param sha256: 报告文件的sha256
+        :return: (报告json(utf-8编码的bytes), bom), 未命中返回None
+        """
+        row = self.conn.execute('SELECT obj, bom FROM results WHERE sha256 = ? AND version = ?',
+                                (sha256, self.version)).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute('UPDATE results SET accessed = ? WHERE sha256 = ? AND version = ?',
+                              (time.time(), sha256, self.version))
+        return zlib.decompress(row[0]), serializer.loads(zlib.decompress(row[1]))
+
+    def put(self, sha256, obj_json, bom):
+        """
+        :param sha256: 报告文件的sha256
+        :param obj_json: 解析后的报告json(utf-8编码的bytes)
+        :param bom:
+        :return:
+        """
+        obj = zlib.compress(obj_json)
+        bom = zlib.compress(serializer.dumps(bom))
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)',
+                              (sha256, self.version, obj, bom, len(obj) + len(bom), time.time()))
+            self._evict()
+
+    def _evict(self):
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.conn.execute('SELECT sha256, version, size FROM results ORDER BY accessed').fetchall()
+        expired = []
+        for sha256, version, size in rows:
+            if total <= self.max_bytes:
+                break
+            expired.append((sha256, version))
+            total -= size
+        self.conn.executemany('DELETE FROM results WHERE sha256 = ? AND version = ?', expired)
+        logger.info('缓存超过上限, 淘汰{0}条'.format(len(expired)))
+
+    def close(self):
+        self.conn.close()
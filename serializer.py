@@ -0,0 +1,97 @@
+# coding: utf-8
+
+"""
+serializer.py
+
+报告及bom的json序列化. 安装了orjson时默认使用orjson, 否则使用标准库json;
+两者输出的内容一致, 只是orjson不输出多余的空格. 统一以utf-8编码的bytes读写
+
+    data = serializer.dumps(obj)
+    serializer.dump(obj, 'a.json')
+    serializer.use('json')  # 指定后端
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Backend(object):
+    """序列化后端: dumps(obj) -> bytes, loads(bytes|str) -> obj"""
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def __repr__(self):
+        return 'Backend({0!r})'.format(self.name)
+
+
+BACKENDS = {}
+
+
+def register(name, dumps, loads):
+    """
+    登记一个序列化后端
+    :param name:
+    :param dumps: dumps(obj) -> utf-8编码的bytes
+    :param loads: loads(bytes|str) -> obj
+    :return:
+    """
+    BACKENDS[name] = Backend(name, dumps, loads)
+    return BACKENDS[name]
+
+
+def _json_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+
+register('json', _json_dumps, json.loads)
+if orjson is not None:
+    # 与json一致, 允许非str的键
+    register('orjson', lambda obj: orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), orjson.loads)
+
+_backend = BACKENDS['orjson' if orjson is not None else 'json']
+
+
+def use(name):
+    """
+    指定当前进程使用的后端
+    :param name: json 或 orjson
+    :return: 之前使用的后端名
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError('未知的序列化后端: {0}, 可选: {1}'.format(name, ','.join(sorted(BACKENDS))))
+    previous, _backend = _backend.name, BACKENDS[name]
+    return previous
+
+
+def backend():
+    """当前使用的后端名"""
+    return _backend.name
+
+
+def dumps(obj) -> bytes:
+    return _backend.dumps(obj)
+
+
+def loads(data):
+    return _backend.loads(data)
+
+
+def dump(obj, json_file):
+    """写入json文件, 返回写入的字节数"""
+    data = _backend.dumps(obj)
+    with open(json_file, 'wb') as of:
+        of.write(data)
+    return len(data)
+
+
+def load(json_file):
+    with open(json_file, 'rb') as f:
+        return _backend.loads(f.read())
@@ -4,364 +4,491 @@
 tojson.py
 
 Usage:
-  tojson.py <word_file> [<json_file>]
+  tojson.py <word_file> [<json_file>] [--body-str]
   tojson.py -h | --help
   tojson.py --version
 
 Options:
   -h --help              Show this screen.
   --version              Show version.
+  --body-str             json中保留文字版报告(body_str)
 """
 
 import logging
 import sys
 import os
 import re
-import json
+import bisect
+import zipfile
 import traceback
 from datetime import datetime
 from typing import List, Dict
 
 from docopt import docopt
-from docx import table as dtable
-import docx
-import pandas as pd
+from lxml import etree
+
+try:
+    from . import instrument, serializer
+except ImportError:
+    import instrument
+    import serializer
 
 logger = logging.getLogger(__name__)
 
 
-class ReportInfo(object):
+class _Unset(object):
+    """未赋值字段的占位值, 布尔值为假"""
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'UNSET'
+
+
+UNSET = _Unset()
+
+# 需要继续展开的值的类型: 列表及各个记录类
+_NESTED = {list}
+
+
+class Record(object):
+    """
+    报告中的一条记录, 字段在 __slots__ 中声明, 顺序即输出dict的键顺序
+    未赋值的字段为 UNSET, 不输出到dict
+    """
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.__init__ = _compile(cls, _INIT_TEMPLATE, '__init__')
+        cls._to_dict = _compile(cls, _TO_DICT_TEMPLATE, 'to_dict')
+        _NESTED.add(cls)
+
+
+# 生成的函数按字段逐个读写 slot, 避免按字段名循环及未赋值字段的 AttributeError
+_INIT_TEMPLATE = ('def __init__(self):', '    self.{0} = _UNSET')
+# 值为记录或列表的字段以 (dict, 键) 压入 stack, 由 obj_to_dict 继续展开
+_TO_DICT_TEMPLATE = ('def to_dict(obj, stack):\n    rs = {}',
+                     '    v = obj.{0}\n'
+                     '    if v is not _UNSET:\n'
+                     '        rs[{0!r}] = v\n'
+                     '        if v.__class__ in _NESTED:\n'
+                     '            stack.append((rs, {0!r}))',
+                     '    return rs')
+
+
+def _compile(cls, template, name):
+    """
+    按模板为 cls 的每个字段生成一段代码
+    :param template: (函数头, 每个字段的代码, [函数尾])
+    :return: 生成的函数
+    """
+    lines = [template[0]] + [template[1].format(field) for field in cls.__slots__] + list(template[2:])
+    scope = {'_UNSET': UNSET, '_NESTED': _NESTED}
+    exec('\n'.join(lines), scope)
+    return scope[name]
+
+
+class ReportInfo(Record):
     """报告信息"""
-    report_number = None  # 报告编号
-    report_query_time = None  # 查询请求时间
-    report_create_time = None  # 报告时间
-    name = None  # 被查询者姓名
-    cert_type = None  # 被查询者证件类型
-    cert_no = None  # 被查询者证件号码
-    query_operator = None  # 查询操作员
-    query_reason = None  # 查询原因
+    __slots__ = (
+        'report_number',  # 报告编号
+        'report_query_time',  # 查询请求时间
+        'report_create_time',  # 报告时间
+        'name',  # 被查询者姓名
+        'cert_type',  # 被查询者证件类型
+        'cert_no',  # 被查询者证件号码
+        'query_operator',  # 查询操作员
+        'query_reason',  # 查询原因
+    )
 
 
-class MessageHeader(object):
-    queryTime = None
-    reportCreateTime = None
-    reportSN = None
+class MessageHeader(Record):
+    __slots__ = ('queryTime', 'reportCreateTime', 'reportSN')
 
 
-class QueryRequest(object):
-    name = None
-    certtype = None
-    certno = None
-    userCode = None
-    queryReason = None
-    # queryResultCue = None
-    # queryOrg = None
-    # productType = None
-    # formatVersion = None
-    # format = None
+class QueryRequest(Record):
+    __slots__ = ('name', 'certtype', 'certno', 'userCode', 'queryReason')
+    # queryResultCue
+    # queryOrg
+    # productType
+    # formatVersion
+    # format
 
 
-class Header(object):
-    messageHeader = None
-    queryReq = None
+class Header(Record):
+    __slots__ = ('messageHeader', 'queryReq')
 
 
-class Identity(object):
+class Identity(Record):
     """ 身份信息 """
-    gender = None
-    birthday = None
-    maritalState = None
-    mobile = None
-    officeTelephoneNo = None
-    homeTelephoneNo = None
-    eduLevel = None
-    eduDegree = None
-    postAddress = None
-    registeredAddress = None
-
-
-class Residence(object):
+    __slots__ = ('gender', 'birthday', 'maritalState', 'mobile', 'officeTelephoneNo', 'homeTelephoneNo', 'eduLevel',
+                 'eduDegree', 'postAddress', 'registeredAddress')
+
+
+class Residence(Record):
     """ 居住信息"""
-    getTime = None
-    residenceType = None
-    address = None
+    __slots__ = ('getTime', 'address', 'residenceType')
 
 
-class Spouse(object):
+class Spouse(Record):
     """配偶信息"""
-    certType = None
-    certNo = None
-    employer = None
-    telephoneNo = None
-    name = None
+    __slots__ = ('name', 'certType', 'certNo', 'employer', 'telephoneNo')
 
 
-class Professional(object):
+class Professional(Record):
     """ 职业信息"""
-    getTime = None
-    employer = None
-    employerAddress = None
-    occupation = None
-    industry = None
-    duty = None
-    startYear = None
-    title = None
+    __slots__ = ('employer', 'employerAddress', 'occupation', 'industry', 'duty', 'title', 'startYear', 'getTime')
 
 
-class PersonalBasicInfo(object):
-    identity = None
-    residence = None
-    spouse = None
-    professional = None
+class PersonalBasicInfo(Record):
+    __slots__ = ('identity', 'residence', 'spouse', 'professional')
 
 
-class CreditCue(object):
+class CreditCue(Record):
     """信用提示"""
-    otherLoanCount = None
-    firstLoanOpenMonth = None
-    loanCardCount = None
-    firstLoanCardOpenMonth = None
-    standardLoanCardCount = None
-    firstStandardLoanCardOpenMonth = None
-    announceCount = None
-    dissentCount = None
-    perHouseLoanCount = None
-    perBusinessHouseLoanCount = None
-
-
-class FellBackSummary(object):
-    fellBackDebtSumCount = None
-    fellBackDebtSumBalance = None
-    assetDispositionSumCount = None
-    assetDispositionSumBalance = None
-    assureerRepaySumCount = None
-    assureerRepaySumBalance = None
-
-
-class OverdueSummary(object):
-    loanSumHighestOverdueAmountPerMon = None
-    loanSumMaxDuration = None
-    loanSumMonths = None
-    loanSumCount = None
-    loanCardSumHighestOverdueAmountPerMon = None
-    loanCardSumMaxDuration = None
-    loanCardSumMonths = None
-    loanCardSumCount = None
-    standardLoanCardSumHighestOverdueAmountPerMon = None
-    standardLoanCardSumMaxDuration = None
-    standardLoanCardSumMonths = None
-    standardLoanCardSumCount = None
-
-
-class OverdueAndFellBack(object):
-    fellBackSummary = None
-    overdueSummary = None
-
-
-class ShareAndDebtCommon(object):
-    balance = None
-    latest6MonthUsedAvgAmount = None
-    financeCorpCount = None
-    financeOrgCount = None
-    accountCount = None
-    creditLimit = None
-    maxCreditLimitPerOrg = None
-    minCreditLimitPerOrg = None
-    usedCreditLimit = None
-
-
-class ShareAndDebt(object):
-    unPaidLoan = None
-    unDestroyLoanCard = None
-    unDestroyStandardLoanCard = None
-
-
-class SummaryInfo(object):
-    creditCue = CreditCue()
-    overdueAndFellBack = OverdueAndFellBack()
-    shareAndDebt = ShareAndDebt()
-
-
-class OverdueRecordDetail(object):
-    lastMonths = None
-    amount = None
-    month = None
-
-
-class OverdueRecord(object):
-    overdueRecordDetail = None
-    dates = None
-    # specials = None
-
-
-class SpecialRecord(object):
-    tradeType = None
-    date = None
-    changeMonths = None
-    amount = None
-    detail = None
-
-
-class Loan(object):
-    statements = None
-    state = None
-    class5State = None
-    balance = None
-    remainPaymentCyc = None
-    scheduledPaymentAmount = None
-    scheduledPaymentDate = None
-    actualPaymentAmount = None
-    recentPayDate = None
-    currOverdueCyc = None
-    currOverdueAmount = None
-    overdue31To60Amount = None
-    overdue61To90Amount = None
-    overdue91To180Amount = None
-    overdueOver180Amount = None
-    latest24State = None
-    latest24Date = None
-    settle = False
-    overdueRecord = None
-    specials = None
-
-
-class LoanCard(object):
-    statements = None
-    state = None
-    usedCreditLimitAmount = None
-    latest6MonthUsedAvgAmount = None
-    usedHighestAmount = None
-    scheduledPaymentAmount = None
-    scheduledPaymentDate = None
-    actualPaymentAmount = None
-    recentPayDate = None
-    currOverdueCyc = None
-    currOverdueAmount = None
-    latest24State = None
-    latest24Date = None
-    overdueRecord = None
-
-
-class AssurerRepay(object):
-    org = None
-    recentAssurerRepayDate = None
-    accumulativeAssurerRepayAmount = None
-    recentRepayDate = None
-    balance = None
-
-
-class Guarantee(object):
-    organname = None
-    contractMoney = None
-    beginDate = None
-    endDate = None
-    guananteeMoney = None
-    guaranteeBalance = None
-    class5State = None
-    billingDate = None
-
-
-class GuaranteeInfo(object):
-    guaranteeFormat = None
-    guarantee = None
-
-
-class CreditDetail(object):
-    assurerRepay = None
-    loan = None
-    loanCard = None
-    standardLoanCard = None
-    guaranteeInfo = None
-
-
-class QueryRecordDetail(object):
-    queryReason = None
-    queryDate = None
-    querier = None
-
-
-class QueryRecordSummary(object):
-    latestMonthQueryorgSumLoanApproval = None
-    latestMonthQueryorgSumLoanCardApproval = None
-    latestMonthQueryRecordSumLoanApproval = None
-    latestMonthQueryRecordSumLoanCardApproval = None
-    latestMonthQueryRecordSumPersonal = None
-    twoYearQueryRecordSumCollection = None
-    twoYearQueryRecordSumGuarantee = None
-    twoYearQueryRecordSumSpecial = None
-
-
-class QueryRecord(object):
-    recordSummary = None
-    recordInfo = None
-
-
-class AccFund(object):
-    area = None
-    registerDate = None
-    firstMonth = None
-    toMonth = None
-    state = None
-    pay = None
-    ownPercent = None
-    comPercent = None
-    organname = None
-    getTime = None
-
-
-class PublicInfo(object):
-    accFund = None
-
-
-class PBOCEntity(object):
-    body_str = None
-    header = ReportInfo()
-    personalInfo = PersonalBasicInfo()
-    creditDetail = CreditDetail()
-    queryRecord = None
+    __slots__ = ('perHouseLoanCount', 'perBusinessHouseLoanCount', 'otherLoanCount', 'firstLoanOpenMonth',
+                 'loanCardCount', 'firstLoanCardOpenMonth', 'standardLoanCardCount', 'firstStandardLoanCardOpenMonth',
+                 'announceCount', 'dissentCount')
+
+
+class FellBackSummary(Record):
+    __slots__ = ('fellBackDebtSumCount', 'fellBackDebtSumBalance', 'assetDispositionSumCount',
+                 'assetDispositionSumBalance', 'assureerRepaySumCount', 'assureerRepaySumBalance')
+
+
+class OverdueSummary(Record):
+    __slots__ = ('loanSumCount', 'loanSumMonths', 'loanSumHighestOverdueAmountPerMon', 'loanSumMaxDuration',
+                 'loanCardSumCount', 'loanCardSumMonths', 'loanCardSumHighestOverdueAmountPerMon',
+                 'loanCardSumMaxDuration', 'standardLoanCardSumCount', 'standardLoanCardSumMonths',
+                 'standardLoanCardSumHighestOverdueAmountPerMon', 'standardLoanCardSumMaxDuration')
+
+
+class OverdueAndFellBack(Record):
+    __slots__ = ('fellBackSummary', 'overdueSummary')
+
+
+class ShareAndDebtCommon(Record):
+    __slots__ = ('financeCorpCount', 'financeOrgCount', 'accountCount', 'creditLimit', 'balance',
+                 'maxCreditLimitPerOrg', 'minCreditLimitPerOrg', 'usedCreditLimit', 'latest6MonthUsedAvgAmount')
+
+
+class ShareAndDebt(Record):
+    __slots__ = ('unPaidLoan', 'unDestroyLoanCard', 'unDestroyStandardLoanCard')
+
+
+class SummaryInfo(Record):
+    __slots__ = ('creditCue', 'overdueAndFellBack', 'shareAndDebt')
+
+
+class OverdueRecordDetail(Record):
+    __slots__ = ('month', 'lastMonths', 'amount')
+
+
+class OverdueRecord(Record):
+    __slots__ = ('overdueRecordDetail', 'dates')
+
+
+class SpecialRecord(Record):
+    __slots__ = ('tradeType', 'date', 'changeMonths', 'amount', 'detail')
+
 
+class Loan(Record):
+    __slots__ = ('statements', 'state', 'class5State', 'balance', 'remainPaymentCyc', 'scheduledPaymentAmount',
+                 'scheduledPaymentDate', 'actualPaymentAmount', 'recentPayDate', 'currOverdueCyc', 'currOverdueAmount',
+                 'overdue31To60Amount', 'overdue61To90Amount', 'overdue91To180Amount', 'overdueOver180Amount',
+                 'latest24Date', 'latest24State', 'settle', 'overdueRecord', 'specials')
 
+
+class LoanCard(Record):
+    """贷记卡及准贷记卡, due180pAmount 仅准贷记卡有"""
+    __slots__ = ('statements', 'state', 'usedCreditLimitAmount', 'latest6MonthUsedAvgAmount', 'usedHighestAmount',
+                 'scheduledPaymentAmount', 'scheduledPaymentDate', 'actualPaymentAmount', 'recentPayDate',
+                 'currOverdueCyc', 'currOverdueAmount', 'due180pAmount', 'latest24Date', 'latest24State',
+                 'overdueRecord', 'specials')
+
+
+class AssurerRepay(Record):
+    __slots__ = ('org', 'accumulativeAssurerRepayAmount', 'recentAssurerRepayDate', 'recentRepayDate', 'balance')
+
+
+class Guarantee(Record):
+    __slots__ = ('organname', 'contractMoney', 'beginDate', 'endDate', 'guananteeMoney', 'guaranteeBalance',
+                 'class5State', 'billingDate')
+
+
+class GuaranteeInfo(Record):
+    __slots__ = ('guarantee', 'guaranteeFormat')
+
+
+class CreditDetail(Record):
+    __slots__ = ('assurerRepay', 'guaranteeInfo', 'loan', 'loanCard', 'standardLoanCard')
+
+
+class QueryRecordDetail(Record):
+    __slots__ = ('queryDate', 'querier', 'queryReason')
+
+
+class QueryRecordSummary(Record):
+    __slots__ = ('latestMonthQueryorgSumLoanApproval', 'latestMonthQueryorgSumLoanCardApproval',
+                 'latestMonthQueryRecordSumLoanApproval', 'latestMonthQueryRecordSumLoanCardApproval',
+                 'latestMonthQueryRecordSumPersonal', 'twoYearQueryRecordSumCollection',
+                 'twoYearQueryRecordSumGuarantee', 'twoYearQueryRecordSumSpecial')
+
+
+class QueryRecord(Record):
+    __slots__ = ('recordSummary', 'recordInfo')
+
+
+class AccFund(Record):
+    __slots__ = ('area', 'registerDate', 'firstMonth', 'toMonth', 'state', 'pay', 'ownPercent', 'comPercent',
+                 'organname', 'getTime')
+
+
+class PublicInfo(Record):
+    __slots__ = ('accFund',)
+
+
+# 报告的各章节, to_dict 的结果总是包含
+REPORT_SECTIONS = ('header', 'personalInfo', 'summary_info', 'creditDetail', 'publicInfo', 'queryRecord')
+
+
+class PBOCEntity(Record):
+    __slots__ = ('body_str', 'keyword_hits') + REPORT_SECTIONS
+
+
+@instrument.stage()
 def obj_to_dict(obj):
-    if isinstance(obj, list):
-        return [obj_to_dict(o) for o in obj]
-    elif not isinstance(obj, dict) and not isinstance(obj, int) and not isinstance(obj, str) and obj is not None:
-        obj = obj.__dict__
-        for k in obj:
-            obj[k] = obj_to_dict(obj[k])
-        return obj
-    else:
+    """
+    记录转为dict, 列表逐项转换, 其余值原样保留
+    用栈代替递归, 逾期记录很多的报告不会加深调用栈
+    """
+    if obj.__class__ not in _NESTED:
         return obj
+    root = [obj]
+    stack = [(root, 0)]
+    while stack:
+        container, key = stack.pop()
+        value = container[key]
+        if value.__class__ is list:
+            value = container[key] = list(value)
+            for ii, v in enumerate(value):
+                if v.__class__ is list:
+                    stack.append((value, ii))
+                elif v.__class__ in _NESTED:
+                    value[ii] = v._to_dict(stack)
+        else:
+            container[key] = value._to_dict(stack)
+    return root[0]
+
+
+class Table(object):
+    """
+    报告中的数据表,只提供read_*函数用到的DataFrame接口(shape/index/columns/iloc/iterrows)
+    每行为定长tuple,不足的列补None
+    """
+    __slots__ = ('rows', 'shape')
+
+    def __init__(self, rows):
+        width = max(map(len, rows)) if rows else 0
+        self.rows = tuple(tuple(r) if len(r) == width else tuple(r) + (None,) * (width - len(r)) for r in rows)
+        self.shape = (len(self.rows), width)
+
+    @property
+    def index(self):
+        return range(self.shape[0])
+
+    @property
+    def columns(self):
+        return range(self.shape[1])
+
+    @property
+    def iloc(self):
+        return _TableILoc(self.rows)
+
+    def iterrows(self):
+        return enumerate(self.rows)
 
+    def __len__(self):
+        return self.shape[0]
 
-def prefix_word(document: docx.Document) -> list:
+    def __eq__(self, other):
+        return isinstance(other, Table) and self.rows == other.rows
+
+    def __hash__(self):
+        return hash(self.rows)
+
+    def __repr__(self):
+        return 'Table({0})'.format(list(self.rows))
+
+
+class _TableILoc(object):
+    """Table.iloc, 支持iloc[row]及iloc[row, col]"""
+    __slots__ = ('rows',)
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self.rows[key[0]][key[1]]
+        return self.rows[key]
+
+
+@instrument.stage()
+def prefix_word(word_file) -> list:
     """
-    将docx解析的报告格式转为list[str|DataFrame]格式,其中描述转为str,数据转为DataFrame
-    :param document:
+    将docx解析的报告格式转为list[str|Table]格式,其中描述转为str,数据转为Table
+    :param word_file: docx文件路径或文件对象
     :return:
     """
-    body = read_tables(document)
+    body = []
+    for item in iter_body(word_file):
+        body.append(item if isinstance(item, str) else Table(item))
     return body
 
 
-def table2dataFrame(table: dtable.Table) -> pd.DataFrame:
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_BODY = W_NS + 'body'
+_W_TBL = W_NS + 'tbl'
+_W_TR = W_NS + 'tr'
+_W_TC = W_NS + 'tc'
+_W_P = W_NS + 'p'
+_W_R = W_NS + 'r'
+_W_HYPERLINK = W_NS + 'hyperlink'
+_W_T = W_NS + 't'
+_W_TC_PR = W_NS + 'tcPr'
+_W_TR_PR = W_NS + 'trPr'
+_W_GRID_SPAN = W_NS + 'gridSpan'
+_W_GRID_BEFORE = W_NS + 'gridBefore'
+_W_V_MERGE = W_NS + 'vMerge'
+_W_TBL_GRID = W_NS + 'tblGrid'
+_W_VAL = W_NS + 'val'
+_W_TYPE = W_NS + 'type'
+_RUN_CHARS = {W_NS + 'tab': '\t', W_NS + 'ptab': '\t', W_NS + 'cr': '\n', W_NS + 'noBreakHyphen': '-'}
+
+
+def iter_body(word_file):
+    """
+    单次流式读取word/document.xml中的所有table并做简单处理(替代python-docx逐个cell的读取方式)
+    描述返回str,嵌套的数据表返回[[str|None]]格式的行列表,连续重复的内容(合并单元格)只返回一次
+    :param word_file: docx文件路径或文件对象
+    :return:
+    """
+    last = None
+    with zipfile.ZipFile(word_file) as zf, zf.open('word/document.xml') as xml:
+        for _, tbl in etree.iterparse(xml, events=('end',), tag=_W_TBL):
+            parent = tbl.getparent()
+            if parent is None or parent.tag != _W_BODY:  # 嵌套表格在外层表格结束时处理
+                continue
+            for tc in _table_cells(tbl):
+                inner = [e for e in tc if e.tag == _W_TBL]
+                if len(inner) == 0:
+                    item = _cell_text(tc).strip()
+                    key = item
+                else:
+                    assert len(inner) == 1
+                    item = _table_rows(inner[0])  # 转化为行列表
+                    key = hash(tuple(map(tuple, item)))
+                if key == last:  # 重复内容或重复table
+                    continue
+                last = key
+                yield item
+            # 释放已处理的节点
+            tbl.clear()
+            while tbl.getprevious() is not None:
+                del parent[0]
+
+
+def _table_cells(tbl) -> list:
+    """
+    与python-docx的Table._cells一致: 按行展开所有单元格,横向合并的单元格重复出现,纵向合并的单元格引用上方单元格
+    """
+    grid = tbl.find(_W_TBL_GRID)
+    col_count = len(grid) if grid is not None else 0
+    cells = []
+    for tr in tbl.iterchildren(_W_TR):
+        for tc in tr.iterchildren(_W_TC):
+            span, v_merge = _tc_span_merge(tc)
+            for ii in range(span):
+                if v_merge == 'continue':
+                    cells.append(cells[-col_count])
+                elif ii > 0:
+                    cells.append(cells[-1])
+                else:
+                    cells.append(tc)
+    return cells
+
+
+def _table_rows(tbl) -> list:
     """
-    Table转DataFrame
+    嵌套table转为行列表,与python-docx的_Row.cells一致
     Table中的cell必须不包含Table
-    :param table:
+    :param tbl:
     :return:
     """
-    lst = []
-    for ii, row in enumerate(table.rows):
-        row_lst = []
-        for jj, cell in enumerate(row.cells):
-            if len(cell.tables) == 0:
-                v = re.sub('(^[\n ]*)|([\n ]*$)', '', cell.text)  # 去除特殊字符
-                row_lst.append(None if v == '' else v)
+    rows = []
+    above = {}  # 上一行 grid offset -> 单元格值
+    for tr in tbl.iterchildren(_W_TR):
+        tr_pr = tr.find(_W_TR_PR)
+        grid_before = tr_pr.find(_W_GRID_BEFORE) if tr_pr is not None else None
+        offset = int(grid_before.get(_W_VAL, 0)) if grid_before is not None else 0
+        row_lst, current = [], {}
+        for tc in tr.iterchildren(_W_TC):
+            span, v_merge = _tc_span_merge(tc)
+            if v_merge == 'continue' and offset in above:
+                v = above[offset]
             else:
-                raise ValueError("cell value contain tables")
+                if tc.find(_W_TBL) is not None:
+                    raise ValueError("cell value contain tables")
+                v = _cell_text(tc).strip('\n ')  # 去除特殊字符
+                v = None if v == '' else v
+            current[offset] = v
+            row_lst.extend([v] * span)
+            offset += span
+        above = current
         if not check_df_row(row_lst):
-            lst.append(row_lst)
-    return pd.DataFrame(lst)
+            rows.append(row_lst)
+    return rows
+
+
+def _tc_span_merge(tc):
+    tc_pr = tc.find(_W_TC_PR)
+    if tc_pr is None:
+        return 1, None
+    grid_span = tc_pr.find(_W_GRID_SPAN)
+    v_merge = tc_pr.find(_W_V_MERGE)
+    span = int(grid_span.get(_W_VAL)) if grid_span is not None else 1
+    return span, (v_merge.get(_W_VAL, 'continue') if v_merge is not None else None)
+
+
+def _cell_text(tc) -> str:
+    """单元格文字,段落之间以换行分隔"""
+    return '\n'.join(_paragraph_text(p) for p in tc.iterchildren(_W_P))
+
+
+def _paragraph_text(p) -> str:
+    texts = []
+    for e in p:
+        if e.tag == _W_R:
+            _run_text(e, texts)
+        elif e.tag == _W_HYPERLINK:
+            for r in e.iterchildren(_W_R):
+                _run_text(r, texts)
+    return ''.join(texts)
+
+
+def _run_text(r, texts):
+    for e in r:
+        tag = e.tag
+        if tag == _W_T:
+            texts.append(e.text or '')
+        elif tag in _RUN_CHARS:
+            texts.append(_RUN_CHARS[tag])
+        elif tag == W_NS + 'br' and e.get(_W_TYPE, 'textWrapping') == 'textWrapping':
+            texts.append('\n')
 
 
 def check_df_row(row: list) -> bool:
@@ -376,48 +503,7 @@ def check_df_row(row: list) -> bool:
     return True
 
 
-def check_df(df: str, value: str):
-    """简单判断两个df是否数据一致"""
-    # if not isinstance(value, pd.DataFrame):
-    #     return False
-    # elif df.shape != value.shape:
-    #     return False
-    # else:
-    #     l = list(value[list(df.columns)[-1]])
-    #     r = list(df[list(df.columns)[-1]])
-    #     for x, y in zip(l, r):
-    #         if x != y:
-    #             return False
-    # return True
-    return df == value
-
-
-def read_tables(document):
-    """
-    读取所有的table并做简单处理
-    :param document:
-    :return:
-    """
-    body = []
-    value = None
-    for table in document.tables:
-        for ii, cell in enumerate(table._cells):
-            if len(cell.tables) == 0:
-                if isinstance(value, str) and cell.text.strip() == value:  # 重复内容
-                    continue
-                body.append(cell.text.strip())
-                value = cell.text.strip()
-            else:
-                assert len(cell.tables) == 1
-                df = table2dataFrame(cell.tables[0])  # 转化为DataFrame
-                df_str = str(df)
-                if check_df(df_str, value):  # 重复table
-                    continue
-                body.append(df)
-                value = df_str
-    return body
-
-
+@instrument.stage()
 def read_report_info(body):
     """
     报告基本信息
@@ -458,14 +544,14 @@ def read_report_info(body):
     return header
 
 
-def find_values_from_df_by_group_tags(df: pd.DataFrame, group_tags: List[List[str]]) -> List[dict]:
+def find_values_from_df_by_group_tags(df: Table, group_tags: List[List[str]]) -> List[dict]:
     """
-    根据标签组给的的标签,从DataFrame中查找到标签对应的值并返回
+    根据标签组给的的标签,从Table中查找到标签对应的值并返回
     注意:
-    1.DataFrame格式必须为[标题+数据]循环模式
+    1.Table格式必须为[标题+数据]循环模式
     Example
     --
-    >>> df1 = pd.DataFrame([['name', 'age', 'gender'], ['smith', 15, 'male']])
+    >>> df1 = Table([['name', 'age', 'gender'], ['smith', 15, 'male']])
     >>> group_tags1 = [['name', 'age']]
     >>> find_values_from_df_by_group_tags(df1, group_tags1)
     '[{\'name\': \'smith\', \'age\': 15}]'
@@ -481,7 +567,7 @@ def find_values_from_df_by_group_tags(df: pd.DataFrame, group_tags: List[List[st
         if not find_title:  # 打标记,当行为标题时,记录标题及类别
             for jj, g in enumerate(group_tags):
                 for kk, e in enumerate(row):
-                    if pd.isnull(e):
+                    if e is None:
                         continue
                     if g[kk] in e:
                         find_title = True
@@ -506,6 +592,8 @@ def find_values_from_df_by_group_tags(df: pd.DataFrame, group_tags: List[List[st
 
 
 def get_body_by_flag(body, start_flag, end_flag=None):
+    if isinstance(body, SectionIndex):
+        return body.section(start_flag, end_flag)
     rs = []
     start, end = False, False
     for b in body:
@@ -523,18 +611,116 @@ def get_body_by_flag(body, start_flag, end_flag=None):
 
 
 def get_single_body_by_flag(body, flag):
+    if isinstance(body, SectionIndex):
+        return body.single(flag)
     find = False
     for b in body:
         if isinstance(b, str) and flag in b:
             find = True
             continue
-        if find and isinstance(b, pd.DataFrame):
+        if find and isinstance(b, Table):
             return b
         elif find and isinstance(b, str) and b.strip() != '':
             return
     return
 
 
+# 报告中的章节标题,建立索引时一次性定位
+SECTION_FLAGS = [
+    '个人基本信息', '身份信息', '配偶信息', '居住信息', '职业信息',
+    '信息概要', '信用提示', '逾期及违约信息概要', '逾期（透支）信息汇总', '未结清贷款信息汇总', '未销户贷记卡信息汇总',
+    '未销户准贷记卡信息汇总',
+    '信贷交易信息明细', '）保证人代偿信息', '对外贷款担保信息', '贷款', '贷记卡', '）贷记卡', '）准贷记卡',
+    '公共信息明细', '四 公共信息明细', '住房公积金参缴记录',
+    '五 查询记录', '查询记录汇总', '信贷审批查询记录明细', '报告说明',
+]
+# 每份报告都应包含的章节
+REQUIRED_SECTION_FLAGS = ['个人基本信息', '信息概要', '信贷交易信息明细', '四 公共信息明细', '五 查询记录', '查询记录汇总',
+                          '信贷审批查询记录明细']
+
+
+class SectionIndex(object):
+    """
+    报告内容的章节索引
+    一次遍历记录所有章节标题的位置,get_body_by_flag/get_single_body_by_flag直接按位置切片,不再重复扫描整个报告
+    结果与在list上调用get_body_by_flag/get_single_body_by_flag一致(空字符串不计入)
+    """
+    __slots__ = ('items', 'positions', 'lo', 'hi')
+
+    @instrument.stage()
+    def __init__(self, body, flags=None):
+        self.items = [b for b in body if not (isinstance(b, str) and b == '')]
+        self.positions = {flag: [] for flag in (SECTION_FLAGS if flags is None else flags)}
+        for ii, b in enumerate(self.items):
+            if not isinstance(b, str):
+                continue
+            for flag, pos in self.positions.items():
+                if flag in b:
+                    pos.append(ii)
+        self.lo, self.hi = 0, len(self.items)
+
+    def _view(self, lo, hi):
+        view = object.__new__(SectionIndex)
+        view.items, view.positions, view.lo, view.hi = self.items, self.positions, lo, hi
+        return view
+
+    def _positions(self, flag):
+        pos = self.positions.get(flag)
+        if pos is None:  # 未预先索引的标题,首次使用时补充
+            pos = [ii for ii, b in enumerate(self.items) if isinstance(b, str) and flag in b]
+            self.positions[flag] = pos
+        return pos
+
+    def _iter_positions(self, flag, lo=None):
+        pos = self._positions(flag)
+        for ii in range(bisect.bisect_left(pos, self.lo if lo is None else lo), len(pos)):
+            if pos[ii] >= self.hi:
+                return
+            yield pos[ii]
+
+    def section(self, start_flag, end_flag=None):
+        """
+        从包含start_flag的内容开始,到包含end_flag(且不包含start_flag)的内容为止
+        end_flag先于start_flag出现时返回空
+        """
+        start = next(self._iter_positions(start_flag), None)
+        if start is None:
+            return self._view(self.lo, self.lo)
+        end = self.hi
+        if end_flag is not None:
+            for ii in self._iter_positions(end_flag):
+                if start_flag in self.items[ii]:
+                    continue
+                if ii < start:
+                    return self._view(self.lo, self.lo)
+                end = ii
+                break
+        return self._view(start, end)
+
+    def single(self, flag):
+        """标题flag之后紧跟的Table,中间出现其他描述时返回None"""
+        ii = next(self._iter_positions(flag), None)
+        if ii is None:
+            return
+        ii += 1
+        while ii < self.hi and isinstance(self.items[ii], str) and flag in self.items[ii]:
+            ii += 1
+        if ii < self.hi and isinstance(self.items[ii], Table):
+            return self.items[ii]
+        return
+
+    def missing(self, flags=None):
+        """缺失的章节"""
+        return [flag for flag in (REQUIRED_SECTION_FLAGS if flags is None else flags)
+                if next(self._iter_positions(flag), None) is None]
+
+    def __iter__(self):
+        return iter(self.items[self.lo:self.hi])
+
+    def __len__(self):
+        return self.hi - self.lo
+
+
 def read_identity(df):
     """
     身份信息
@@ -585,14 +771,13 @@ def read_residence(df):
         raise ValueError("居住信息数据有误或结构调整,请确认")
     residence_lst = []
     mapping = {'编号': 'no', '居住地址': 'address', '居住状况': 'status', '信息更新日期': 'update_date'}
-    df.columns = [mapping.get(v, v) for v in df.iloc[0]]
-    df = df.drop([0], axis=0)
-    df.set_index(['no'], inplace=True)
-    for row in df.iterrows():
+    columns = [mapping.get(v, v) for v in df.iloc[0]]
+    for row in df.rows[1:]:
+        row = dict(zip(columns, row))
         r = Residence()
-        r.getTime = row[1]['update_date']
-        r.address = row[1]['address']
-        r.residenceType = row[1]['status']
+        r.getTime = row['update_date']
+        r.address = row['address']
+        r.residenceType = row['status']
         residence_lst.append(r)
     return residence_lst
 
@@ -665,6 +850,7 @@ def read_professional(body):
     return professional_lst
 
 
+@instrument.stage()
 def read_personal_basic_info(body):
     """
     :param body:
@@ -820,6 +1006,7 @@ def read_share_and_debt(body):
     return share_and_debt
 
 
+@instrument.stage()
 def read_summary_info(body):
     summary_info = SummaryInfo()
     summary_info_body = get_body_by_flag(body, '信息概要', '信贷交易信息明细')
@@ -832,6 +1019,7 @@ def read_summary_info(body):
     return summary_info
 
 
+@instrument.stage()
 def read_assurer_repay(body):
     """
     0,1,2,3,4,5
@@ -861,6 +1049,7 @@ def read_assurer_repay(body):
     return rs
 
 
+@instrument.stage()
 def read_guarantee_info(body):
     guarantee_info = GuaranteeInfo()
     guarantee_info.guarantee = []
@@ -886,6 +1075,7 @@ def read_guarantee_info(body):
         return {}
 
 
+@instrument.stage()
 def read_loan(body):
     """
     账户状态	五级分类	本金余额	剩余还款期数	本月应还款 	应还款日 	本月实还款 	最近一次还款日期
@@ -919,7 +1109,7 @@ def read_loan(body):
             loan = Loan()
             loan.statements = ln
             loan_lst.append(loan)
-        elif isinstance(ln, pd.DataFrame) and find:
+        elif isinstance(ln, Table) and find:
             find = False
             if len(ln.index) == 0:
                 continue
@@ -979,7 +1169,7 @@ def read_loan(body):
                     detail.month = row[0 * gap]
                     detail.lastMonths = row[1 * gap]
                     detail.amount = row[2 * gap]
-                    if loan.overdueRecord is not None and isinstance(loan.overdueRecord.overdueRecordDetail, list):
+                    if loan.overdueRecord and isinstance(loan.overdueRecord.overdueRecordDetail, list):
                         loan.overdueRecord.overdueRecordDetail.append(detail)
                     else:
                         loan.overdueRecord = OverdueRecord()
@@ -1007,13 +1197,14 @@ def read_loan(body):
                     special.changeMonths = row[2 * gap]
                     special.amount = row[3 * gap]
                     special.detail = row[4 * gap]
-                    if loan.specials is not None:
+                    if loan.specials:
                         loan.specials.append(special)
                     else:
                         loan.specials = [special]
     return loan_lst
 
 
+@instrument.stage()
 def read_loan_card(loan_card_body_lst):
     """
     账户状态	已用额度	最近6个月平均使用额度	最大使用额度	本月应还款
@@ -1043,7 +1234,7 @@ def read_loan_card(loan_card_body_lst):
             loan = LoanCard()
             loan.statements = lc
             loan_card_lst.append(loan)
-        elif isinstance(lc, pd.DataFrame) and find:
+        elif isinstance(lc, Table) and find:
             find = False
             if len(lc.index) == 0:
                 continue
@@ -1099,7 +1290,7 @@ def read_loan_card(loan_card_body_lst):
                     detail.month = row[0 * gap]
                     detail.lastMonths = row[1 * gap]
                     detail.amount = row[2 * gap]
-                    if loan.overdueRecord is not None and isinstance(loan.overdueRecord.overdueRecordDetail, list):
+                    if loan.overdueRecord and isinstance(loan.overdueRecord.overdueRecordDetail, list):
                         loan.overdueRecord.overdueRecordDetail.append(detail)
                     else:
                         loan.overdueRecord = OverdueRecord()
@@ -1124,13 +1315,14 @@ def read_loan_card(loan_card_body_lst):
                     special.changeMonths = row[2 * gap]
                     special.amount = row[3 * gap]
                     special.detail = row[4 * gap]
-                    if loan.specials is not None:
+                    if loan.specials:
                         loan.specials.append(special)
                     else:
                         loan.specials = [special]
     return loan_card_lst
 
 
+@instrument.stage()
 def read_standard_loan_card(loan_card_body_lst):
     loan_card_lst = []
     find = False
@@ -1145,7 +1337,7 @@ def read_standard_loan_card(loan_card_body_lst):
             loan = LoanCard()
             loan.statements = lc
             loan_card_lst.append(loan)
-        elif isinstance(lc, pd.DataFrame) and find:
+        elif isinstance(lc, Table) and find:
             find = False
             if len(lc.index) == 0:
                 continue
@@ -1185,7 +1377,7 @@ def read_standard_loan_card(loan_card_body_lst):
                     detail.month = lc.iloc[ii, 0 * gap]
                     detail.lastMonths = lc.iloc[ii, 1 * gap]
                     detail.amount = lc.iloc[ii, 2 * gap]
-                    if loan.overdueRecord is not None and isinstance(loan.overdueRecord.overdueRecordDetail, list):
+                    if loan.overdueRecord and isinstance(loan.overdueRecord.overdueRecordDetail, list):
                         loan.overdueRecord.overdueRecordDetail.append(detail)
                     else:
                         loan.overdueRecord = OverdueRecord()
@@ -1203,13 +1395,19 @@ def read_standard_loan_card(loan_card_body_lst):
                     special.changeMonths = row[2 * gap]
                     special.amount = row[3 * gap]
                     special.detail = row[4 * gap]
-                    if loan.specials is not None:
+                    if loan.specials:
                         loan.specials.append(special)
                     else:
                         loan.specials = [special]
     return loan_card_lst
 
 
+def _credit_detail_rows(credit_detail, *args):
+    """贷款、贷记卡、准贷记卡的账户数"""
+    return sum(len(getattr(credit_detail, k) or ()) for k in ('loan', 'loanCard', 'standardLoanCard'))
+
+
+@instrument.stage(rows=_credit_detail_rows)
 def read_credit_detail(body):
     """
     信贷交易信息明细
@@ -1266,6 +1464,7 @@ def read_acc_fund(body):
     return acc_fund_lst
 
 
+@instrument.stage()
 def read_public_info(body):
     public_info = PublicInfo()
     public_info_body = get_body_by_flag(body, '四 公共信息明细', '五 查询记录')
@@ -1307,6 +1506,7 @@ def read_query_record_summary(body):
     return record_summary
 
 
+@instrument.stage()
 def read_query_record(body):
     query_record = QueryRecord()
     query_record_body = get_body_by_flag(body, '五 查询记录', '报告说明')
@@ -1318,13 +1518,26 @@ def read_query_record(body):
     return query_record
 
 
-def to_json(word_file, json_file):
-    document = docx.Document(word_file)
-    body = prefix_word(document)
+@instrument.stage()
+def to_dict(word_file, body_str=False):
+    """
+    解析word报告,直接返回dict格式的报告,不落地json文件
+    :param word_file:
+    :param body_str: 是否保留文字版报告, 规则只使用关键词索引 keyword_hits
+    :return:
+    """
+    body = prefix_word(word_file)
     obj = PBOCEntity()
-    obj.body_str = str(body).replace('\n', '')  # 提供文字版报告
+    text = body_text(body)
+    if body_str:
+        obj.body_str = text  # 提供文字版报告
+    obj.keyword_hits = keyword_hits(text)
     # 报告基本信息
     obj.header = read_report_info(body)
+    body = SectionIndex(body)
+    missing = body.missing()
+    if len(missing) != 0:
+        logger.warning('缺少章节: {0} {1}'.format(word_file, ','.join(missing)))
     # 个人基本信息
     obj.personalInfo = read_personal_basic_info(body)
     # 信息概要
@@ -1336,9 +1549,67 @@ def to_json(word_file, json_file):
     # 查询记录
     obj.queryRecord = read_query_record(body)
 
-    with open(json_file, 'w', encoding='utf-8') as of:
-        obj = obj_to_dict(obj)
-        json.dump(obj, of, ensure_ascii=False)
+    return obj_to_dict(obj)
+
+
+@instrument.stage()
+def body_text(body):
+    """
+    文字版报告: 描述原样输出, 数据表逐行输出, 单元格之间以制表符分隔
+    :param body: prefix_word 的结果
+    :return:
+    """
+    lines = []
+    for item in body:
+        if isinstance(item, str):
+            lines.append(item)
+        else:
+            lines.extend('\t'.join(filter(None, row)) for row in item.rows)
+    return '\n'.join(lines)
+
+
+# 需要统计出现次数的关键词, pboc_negative_black_001 使用
+KEYWORDS = ('呆账', '核销', '冻结', '止付', '担保人代偿', '保证人代偿', '以资抵债')
+
+
+class KeywordIndex(object):
+    """
+    多个关键词的出现次数: 关键词编译为一个正则, 文本只扫描一遍
+    """
+
+    def __init__(self, keywords=KEYWORDS):
+        self.keywords = tuple(keywords)
+        # 同一位置优先匹配较长的关键词
+        self.pattern = re.compile('|'.join(map(re.escape, sorted(self.keywords, key=len, reverse=True))))
+
+    def count(self, text):
+        """
+        :return: {关键词: 出现次数}, 包含未出现的关键词
+        """
+        hits = dict.fromkeys(self.keywords, 0)
+        for m in self.pattern.finditer(text):
+            hits[m.group()] += 1
+        return hits
+
+
+_keyword_index = KeywordIndex()
+
+
+@instrument.stage()
+def keyword_hits(text):
+    """文字版报告中 KEYWORDS 的出现次数"""
+    return _keyword_index.count(text)
+
+
+def dump_json(obj, json_file):
+    """dict格式的报告写入json文件"""
+    serializer.dump(obj, json_file)
+
+
+def to_json(word_file, json_file, body_str=False):
+    obj = to_dict(word_file, body_str)
+    dump_json(obj, json_file)
+    return obj
 
 
 def logger_(log_file_name=None, name=__name__, stdout_on=True):
@@ -1385,7 +1656,6 @@ if __name__ == '__main__':
     try:
         args = docopt(__doc__)
         print(args)
-        is_extract = args['extract']
 
         log_file = os.path.join(log_dir, 'word2json_{0}.log'.format(now_str))
         logger = logger_(log_file, name='tojson')
@@ -1393,7 +1663,7 @@ if __name__ == '__main__':
         json_file = args['<json_file>']
         if json_file is None:
             json_file = '{0}.json'.format(word_file)
-        to_json(word_file, json_file)
+        to_json(word_file, json_file, args['--body-str'])
 
     except Exception as e:
         logger.error(traceback.format_exc())